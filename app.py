@@ -1,35 +1,118 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, g, jsonify, render_template, request, Response, url_for
 from flask_cors import CORS
 from pathlib import Path
+import hmac
 import os
+import random
+import time
+import uuid
 from dotenv import load_dotenv
 
-from openai import OpenAI
+from openai import RateLimitError
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI client
-# Ensure your OPENAI_API_KEY is set in your .env file
-client = OpenAI()
-
 # Assuming your utility functions are in the 'utils' directory
 # and prompts are in the 'prompts' directory, relative to this script.
 # Adjust these imports if your project structure is different.
 from utils import (
-    get_categories, choose_random_problem, 
+    get_categories, choose_random_problem, choose_problem_for_query,
     get_question_response, text_to_speech, 
-    evaluate_answer, handle_followup_question,
-    answer_feedback_tool # Assuming this is still needed or adapted
+    evaluate_answer, evaluate_answers_batch, handle_followup_question,
+    start_followup_conversation, ConversationStore,
+    answer_feedback_tool, # Assuming this is still needed or adapted
+    batch_answer_feedback_tool, preload_feedback_sounds
+)
+from utils.deck_registry import get_registry
+from utils.deck_media import resolve_media, iter_media
+from utils import metrics, model_router, admission
+from utils.admission import Overloaded
+from utils.http_cache import body_bytes, cache_content_addressed, compress_response
+from utils.user_shards import get_shards, is_valid_user_id
+from utils.profiling import profiled
+from utils.verdict_cache import get_verdict_cache
+from utils.conversation import is_undetermined
+from utils.openai_client import get_client
+from utils import warmup
+from utils.warmup import PrerenderedProblems, Warmup, popular_categories
+from utils.speech_to_text import RATE, get_streaming_transcriber
+from utils.saved_queries import list_saved_queries, get_saved_query, save_query, delete_saved_query
+from prompts.prompts import (
+    system_prompt, question_prompt_template, textual_question_prompt_template, evaluation_prompt, followup_prompt,
+    followup_conversation_prompt, batch_evaluation_prompt, batch_evaluation_item_template
 )
-from prompts.prompts import system_prompt, question_prompt_template, evaluation_prompt, followup_prompt
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Profile-Id"])
+
+# Every .apkg in DECKS_DIR (project root by default), loaded and hot-reloaded by start_background_work
+deck_registry = get_registry(load=False)
+
+# Questions rendered by the warm-up for the most studied categories, served to the first students
+prerendered_problems = PrerenderedProblems()
+
+# Number of related cards given to the model as context for follow-up questions
+RELATED_CARDS_K = 3
+
+# Admin endpoints need this token in an X-Admin-Token header; without one they only answer localhost
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Multi-turn follow-up conversations, one per card a student asks about
+followup_conversations = ConversationStore()
+
+# Cookie identifying a student; each student's state lives in their own shard
+USER_COOKIE = "rt_anki_user"
+USER_COOKIE_MAX_AGE = 365 * 24 * 3600
+user_shards = get_shards()
+
+def current_user_id():
+    """Get the id of the student making the request, assigning a new one if they have none."""
+    user_id = request.cookies.get(USER_COOKIE)
+    if is_valid_user_id(user_id):
+        return user_id
+    if 'new_user_id' not in g:
+        g.new_user_id = uuid.uuid4().hex
+    return g.new_user_id
+
+@app.after_request
+def remember_user(response):
+    """Set the cookie of a student who was just given an id."""
+    if 'new_user_id' in g:
+        response.set_cookie(USER_COOKIE, g.new_user_id, max_age=USER_COOKIE_MAX_AGE,
+                            httponly=True, samesite='Lax')
+    return response
+
+@app.after_request
+def cache_and_compress(response):
+    """Mark content-addressed audio immutable, gzip JSON and count the bytes sent."""
+    if request.endpoint == 'static':
+        cache_content_addressed(response, (request.view_args or {}).get('filename', ''))
+    uncompressed_bytes = body_bytes(response)
+    compress_response(response, request.accept_encodings)
+    metrics.record_transfer(request.endpoint or "unknown", response.status_code,
+                            uncompressed_bytes, body_bytes(response))
+    return response
+
+def is_admin_request():
+    """Whether the request may use admin endpoints: it carries ADMIN_TOKEN, or comes from localhost when no token is set."""
+    if ADMIN_TOKEN:
+        token = request.headers.get("X-Admin-Token", "")
+        return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+def overloaded_response(error):
+    """Build the 503 response telling the client when to retry an overloaded request."""
+    print(f"Overloaded: {error}")
+    response = jsonify({"error": "The server is busy, please retry shortly", "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
 
-# Ensure the anki package path is correct
-# This might need to be configurable or determined differently in a server environment
-APKG_PATH = Path(__file__).parent / "MCAT_Milesdown.apkg"
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    """Turn API calls rejected by admission control (or rate limited upstream) into 503s."""
+    return overloaded_response(error)
 
 @app.route('/')
 def index():
@@ -38,74 +121,213 @@ def index():
 
 @app.route('/api/categories', methods=['GET'])
 def api_get_categories():
-    """API endpoint to get available categories."""
+    """
+    API endpoint to get available categories.
+
+    The ETag is the deck registry version, so browsers revalidate and get a 304 until a
+    deck is added, reloaded or removed.
+    """
     try:
-        # Check if APKG file exists - this check is implicitly handled by get_categories_from_apkg
-        # if not APKG_PATH.exists():
-        #     return jsonify({"error": f"Anki package file not found at {APKG_PATH}"}), 500
-        
+        version = deck_registry.version
         categories = get_categories() # get_categories from choose_random_problem does not take path
-        return jsonify(categories)
+        response = jsonify(categories)
+        response.set_etag(f"categories-{version}")
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         # Log the exception e for debugging
         print(f"Error in /api/categories: {e}")
         return jsonify({"error": "Failed to retrieve categories"}), 500
 
+@app.route('/api/deck_tree', methods=['GET'])
+def api_get_deck_tree():
+    """
+    API endpoint to get the deck hierarchy with full paths, ids and new/due/total card counts.
+
+    Cached per registry version like /api/categories. A node's counts include its
+    sub-decks, and selecting its path as a category includes their cards.
+    """
+    version = deck_registry.version
+    response = jsonify(deck_registry.deck_tree())
+    response.set_etag(f"deck-tree-{version}")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/decks', methods=['GET'])
+def api_get_decks():
+    """API endpoint reporting the loaded decks with reload time and memory per deck."""
+    return jsonify(deck_registry.stats())
+
+def media_urls(deck_key, names):
+    """Build media endpoint URLs for a card's referenced media files."""
+    return [url_for('api_get_media', deck_key=deck_key, filename=name) for name in names]
+
+@app.route('/api/media/<deck_key>/<path:filename>', methods=['GET'])
+def api_get_media(deck_key, filename):
+    """
+    API endpoint streaming a media file straight out of a deck's .apkg.
+
+    Supports ETag revalidation (304), and single-range requests (206) for media stored
+    uncompressed. Compressed media is always sent whole, since reaching a range would
+    mean inflating everything before it.
+    """
+    deck_index = deck_registry.get(deck_key)
+    member = resolve_media(deck_index, filename) if deck_index is not None else None
+    if member is None:
+        return jsonify({"error": "Media file not found"}), 404
+
+    headers = {
+        "ETag": member.etag,
+        "Accept-Ranges": "bytes" if member.seekable else "none",
+        "Cache-Control": "public, max-age=86400",
+    }
+    if member.etag.strip('"') in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    start, stop, status = 0, member.file_size, 200
+    if_range = request.headers.get("If-Range")
+    if member.seekable and request.range is not None and (not if_range or if_range == member.etag):
+        byte_range = request.range.range_for_length(member.file_size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{member.file_size}"
+            return Response(status=416, headers=headers)
+        start, stop = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{member.file_size}"
+
+    if stop is not None:  # Unknown for zstd media whose size the package doesn't list
+        headers["Content-Length"] = str(stop - start)
+    return Response(
+        iter_media(deck_index.apkg_path, member, start, stop),
+        status=status,
+        headers=headers,
+        mimetype=member.mimetype,
+        direct_passthrough=True,
+    )
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """API endpoint returning ranked card ids matching a full-text query, with counts per deck."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing query parameter 'q'"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 1000))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    start = time.perf_counter()
+    result = deck_registry.search(query, limit=limit)
+    result["query"] = query
+    result["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return jsonify(result)
+
+@app.route('/api/saved_queries', methods=['GET', 'POST'])
+def api_saved_queries():
+    """API endpoint to list saved study-set queries, or save one with {"name", "query"}."""
+    if request.method == 'POST':
+        data = request.get_json()
+        if not data or not data.get('name') or not data.get('query'):
+            return jsonify({"error": "Missing name or query"}), 400
+        save_query(data['name'], data['query'])
+    return jsonify(list_saved_queries())
+
+@app.route('/api/saved_queries/<name>', methods=['DELETE'])
+def api_delete_saved_query(name):
+    """API endpoint to delete a saved query."""
+    if not delete_saved_query(name):
+        return jsonify({"error": f"No saved query named: {name}"}), 404
+    return jsonify(list_saved_queries())
+
 @app.route('/api/start_problem', methods=['POST'])
+@profiled
 def api_start_problem():
-    """API endpoint to start a new problem."""
+    """
+    API endpoint to start a new problem.
+
+    With "textual_only": true, cards that can't be answered without seeing a picture are skipped.
+    """
     data = request.get_json()
-    if not data or 'categories' not in data or not data['categories']:
+    if not data:
         return jsonify({"error": "No categories selected"}), 400
-    
-    selected_categories = data['categories']
-    # For now, let's just pick the first selected category
-    # The original UI implies multiple category selection for choosing *from*, 
-    # but choose_random_problem takes one deck/category.
-    # We might need to adjust choose_random_problem or how we select one category from the list.
-    # For simplicity, we take the first one.
-    if not selected_categories:
-         return jsonify({"error": "Categories list is empty after filtering."}), 400
-
-    # The `get_categories()` function from `choose_random_problem.py` returns only sub-deck names.
-    # The `choose_random_problem` function expects one of these sub-deck names.
-    # So, we can randomly pick one from the user's selection if they picked multiple.
-    import random
-    chosen_category_for_problem = random.choice(selected_categories)
 
-    try:
-        problem = choose_random_problem(apkg_path=str(APKG_PATH), deck=chosen_category_for_problem)
-        if problem is None:
-            return jsonify({"error": f"No problems found in category: {chosen_category_for_problem}"}), 404
-        
-        question = problem['question']
-        answer = problem['answer']
-        
-        # Commenting out the app.current_problem_data assignment as it's not the preferred way
-        # app.current_problem_data = {'question': question, 'answer': answer}
+    # A session can be scoped by a search query (or a saved one) instead of by categories
+    query = data.get('query')
+    if data.get('saved_query'):
+        query = get_saved_query(data['saved_query'])
+        if query is None:
+            return jsonify({"error": f"No saved query named: {data['saved_query']}"}), 404
 
-        formatted_question = get_question_response(question, answer, question_prompt_template)
-        audio_path = text_to_speech(formatted_question) # This now returns a web path
+    if not query and ('categories' not in data or not data['categories']):
+        return jsonify({"error": "No categories selected"}), 400
+    
+    try:
+        if query:
+            problem = choose_problem_for_query(query, textual_only=bool(data.get('textual_only')))
+            if problem is None:
+                return jsonify({"error": f"No problems match the query: {query}"}), 404
+        else:
+            # The UI allows selecting several categories to choose *from*, but
+            # choose_random_problem takes one deck/category, so pick one at random.
+            chosen_category_for_problem = random.choice(data['categories'])
+            rendered = prerendered_problems.take(chosen_category_for_problem, deck_registry.version,
+                                                 bool(data.get('textual_only')))
+            if rendered is not None:
+                return jsonify(rendered)
+            problem = choose_random_problem(deck=chosen_category_for_problem,
+                                            textual_only=bool(data.get('textual_only')))
+            if problem is None:
+                return jsonify({"error": f"No problems found in category: {chosen_category_for_problem}"}), 404
         
-        return jsonify({
-            "formatted_question": formatted_question,
-            "audio_path": audio_path,
-            "original_question": question, # Sending original question for later evaluation
-            "original_answer": answer # Sending original answer for later evaluation
-        })
+        return jsonify(render_problem(problem))
     except FileNotFoundError as e:
         print(f"Error in /api/start_problem (FileNotFound): {e}")
         return jsonify({"error": str(e)}), 500
     except ValueError as e:
         print(f"Error in /api/start_problem (ValueError): {e}")
         return jsonify({"error": str(e)}), 400
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error in /api/start_problem: {e}")
         # import traceback
         # traceback.print_exc()
         return jsonify({"error": "Failed to start problem"}), 500
 
+def render_problem(problem):
+    """
+    Format a chosen problem's question and synthesize its speech.
+
+    Args:
+        problem (dict): A problem from choose_random_problem or choose_problem_for_query
+
+    Returns:
+        dict: The /api/start_problem response
+    """
+    question = problem['question']
+    answer = problem['answer']
+    
+    # Commenting out the app.current_problem_data assignment as it's not the preferred way
+    # app.current_problem_data = {'question': question, 'answer': answer}
+
+    formatted_question = get_question_response(question, answer, question_prompt_template,
+                                               problem['visual'], textual_question_prompt_template)
+    audio_path = text_to_speech(formatted_question) # This now returns a web path
+    
+    return {
+        "formatted_question": formatted_question,
+        "audio_path": audio_path,
+        "original_question": question, # Sending original question for later evaluation
+        "original_answer": answer, # Sending original answer for later evaluation
+        "deck": problem['deck'],
+        "card_id": problem['card_id'],
+        "media": media_urls(problem['deck'], problem['media']),
+        "answer_media": media_urls(problem['deck'], problem['answer_media']),
+        "visual": problem['visual']
+    }
+
 @app.route('/api/transcribe_audio', methods=['POST'])
+@profiled
 def api_transcribe_audio():
     """API endpoint to transcribe uploaded audio file."""
     if 'audio_data' not in request.files:
@@ -128,12 +350,20 @@ def api_transcribe_audio():
             # The OpenAI client expects the file to be passed as a tuple (filename, file_data)
             # where file_data is bytes.
             # We need to give it a name, even if it's generic.
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1", 
-                file=(audio_file_storage.filename or "audio.webm", audio_bytes),
-                response_format="text"
-            )
+            with admission.get_controller("transcribe").slot():
+                start = time.perf_counter()
+                try:
+                    transcription = get_client().audio.transcriptions.create(
+                        model=model_router.UPLOAD_TRANSCRIBE_MODEL,
+                        file=(audio_file_storage.filename or "audio.webm", audio_bytes),
+                        response_format="text"
+                    )
+                except RateLimitError as e:
+                    raise Overloaded(f"Transcription API rate limit reached: {e}", admission.rate_limit_retry_after(e))
+            model_router.observe("transcribe", model_router.UPLOAD_TRANSCRIBE_MODEL, time.perf_counter() - start)
             return jsonify({"transcript": transcription})
+        except Overloaded as e:
+            return overloaded_response(e)
         except Exception as e:
             print(f"Error during transcription: {e}")
             # import traceback
@@ -142,7 +372,70 @@ def api_transcribe_audio():
     
     return jsonify({"error": "File processing error"}), 500
 
+@app.route('/api/speech_streams', methods=['POST'])
+def api_open_speech_stream():
+    """
+    API endpoint opening a realtime transcription stream.
+
+    The client posts its audio to /api/speech_streams/<stream_id>/audio as it records, and
+    the server sends it on to the realtime API right away, so the transcript is usually
+    ready soon after /api/speech_streams/<stream_id>/finish is called.
+    """
+    stream_id = get_streaming_transcriber().open()
+    return jsonify({"stream_id": stream_id, "format": "pcm16", "sample_rate": RATE, "channels": 1}), 201
+
+@app.route('/api/speech_streams/<stream_id>/audio', methods=['POST'])
+def api_push_speech_audio(stream_id):
+    """API endpoint adding a chunk of 16 kHz 16-bit mono PCM, sent as the raw request body, to a stream."""
+    frame = request.get_data()
+    if len(frame) % 2:
+        return jsonify({"error": "Audio must be 16-bit PCM"}), 400
+    if not get_streaming_transcriber().push(stream_id, frame):
+        return jsonify({"error": f"No speech stream: {stream_id}"}), 404
+    return "", 204
+
+@app.route('/api/speech_streams/<stream_id>/finish', methods=['POST'])
+def api_finish_speech_stream(stream_id):
+    """API endpoint ending a stream's audio and returning its transcript."""
+    transcript = get_streaming_transcriber().finish(stream_id)
+    if transcript is None:
+        return jsonify({"error": f"No speech stream: {stream_id}"}), 404
+    return jsonify({"transcript": transcript})
+
+def card_category(deck_key, card_id):
+    """Get a card's category (its full deck name), or None if the card isn't loaded."""
+    deck_index = deck_registry.get(deck_key)
+    card = deck_index.cards.get(card_id) if deck_index is not None else None
+    if card is None:
+        return None
+    return deck_index.decks[card['deck_id']]
+
+def card_key(deck_key, card_id):
+    """Get the key a card's verdicts are cached under, or None if the card isn't loaded."""
+    if card_category(deck_key, card_id) is None:
+        return None
+    return f"{deck_key}:{card_id}"
+
+def record_attempt(deck_key, card_id, feedback, response_ms=None):
+    """
+    Reschedule the card and add the answer to the student's review log, if it is for a known card.
+
+    Undetermined verdicts (the model gave none) aren't recorded, so they don't count as lapses.
+    """
+    if not isinstance(feedback, dict) or 'is_correct' not in feedback or is_undetermined(feedback):
+        return
+    category = card_category(deck_key, card_id)
+    if category is None:
+        return
+    try:
+        response_ms = float(response_ms) if response_ms is not None else None
+        with user_shards.open(current_user_id()) as shard:
+            shard.record_review(deck_key, card_id, category, feedback['is_correct'], response_ms)
+    except (TypeError, ValueError, OSError) as e:
+        print(f"Error recording review attempt: {e}")
+
 @app.route('/api/evaluate_answer', methods=['POST'])
+@profiled
 def api_evaluate_answer():
     """API endpoint to evaluate the user's answer."""
     data = request.get_json()
@@ -163,18 +456,152 @@ def api_evaluate_answer():
             user_answer=user_answer, 
             correct_answer=original_answer,
             evaluation_prompt=evaluation_prompt,
-            answer_feedback_tool=answer_feedback_tool
+            answer_feedback_tool=answer_feedback_tool,
+            card_key=card_key(data.get('deck'), data.get('card_id'))
         )
         
         # feedback is expected to be a dictionary, e.g., {"is_correct": True/False, "explanation": "..."}
+        record_attempt(data.get('deck'), data.get('card_id'), feedback, data.get('response_ms'))
         return jsonify(feedback)
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error in /api/evaluate_answer: {e}")
         # import traceback
         # traceback.print_exc()
         return jsonify({"error": "Failed to evaluate answer"}), 500
 
+# Largest run of cards accepted by one rapid-fire evaluation
+MAX_RAPID_FIRE_ITEMS = 50
+
+@app.route('/api/rapid_fire/evaluate', methods=['POST'])
+def api_rapid_fire_evaluate():
+    """
+    API endpoint to evaluate a run of rapid-fire answers in one batched request.
+
+    Expects {"items": [{"original_question", "original_answer", "user_answer"}, ...]} and
+    returns per-card verdicts in the same order, plus a report on the whole batch.
+    """
+    data = request.get_json()
+    items = data.get('items') if data else None
+    if not items or not isinstance(items, list):
+        return jsonify({"error": "Missing items for evaluation"}), 400
+    if len(items) > MAX_RAPID_FIRE_ITEMS:
+        return jsonify({"error": f"At most {MAX_RAPID_FIRE_ITEMS} items can be evaluated at once"}), 400
+    if any(not isinstance(item, dict) or 'original_question' not in item or
+           'original_answer' not in item or 'user_answer' not in item for item in items):
+        return jsonify({"error": "Missing data for evaluation"}), 400
+
+    try:
+        results, report = evaluate_answers_batch(
+            [{"question": item['original_question'], "answer": item['original_answer'],
+              "user_answer": item['user_answer'], "card_key": card_key(item.get('deck'), item.get('card_id'))}
+             for item in items],
+            batch_evaluation_prompt,
+            batch_evaluation_item_template,
+            batch_answer_feedback_tool,
+            evaluation_prompt=evaluation_prompt,
+            answer_feedback_tool=answer_feedback_tool,
+            measure_baseline=bool(data.get('measure_baseline'))
+        )
+        for item, result in zip(items, results):
+            record_attempt(item.get('deck'), item.get('card_id'), result, item.get('response_ms'))
+        return jsonify({"results": results, "report": report})
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error in /api/rapid_fire/evaluate: {e}")
+        return jsonify({"error": "Failed to evaluate answers"}), 500
+
+# Days of history /api/stats covers by default, and the most it will cover
+STATS_DAYS = 30
+MAX_STATS_DAYS = 365
+
+@app.route('/api/stats', methods=['GET'])
+def api_get_stats():
+    """
+    API endpoint reporting study statistics from the student's review log.
+
+    Returns accuracy, median response time, the current correct streak and the weakest
+    cards per category, plus accuracy and response time per day for the last `days` days.
+    """
+    try:
+        days = min(int(request.args.get('days', STATS_DAYS)), MAX_STATS_DAYS)
+        weakest = int(request.args.get('weakest', 5))
+    except ValueError:
+        return jsonify({"error": "days and weakest must be integers"}), 400
+    with user_shards.open(current_user_id()) as shard:
+        stats = shard.review_log.stats(days=max(1, days), weakest=max(0, weakest))
+    for category in stats["categories"].values():
+        for card in category["weakest_cards"]:
+            deck_index = deck_registry.get(card["deck"])
+            loaded = deck_index.cards.get(card["card_id"]) if deck_index is not None else None
+            card["question"] = loaded["question"] if loaded else None
+    return jsonify(stats)
+
+@app.route('/api/profile', methods=['GET'])
+def api_get_profile():
+    """API endpoint reporting the student's id, profile and numbers of cards seen and due."""
+    user_id = current_user_id()
+    with user_shards.open(user_id) as shard:
+        summary = shard.summary()
+    return jsonify({"user_id": user_id, **summary})
+
+@app.route('/api/metrics', methods=['GET'])
+def api_get_metrics():
+    """API endpoint reporting latency and token usage per API call type."""
+    return jsonify(metrics.summary())
+
+@app.route('/api/metrics/routing', methods=['GET'])
+def api_get_routing_metrics():
+    """API endpoint reporting p50/p95 latency per model and the routing decisions per call type."""
+    return jsonify(model_router.summary())
+
+@app.route('/api/metrics/admission', methods=['GET'])
+def api_get_admission_metrics():
+    """API endpoint reporting admitted, queued and rejected API calls per upstream API."""
+    return jsonify(admission.stats())
+
+@app.route('/api/metrics/shards', methods=['GET'])
+def api_get_shard_metrics():
+    """API endpoint reporting open per-user shards and how many were opened and closed."""
+    return jsonify(user_shards.stats())
+
+@app.route('/api/metrics/verdict_cache', methods=['GET'])
+def api_get_verdict_cache_metrics():
+    """API endpoint reporting the verdict cache's hits per tier, misses and hit rate."""
+    return jsonify(get_verdict_cache().stats())
+
+@app.route('/api/verdict_cache/<deck_key>/<int:card_id>', methods=['DELETE'])
+def api_invalidate_verdicts(deck_key, card_id):
+    """
+    API endpoint dropping a card's cached verdicts.
+
+    Verdicts are already ignored once the card's question or answer changes; this is
+    for forcing a card to be evaluated afresh, e.g. after changing how it should be graded.
+    The cache is shared by every student, so only admins (see is_admin_request) may drop entries.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({"dropped": get_verdict_cache().invalidate(f"{deck_key}:{card_id}")})
+
+@app.route('/api/metrics/prompt_savings', methods=['GET'])
+def api_get_prompt_savings_metrics():
+    """API endpoint reporting the prompt tokens saved by formatting textual cards with a short prompt or none."""
+    return jsonify(metrics.prompt_savings_summary())
+
+@app.route('/api/metrics/speech_streams', methods=['GET'])
+def api_get_speech_stream_metrics():
+    """API endpoint reporting open realtime transcription streams and how many were opened, finished and rejected."""
+    return jsonify(get_streaming_transcriber().stats())
+
+@app.route('/api/metrics/transfer', methods=['GET'])
+def api_get_transfer_metrics():
+    """API endpoint reporting response bytes sent per endpoint, before and after compression."""
+    return jsonify(metrics.transfer_summary())
+
 @app.route('/api/follow_up', methods=['POST'])
+@profiled
 def api_follow_up():
     """API endpoint to handle a follow-up question."""
     data = request.get_json()
@@ -187,26 +614,137 @@ def api_follow_up():
     follow_up_question_text = data['follow_up_question']
 
     try:
-        # Ensure followup_prompt is imported from prompts.prompts
+        # Continue the card's follow-up conversation, or start one on the first follow-up
+        conversation_id = data.get('conversation_id')
+        conversation = followup_conversations.get(conversation_id) if conversation_id else None
+        if conversation is None:
+            # Give the model a few sibling cards as context when we know which card this is
+            related_cards = []
+            deck_index = deck_registry.get(data.get('deck'))
+            if deck_index is not None and data.get('card_id') is not None:
+                related_cards = deck_index.related_cards(
+                    data['card_id'],
+                    f"{original_question} {original_answer} {follow_up_question_text}",
+                    k=RELATED_CARDS_K
+                )
+            conversation = start_followup_conversation(
+                original_question, original_answer, followup_conversation_prompt, related_cards
+            )
+            conversation_id = followup_conversations.create(conversation)
+
+        # Ensure followup_conversation_prompt is imported from prompts.prompts
         followup_response_text = handle_followup_question(
             question=original_question,
             correct_answer=original_answer,
             followup=follow_up_question_text,
-            followup_prompt=followup_prompt
+            followup_prompt=followup_prompt,
+            conversation=conversation
         )
         
         audio_path = text_to_speech(followup_response_text)
         
         return jsonify({
             "follow_up_response": followup_response_text,
-            "audio_path": audio_path
+            "audio_path": audio_path,
+            "conversation_id": conversation_id
         })
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error in /api/follow_up: {e}")
         # import traceback
         # traceback.print_exc()
         return jsonify({"error": "Failed to get follow-up response"}), 500
 
+def load_decks():
+    """Warm-up step: load (or rebuild) every deck index, then start hot-reloading."""
+    deck_registry.load_all()
+    deck_registry.start_watching()
+    return {"decks": len(deck_registry.decks()), "cards": sum(len(index.cards) for index in deck_registry.decks().values())}
+
+def compile_templates():
+    """Warm-up step: compile the page template so the first page view doesn't."""
+    with app.app_context():
+        app.jinja_env.get_template('index.html')
+    return {"templates": 1}
+
+def open_connections():
+    """
+    Warm-up step: create the shared OpenAI client and open its connection pool.
+
+    A models request costs no tokens but resolves DNS and does the TLS handshake;
+    the connection then stays in the client's keep-alive pool.
+    """
+    start = time.perf_counter()
+    get_client().models.list()
+    return {"connect_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+def open_caches():
+    """Warm-up step: open the verdict cache's database."""
+    return {"verdicts": get_verdict_cache().stats()["disk_entries"]}
+
+def prerender_problems():
+    """Warm-up step: render the first questions of the most studied categories, at background priority."""
+    rendered = 0
+    with admission.background():
+        for category in popular_categories(deck_registry.deck_tree()):
+            for _ in range(warmup.WARMUP_QUESTIONS):
+                version = deck_registry.version
+                problem = choose_random_problem(deck=category)
+                if problem is None:
+                    break
+                prerendered_problems.add(category, version, render_problem(problem))
+                rendered += 1
+    return {"questions": rendered}
+
+def preload_sounds():
+    """Warm-up step: decode the feedback sounds into the audio player."""
+    return {"preloaded": preload_feedback_sounds()}
+
+# Startup warm-up; /readyz answers 503 until it is done
+startup = Warmup()
+if warmup.WARMUP:
+    startup.add("decks", load_decks, required=True)
+    startup.add("templates", compile_templates)
+    startup.add("caches", open_caches)
+    startup.add("connections", open_connections)
+    startup.add("sounds", preload_sounds)
+    startup.add("questions", prerender_problems)
+
+def start_background_work():
+    """
+    Load the decks and start hot-reloading them, or start the warm-up, which does both.
+
+    With warm-up enabled the decks are loaded by the warm-up thread instead of before serving.
+    """
+    if warmup.WARMUP:
+        startup.start()
+    else:
+        deck_registry.load_all()
+        deck_registry.start_watching()
+
+# The debug reloader runs this script in a parent process that only watches the source
+# files and serves from a child (with WERKZEUG_RUN_MAIN set), so only the child starts them
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN"):
+    start_background_work()
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up. Reports the warm-up's progress."""
+    return jsonify({"status": "ok", "warmup": startup.progress(),
+                    "prerendered": prerendered_problems.stats()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once the warm-up is done, 503 (with its progress) until then."""
+    progress = startup.progress()
+    response = jsonify(progress)
+    if not progress["ready"]:
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+    response.cache_control.no_store = True
+    return response
+
 if __name__ == '__main__':
     # Create static/audio directory if it doesn't exist
     static_audio_dir = Path(__file__).parent / "static" / "audio"
@@ -1,29 +1,185 @@
+import argparse
+import contextlib
 import os
 from pathlib import Path
 import sys
-from prompts.prompts import system_prompt, question_prompt_template, evaluation_prompt, followup_prompt
+from prompts.prompts import (
+    system_prompt, question_prompt_template, textual_question_prompt_template, evaluation_prompt, followup_prompt,
+    followup_conversation_prompt, batch_evaluation_prompt, batch_evaluation_item_template
+)
 from utils import (
     get_categories, choose_random_problem, 
     get_question_response, text_to_speech, 
-    evaluate_answer, handle_followup_question,
-    answer_feedback_tool, play_sound
+    evaluate_answer, evaluate_answers_batch, handle_followup_question, start_followup_conversation,
+    answer_feedback_tool, batch_answer_feedback_tool, play_sound, play_feedback_sound, preload_feedback_sounds
 )
+from utils import metrics, speculation, speech_to_text
+from utils.conversation import cached_check_answer, is_undetermined, UNDETERMINED_VERDICT
 from utils.speech_to_text import get_speech_input
+from utils.speculation import SpeculativeEvaluator
+from utils.deck_registry import get_registry
+from utils.play_sound import start_sound
+from utils.user_shards import get_shards, LOCAL_USER
+from utils.profiling import profile_block
+
+# Seconds of question audio skipped by answering over it, across the session
+barge_in_stats = {"cards": 0, "interrupted": 0, "saved_seconds": 0.0}
+
+def record_review(problem, feedback):
+    """
+    Reschedule the problem's card and add the answer to the local student's review log.
+
+    Undetermined verdicts (the model gave none) aren't recorded, so they don't count as lapses.
+    
+    Args:
+        problem (dict): The problem from choose_random_problem
+        feedback (dict): The verdict or feedback, with 'is_correct'
+    """
+    if "is_correct" not in feedback or is_undetermined(feedback):
+        return
+    deck_index = get_registry().get(problem['deck'])
+    deck_name = deck_index.decks[deck_index.cards[problem['card_id']]['deck_id']]
+    with get_shards().open(LOCAL_USER) as shard:
+        shard.record_review(problem['deck'], problem['card_id'], deck_name, feedback["is_correct"])
+
+def ask_question_aloud(formatted_question, answer_prompt, barge_in=True, on_partial=None):
+    """
+    Speak a question and listen for the answer while it plays.
+    
+    With barge-in the student can answer as soon as they know it; their speech stops the
+    question audio, and the skipped audio is added to barge_in_stats.
+    
+    Args:
+        formatted_question (str): The question text to speak
+        answer_prompt (str): Prompt shown while listening
+        barge_in (bool): Listen during playback instead of after it
+        on_partial (callable, optional): Called with the partial transcript as it grows
+        
+    Returns:
+        str: The transcribed answer
+    """
+    question_audio_path = text_to_speech(formatted_question)
+    playback = start_sound(question_audio_path) if barge_in else None
+    if playback is None:
+        # Explicitly play the question audio
+        play_sound(question_audio_path)
+        return get_speech_input(answer_prompt, on_partial=on_partial)
+    
+    user_answer = get_speech_input(answer_prompt, playback=playback, on_partial=on_partial)
+    playback.wait()
+    saved = playback.time_saved()
+    barge_in_stats["cards"] += 1
+    if saved > 0:
+        barge_in_stats["interrupted"] += 1
+        barge_in_stats["saved_seconds"] += saved
+        print(f"(Answered {saved:.1f}s before the question finished; "
+              f"{barge_in_stats['saved_seconds'] / barge_in_stats['cards']:.1f}s saved per card so far)")
+    return user_answer
+
+def run_rapid_fire(category, count, measure_baseline=False, barge_in=True, textual_only=False):
+    """
+    Drill a run of cards back to back, then evaluate all answers in one batched request.
+    
+    Args:
+        category (str): The category to draw cards from
+        count (int): Number of cards in the run
+        measure_baseline (bool): Also evaluate each answer individually to measure the savings
+        barge_in (bool): Let the student answer while the question is still playing
+        textual_only (bool): Skip cards that can't be answered without seeing a picture
+    """
+    items = []
+    problems = []
+    for number in range(1, count + 1):
+        problem = choose_random_problem(deck=category, textual_only=textual_only)
+        if problem is None:
+            print(f"No problems found in category: {category}")
+            return
+        
+        formatted_question = get_question_response(problem['question'], problem['answer'], question_prompt_template,
+                                                   problem['visual'], textual_question_prompt_template)
+        print(f"\n[{number}/{count}] {formatted_question}")
+        user_answer = ask_question_aloud(formatted_question, "\nYour answer (speak clearly): ", barge_in) or ""
+        items.append({"question": problem['question'], "answer": problem['answer'], "user_answer": user_answer,
+                      "card_key": f"{problem['deck']}:{problem['card_id']}"})
+        problems.append(problem)
+    
+    print("\nEvaluating your answers...")
+    results, report = evaluate_answers_batch(
+        items, batch_evaluation_prompt, batch_evaluation_item_template, batch_answer_feedback_tool,
+        evaluation_prompt=evaluation_prompt, answer_feedback_tool=answer_feedback_tool,
+        measure_baseline=measure_baseline
+    )
+    
+    correct = 0
+    for number, (item, problem, verdict) in enumerate(zip(items, problems, results), start=1):
+        record_review(problem, verdict)
+        if verdict.get("is_correct"):
+            correct += 1
+            print(f"{number}. ✓ {item['question']}")
+        else:
+            print(f"{number}. ✗ {item['question']}")
+            print(f"   Your answer: {item['user_answer'] or '(none)'}")
+            print(f"   The correct answer is: {item['answer']}")
+            if verdict.get("explanation"):
+                print(f"   Explanation: {verdict['explanation']}")
+    print(f"\nScore: {correct}/{len(items)}")
+    play_feedback_sound(correct == len(items))
+    
+    if report.get("cache_hits"):
+        print(f"{report['cache_hits']} of {len(items)} answers were given before and evaluated from the cache")
+    if report.get("cache_hits") != len(items):
+        print(f"Batch evaluation: 1 request, {report['latency_ms']} ms, "
+              f"{report['prompt_tokens'] + report['completion_tokens']} tokens")
+    if "per_card_baseline" in report:
+        baseline = report["per_card_baseline"]
+        print(f"Per-card evaluation would take {baseline['requests']} requests, ~{baseline['latency_ms']} ms, "
+              f"~{baseline['tokens']} tokens (saved ~{report['latency_saved_ms']} ms, ~{report['tokens_saved']} tokens)")
+
+def profiling(name, mode):
+    """
+    Profile one step of the study loop if profiling was asked for, and print the profile's path.
+    
+    Args:
+        name (str): The step, named like the matching API endpoint
+        mode (str or None): "sample" or "trace"; None to run without profiling
+        
+    Returns:
+        context manager: The profiling block, or a no-op one
+    """
+    if mode is None:
+        return contextlib.nullcontext()
+    
+    @contextlib.contextmanager
+    def block():
+        with profile_block(name, mode) as profile:
+            yield profile
+        print(f"[profile] {name}: {profile.seconds * 1000:.0f} ms, written to {profile.path}")
+    return block()
 
-def main():
+def main(rapid_fire=0, measure_baseline=False, barge_in=True, profile_mode=None, textual_only=False):
     """
     Main function implementing the flashcard study loop.
+    
+    Args:
+        rapid_fire (int): If set, drill this many cards per run and evaluate them in one batch
+        measure_baseline (bool): In rapid-fire mode, also evaluate each answer individually
+        barge_in (bool): Let the student answer while the question is still playing
+        profile_mode (str): Profile each step of every card ("sample" or "trace"); None to not profile
+        textual_only (bool): Skip cards that can't be answered without seeing a picture
     """
     print("RT Anki - Real-time Anki with OpenAI")
     print("=" * 50)
     
-    # Check if APKG file exists
-    apkg_path = Path(__file__).parent / "MCAT_Milesdown.apkg"
-    if not apkg_path.exists():
-        print(f"Error: Anki package file not found at {apkg_path}")
-        print("Please ensure the MCAT_Milesdown.apkg file is in the project root directory.")
+    # Check that at least one deck was loaded
+    registry = get_registry()
+    if not registry.decks():
+        print(f"Error: No Anki package files found in {registry.decks_dir}")
+        print("Please place one or more .apkg files there, or set DECKS_DIR in your .env file.")
         return
     
+    # Decode the feedback sounds up front so they play without delay
+    preload_feedback_sounds()
+    
     # Main loop
     while True:
         # Print categories
@@ -65,38 +221,64 @@ def main():
         selected_category = categories[category_index]
         print(f"\nSelected category: {selected_category}")
         
-        # Choose a random problem from the selected category
-        try:
-            problem = choose_random_problem(str(apkg_path), selected_category)
-            if problem is None:
-                print(f"No problems found in category: {selected_category}")
+        if rapid_fire:
+            run_rapid_fire(selected_category, rapid_fire, measure_baseline, barge_in, textual_only)
+            input("\nPress Enter to start another run...")
+            continue
+        
+        with profiling("start_problem", profile_mode):
+            # Choose a random problem from the selected category
+            try:
+                problem = choose_random_problem(deck=selected_category, textual_only=textual_only)
+                if problem is None:
+                    print(f"No problems found in category: {selected_category}")
+                    continue
+                
+                question = problem['question']
+                answer = problem['answer']
+            except Exception as e:
+                print(f"Error choosing random problem: {e}")
                 continue
             
-            question = problem['question']
-            answer = problem['answer']
-        except Exception as e:
-            print(f"Error choosing random problem: {e}")
-            continue
+            # Get the formatted question from the LLM
+            formatted_question = get_question_response(question, answer, question_prompt_template,
+                                                       problem['visual'], textual_question_prompt_template)
+            savings = metrics.prompt_savings_summary().get("format_question")
+            if savings and savings["tokens_saved"]:
+                print(f"(Question prompts this session: {savings['tokens_saved']} tokens saved, "
+                      f"{savings['saved_rate']:.0%} of the full prompt)")
         
-        # Get the formatted question from the LLM
-        formatted_question = get_question_response(question, answer, question_prompt_template)
+        # Evaluate the answer on the partial transcript while the student is still being transcribed
+        card_key = f"{problem['deck']}:{problem['card_id']}"
+        speculator = SpeculativeEvaluator(
+            lambda transcript: cached_check_answer(question, transcript, answer, evaluation_prompt,
+                                                   answer_feedback_tool, card_key),
+            answer
+        ) if speculation.SPECULATIVE_EVALUATION else None
         
-        # Print and speak the question
+        # Print and speak the question, listening for the answer while it plays
         print("\n" + formatted_question)
-        question_audio_path = text_to_speech(formatted_question)
-        
-        # Explicitly play the question audio
-        play_sound(question_audio_path)
-        
-        # Get user's answer
         user_answer_prompt = "\nYour answer (speak clearly): "
-        user_answer = get_speech_input(user_answer_prompt)
+        user_answer = ask_question_aloud(formatted_question, user_answer_prompt, barge_in,
+                                         on_partial=speculator.on_partial if speculator else None)
         if not user_answer:
             print("No answer received. Marking as incorrect.")
             user_answer = ""
         
         # Evaluate the answer
-        feedback = evaluate_answer(question, user_answer, answer, evaluation_prompt, answer_feedback_tool)
+        with profiling("evaluate_answer", profile_mode):
+            if speculator is None:
+                feedback = evaluate_answer(question, user_answer, answer, evaluation_prompt, answer_feedback_tool,
+                                           card_key=card_key)
+            else:
+                verdict = speculator.verdict(user_answer, speech_to_text.last_speech_end_time())
+                feedback = evaluate_answer(question, user_answer, answer, evaluation_prompt, answer_feedback_tool,
+                                           verdict=verdict) if verdict is not None else dict(UNDETERMINED_VERDICT)
+                if speculator.speculated:
+                    stats = speculation.summary()
+                    print(f"(Speculative evaluation: {stats['committed']} of {stats['answers']} verdicts ready early, "
+                          f"{stats['avg_saved_ms']} ms saved per answer, {stats['wasted_rate']:.0%} of early calls wasted)")
+        record_review(problem, feedback)
         
         # Print result
         if feedback.get("is_correct"):
@@ -107,35 +289,70 @@ def main():
             if "explanation" in feedback:
                 print(f"Explanation: {feedback['explanation']}")
             
-            # Ask if user wants to ask a follow-up
+            # Let the user ask follow-ups until they're done; each one continues the same conversation
+            conversation = None
             followup_choice_prompt = "\nWould you like to ask a follow-up question? (Speak 'yes' or 'no'): "
-            followup_choice_text = get_speech_input(followup_choice_prompt).lower()
-            
-            if not followup_choice_text:
-                print("No choice received for follow-up.")
-            elif followup_choice_text.startswith('y'):
+            while True:
+                followup_choice_text = get_speech_input(followup_choice_prompt).lower()
+                
+                if not followup_choice_text:
+                    print("No choice received for follow-up.")
+                    break
+                if not followup_choice_text.startswith('y'):
+                    break
+                
                 followup_prompt_text = "Your follow-up question (speak clearly): "
                 followup = get_speech_input(followup_prompt_text)
                 
-                if followup:
-                    # Get follow-up response
+                if not followup:
+                    print("No follow-up question received.")
+                    break
+                
+                if conversation is None:
+                    deck_index = registry.get(problem['deck'])
+                    related_cards = deck_index.related_cards(
+                        problem['card_id'], f"{question} {answer} {followup}"
+                    ) if deck_index is not None else []
+                    conversation = start_followup_conversation(
+                        question, answer, followup_conversation_prompt, related_cards
+                    )
+                
+                # Get follow-up response
+                with profiling("follow_up", profile_mode):
                     followup_response = handle_followup_question(
-                        question, answer, followup, followup_prompt
+                        question, answer, followup, followup_prompt, conversation=conversation
                     )
-                    
-                    # Print and speak the follow-up response
-                    print(f"\nResponse: {followup_response}")
                     followup_audio_path = text_to_speech(followup_response)
-                    
-                    # Explicitly play the follow-up response audio
-                    play_sound(followup_audio_path)
-                else:
-                    print("No follow-up question received.")
+                
+                # Print and speak the follow-up response
+                print(f"\nResponse: {followup_response}")
+                
+                # Explicitly play the follow-up response audio
+                play_sound(followup_audio_path)
+                followup_choice_prompt = "\nAnother follow-up question? (Speak 'yes' or 'no'): "
         
         # Wait for user to continue
         input("\nPress Enter to continue to the next question...")
     
+    if barge_in_stats["interrupted"]:
+        print(f"\nAnswered over the question on {barge_in_stats['interrupted']} of {barge_in_stats['cards']} cards, "
+              f"saving {barge_in_stats['saved_seconds']:.1f}s "
+              f"({barge_in_stats['saved_seconds'] / barge_in_stats['cards']:.1f}s per card).")
     print("\nThank you for using RT Anki!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="RT Anki - Real-time Anki with OpenAI")
+    parser.add_argument("--rapid-fire", type=int, default=0, metavar="N",
+                        help="answer N cards back to back and evaluate them in one batch")
+    parser.add_argument("--measure-baseline", action="store_true",
+                        help="in rapid-fire mode, also evaluate each answer individually to measure the savings")
+    parser.add_argument("--no-barge-in", action="store_true",
+                        help="wait for the question audio to finish before listening for the answer")
+    parser.add_argument("--profile", nargs="?", const="sample", choices=["sample", "trace"],
+                        help="profile choosing, evaluating and following up on each card, writing "
+                             "flamegraph-ready profiles (sample, the default) or cProfile stats (trace)")
+    parser.add_argument("--textual-only", action="store_true",
+                        help="skip cards that can't be answered without seeing a picture")
+    args = parser.parse_args()
+    main(rapid_fire=args.rapid_fire, measure_baseline=args.measure_baseline, barge_in=not args.no_barge_in,
+         profile_mode=args.profile, textual_only=args.textual_only) 
\ No newline at end of file
@@ -10,11 +10,12 @@ You will be given a question and its correct answer. Your task is to:
 After the user gives their answer, you will evaluate it and provide feedback.
 """
 
+# The question prompt keeps its static instructions first and the card content last, so
+# the instructions form an identical prefix on every call and hit the provider's prompt
+# cache. The other prompts are far shorter than the 1024-token minimum the cache needs,
+# so their order makes no difference and is left as it was.
 question_prompt_template = """
-Here is a flashcard question and its correct answer:
-
-Question: {question}
-Correct Answer: {answer}
+You will be given a flashcard question and its correct answer at the end of this message.
 
 Your primary goal is to present ONLY the question to the user in a way that is **clear, self-contained, and answerable through audio alone**, without requiring the user to see any visual aids that are not explicitly provided as part of your textual response. The user is studying via audio and will not be looking at a screen.
 
@@ -61,6 +62,22 @@ Follow these guidelines rigorously, in the specified order:
 6.  **No Direct Hints/Answers:** Do not include the target answer in your question. (Rephrasing to provide *context* based on the answer, as shown in Guideline 2, is different and encouraged).
 
 7.  **Conciseness:** Your final output (the question, or question with warning) should be concise.
+
+Here is the flashcard question and its correct answer:
+
+Question: {question}
+Correct Answer: {answer}
+"""
+
+# For cards screened as textual when their deck was loaded: they need none of the
+# visual-dependency rescue above, so they get a much shorter prompt.
+textual_question_prompt_template = """
+You will be given a flashcard question and its correct answer at the end of this message.
+
+Present ONLY the question to a user who is studying by audio. If the question is already clear, present it as is. If it is terse or ambiguous, rephrase it slightly so it tests the same knowledge, using the correct answer to understand what is being asked. Mark blanks as "[blank]". Never include the answer or hints about it. Be concise.
+
+Question: {question}
+Correct Answer: {answer}
 """
 
 evaluation_prompt = """
@@ -80,14 +97,50 @@ Keep your response extremely concise - just 1-2 short sentences total.
 Use the check_answer tool to provide your evaluation.
 """
 
+batch_evaluation_prompt = """
+Evaluate each of the user's {count} answers below against its correct answer.
+
+Call the check_answer tool exactly once for every item, passing the item's number.
+
+If an answer is wrong:
+1. State the correct answer briefly
+2. If they provided an actual attempt (not "I don't know"), very briefly explain why it was wrong
+3. If their answer was very close, offer brief encouragement
+
+Keep each explanation extremely concise - just 1-2 short sentences total.
+
+{items}
+"""
+
+batch_evaluation_item_template = """Item {number}:
+Question: {question}
+User's Answer: {user_answer}
+Correct Answer: {answer}
+"""
+
 followup_prompt = """
 The user would like to ask a follow-up question after their incorrect answer.
 
 Original Question: {question}
 Correct Answer: {answer}
 User's Follow-up: {followup}
-
+{related}
 Provide a helpful, concise response that addresses their follow-up question without 
 revealing information about other flashcard questions.
 """
 
+followup_conversation_prompt = """
+The user is asking follow-up questions about a flashcard after answering it.
+
+Original Question: {question}
+Correct Answer: {answer}
+{related}
+Answer each follow-up helpfully and concisely, using the earlier turns of this conversation 
+for context, without revealing information about other flashcard questions.
+"""
+
+related_cards_template = """
+Related flashcards from the same deck (use them only as background context if they help answer the follow-up):
+{cards}
+"""
+
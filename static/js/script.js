@@ -4,6 +4,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const problemArea = document.getElementById('problem-area');
     const questionTextElem = document.getElementById('question-text');
     const questionAudioElem = document.getElementById('question-audio');
+    const questionMediaElem = document.getElementById('question-media');
+    const answerMediaElem = document.getElementById('answer-media');
     const feedbackArea = document.getElementById('feedback-area');
     const feedbackTextElem = document.getElementById('feedback-text');
     const correctAnswerTextElem = document.getElementById('correct-answer-text');
@@ -38,6 +40,26 @@ document.addEventListener('DOMContentLoaded', function() {
 
     console.log('Script loaded. Hold-to-record implementation. Max time (ms):', MAX_RECORD_TIME_MS);
 
+    // Show a card's images and sound clips (served from /api/media) in a container
+    function renderMedia(container, urls) {
+        container.innerHTML = '';
+        (urls || []).forEach(url => {
+            let elem;
+            if (/\.(mp3|ogg|wav|m4a|flac)$/i.test(url)) {
+                elem = document.createElement('audio');
+                elem.controls = true;
+                elem.preload = 'none';
+                elem.className = 'w-full';
+            } else {
+                elem = document.createElement('img');
+                elem.className = 'max-w-full rounded-lg';
+                elem.loading = 'lazy';
+            }
+            elem.src = url;
+            container.appendChild(elem);
+        });
+    }
+
     async function requestMicrophoneAccess() {
         console.log('Requesting microphone access...');
         try {
@@ -166,6 +188,10 @@ document.addEventListener('DOMContentLoaded', function() {
             mediaRecorder.start(); 
             console.log('[Record] MediaRecorder started. State:', mediaRecorder.state);
             recordStartTime = Date.now();
+            if (targetConceptId === 'user-answer-text' && currentProblem && currentProblem.answerStartedAt === undefined) {
+                // Response time runs from showing the question to starting the first answer
+                currentProblem.answerStartedAt = performance.now();
+            }
             animationFrameId = requestAnimationFrame(updateRecordProgress);
 
             maxRecordTimer = setTimeout(() => {
@@ -445,20 +471,34 @@ document.addEventListener('DOMContentLoaded', function() {
     const categoryButtonUnselectedClass = 'bg-gray-200 text-gray-700 hover:bg-gray-300 focus:ring-gray-400';
     const categoryButtonSelectedClass = 'bg-blue-500 text-white hover:bg-blue-600 focus:ring-blue-500';
 
-    fetch('/api/categories')
+    // Flatten the deck tree depth-first, skipping decks with nothing to study
+    function flattenDeckTree(nodes, depth = 0, flat = []) {
+        nodes.forEach(node => {
+            if (node.counts.total > 0) {
+                flat.push({ node, depth });
+                flattenDeckTree(node.children, depth + 1, flat);
+            }
+        });
+        return flat;
+    }
+
+    fetch('/api/deck_tree')
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             return response.json();
         })
-        .then(categories => {
+        .then(tree => {
             categoriesListDiv.innerHTML = ''; 
-            if (categories && categories.length > 0) {
-                categories.forEach(category => {
+            const decks = tree ? flattenDeckTree(tree) : [];
+            if (decks.length > 0) {
+                decks.forEach(({ node, depth }) => {
                     const button = document.createElement('button');
-                    button.textContent = category;
-                    button.dataset.category = category;
+                    // Selecting a deck includes its sub-decks, so show the counts they add up to
+                    button.textContent = `${'› '.repeat(depth)}${node.name} (${node.counts.due} due, ${node.counts.new} new / ${node.counts.total})`;
+                    button.title = node.path;
+                    button.dataset.category = node.path;
                     button.className = `${categoryButtonBaseClass} ${categoryButtonUnselectedClass}`;
                     button.type = 'button'; // Important to prevent form submission if it were in a form
 
@@ -484,6 +524,70 @@ document.addEventListener('DOMContentLoaded', function() {
             categoriesListDiv.innerHTML = '<p class="text-red-500">Error loading categories. Please try again later.</p>';
         });
 
+    const searchQueryInput = document.getElementById('search-query-text');
+    const searchCountText = document.getElementById('search-count-text');
+    const saveQueryButton = document.getElementById('save-query-button');
+    const savedQueriesListDiv = document.getElementById('saved-queries-list');
+    let searchDebounceTimer = null;
+
+    function updateSearchCount() {
+        const query = searchQueryInput.value.trim();
+        if (!query) {
+            searchCountText.textContent = '';
+            return;
+        }
+        fetch(`/api/search?q=${encodeURIComponent(query)}&limit=1`)
+            .then(response => response.json())
+            .then(result => {
+                searchCountText.textContent = `${result.total || 0} matching cards`;
+            })
+            .catch(error => console.error('Error searching cards:', error));
+    }
+
+    function renderSavedQueries(savedQueries) {
+        savedQueriesListDiv.innerHTML = '';
+        Object.entries(savedQueries || {}).forEach(([name, query]) => {
+            const button = document.createElement('button');
+            button.type = 'button';
+            button.textContent = name;
+            button.title = query;
+            button.className = `${categoryButtonBaseClass} ${categoryButtonUnselectedClass}`;
+            button.addEventListener('click', () => {
+                searchQueryInput.value = query;
+                updateSearchCount();
+            });
+            savedQueriesListDiv.appendChild(button);
+        });
+    }
+
+    searchQueryInput.addEventListener('input', () => {
+        clearTimeout(searchDebounceTimer);
+        searchDebounceTimer = setTimeout(updateSearchCount, 250);
+    });
+
+    saveQueryButton.addEventListener('click', () => {
+        const query = searchQueryInput.value.trim();
+        if (!query) {
+            alert('Type a query to save.');
+            return;
+        }
+        const name = prompt('Name for this study set:', query);
+        if (!name) return;
+        fetch('/api/saved_queries', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ name: name, query: query })
+        })
+            .then(response => response.json())
+            .then(renderSavedQueries)
+            .catch(error => console.error('Error saving query:', error));
+    });
+
+    fetch('/api/saved_queries')
+        .then(response => response.json())
+        .then(renderSavedQueries)
+        .catch(error => console.error('Error fetching saved queries:', error));
+
     startButton.addEventListener('click', function() {
         selectedCategories = [];
         const categoryButtons = document.querySelectorAll('#categories-list button');
@@ -493,8 +597,8 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
 
-        if (selectedCategories.length === 0) {
-            alert('Please select at least one category.');
+        if (selectedCategories.length === 0 && !searchQueryInput.value.trim()) {
+            alert('Please select at least one category or enter a search query.');
             return;
         }
 
@@ -520,7 +624,7 @@ document.addEventListener('DOMContentLoaded', function() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ categories: selectedCategories })
+            body: JSON.stringify({ categories: selectedCategories, query: searchQueryInput.value.trim() })
         })
         .then(response => {
             if (!response.ok) {
@@ -531,7 +635,10 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             console.log('[UI] Problem data received:', data);
             currentProblem = data; 
+            currentProblem.shownAt = performance.now();
             questionTextElem.textContent = data.formatted_question;
+            renderMedia(questionMediaElem, data.media);
+            renderMedia(answerMediaElem, []);
             questionAudioElem.src = data.audio_path;
             
             problemArea.style.display = 'block';
@@ -612,7 +719,11 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify({
                 original_question: currentProblem.original_question,
                 original_answer: currentProblem.original_answer,
-                user_answer: userAnswer
+                user_answer: userAnswer,
+                deck: currentProblem.deck,
+                card_id: currentProblem.card_id,
+                response_ms: currentProblem.answerStartedAt !== undefined
+                    ? Math.round(currentProblem.answerStartedAt - currentProblem.shownAt) : null
             })
         })
         .then(response => {
@@ -641,6 +752,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 feedbackTextElem.textContent = '✗ Incorrect!';
                 feedbackTextElem.style.color = 'red';
                 correctAnswerTextElem.textContent = `The correct answer is: ${currentProblem.original_answer}`;
+                renderMedia(answerMediaElem, currentProblem.answer_media);
                 explanationTextElem.textContent = feedback.explanation || 'No explanation provided.';
                 followUpButton.style.display = 'inline-block'; 
                 if(recordFollowUpButton) recordFollowUpButton.disabled = false;
@@ -773,6 +885,9 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify({
                 original_question: currentProblem.original_question,
                 original_answer: currentProblem.original_answer,
+                deck: currentProblem.deck,
+                card_id: currentProblem.card_id,
+                conversation_id: currentProblem.conversation_id,
                 follow_up_question: followUpQuestion
             })
         })
@@ -784,6 +899,8 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(data => {
             console.log('[UI] Follow-up response received:', data);
+            // Later follow-ups on this card continue the same conversation
+            currentProblem.conversation_id = data.conversation_id;
             explanationTextElem.innerHTML = `<strong>Follow-up Response:</strong><br>${data.follow_up_response}`;
             questionAudioElem.src = data.audio_path; 
             replayQuestionAudioButton.style.display = 'none';
@@ -806,6 +923,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 nextQuestionButton.disabled = false;
                 nextQuestionButton.focus();
                 followUpInputArea.style.display = 'none'; 
+                followUpButton.style.display = 'inline-block';
                 replayContextualAudioButton.disabled = false;
             };
             questionAudioElem.onerror = () => {
@@ -814,6 +932,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 nextQuestionButton.disabled = false;
                 nextQuestionButton.focus();
                 followUpInputArea.style.display = 'none';
+                followUpButton.style.display = 'inline-block';
                 replayContextualAudioButton.disabled = false;
             };
         })
@@ -1,7 +1,11 @@
 from .get_response import get_response
 from .text_to_speech import text_to_speech
 from .play_sound import play_sound
-from .answer_feedback import process_answer, play_feedback_sound
-from .answer_feedback_tool import get_answer_feedback, handle_followup, answer_feedback_tool
-from .choose_random_problem import choose_random_problem, get_categories
-from .conversation import Conversation, get_question_response, evaluate_answer, handle_followup_question 
\ No newline at end of file
+from .answer_feedback import process_answer, play_feedback_sound, preload_feedback_sounds
+from .answer_feedback_tool import get_answer_feedback, handle_followup, answer_feedback_tool, batch_answer_feedback_tool
+from .choose_random_problem import choose_random_problem, choose_problem_for_query, get_categories
+from .conversation import (
+    Conversation, ConversationStore, get_question_response, evaluate_answer, evaluate_answers_batch,
+    handle_followup_question, start_followup_conversation
+)
+from .deck_registry import DeckRegistry, get_registry
@@ -0,0 +1,318 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Priorities: lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Concurrent calls, estimated tokens per minute (0 = no rate limit) and waiting calls
+# allowed per API before new calls are turned away
+LIMITS = {
+    "chat": {
+        "max_concurrent": int(os.getenv("CHAT_CONCURRENCY") or "8"),
+        "tokens_per_minute": int(os.getenv("CHAT_TOKENS_PER_MINUTE") or "200000"),
+        "max_queue": int(os.getenv("CHAT_MAX_QUEUE") or "16"),
+    },
+    "tts": {
+        "max_concurrent": int(os.getenv("TTS_CONCURRENCY") or "4"),
+        "tokens_per_minute": int(os.getenv("TTS_TOKENS_PER_MINUTE") or "0"),
+        "max_queue": int(os.getenv("TTS_MAX_QUEUE") or "8"),
+    },
+    "transcribe": {
+        "max_concurrent": int(os.getenv("TRANSCRIBE_CONCURRENCY") or "4"),
+        "tokens_per_minute": int(os.getenv("TRANSCRIBE_TOKENS_PER_MINUTE") or "0"),
+        "max_queue": int(os.getenv("TRANSCRIBE_MAX_QUEUE") or "8"),
+    },
+}
+# Longest an interactive call waits for a slot; background work is more patient
+INTERACTIVE_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT") or "5")
+BACKGROUND_TIMEOUT = 60.0
+
+_priority = contextvars.ContextVar("admission_priority", default=INTERACTIVE)
+
+class Overloaded(Exception):
+    """Raised when a call is turned away, or the API itself reported a rate limit."""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(round(retry_after)))
+
+@contextlib.contextmanager
+def background():
+    """Run the API calls made inside the block at background priority, e.g. for prefetching."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class AdmissionController:
+    """
+    Concurrency and token-rate limiter for one upstream API.
+
+    Callers wait in a priority queue: interactive calls are admitted before background
+    ones, and in arrival order within a priority. A call is admitted when a concurrency
+    slot is free and the token bucket holds its estimated tokens. When max_queue calls are
+    already waiting, or a call waits longer than its timeout, it is turned away with
+    Overloaded so the endpoint can answer 503 immediately instead of piling up threads.
+    """
+    def __init__(self, name, max_concurrent, tokens_per_minute=0, max_queue=16):
+        """
+        Initialize the controller.
+
+        Args:
+            name (str): Name of the API, for messages and metrics
+            max_concurrent (int): Calls allowed in flight at once
+            tokens_per_minute (int, optional): Estimated tokens admitted per minute; 0 for no limit
+            max_queue (int, optional): Calls allowed to wait before new ones are rejected
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self._condition = threading.Condition()
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._hold_seconds = 1.0  # Moving average of how long a call holds its slot
+        self.admitted = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.rejected = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        # Called with the lock held
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute,
+                           self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60)
+        self._refilled_at = now
+
+    def retry_after(self):
+        """Estimate how many seconds until a new call would be admitted."""
+        return (len(self._waiters) + 1) * self._hold_seconds / self.max_concurrent
+
+    def acquire(self, tokens=0, priority=None, timeout=None):
+        """
+        Wait for a slot and reserve the call's tokens.
+
+        Args:
+            tokens (int, optional): Estimated tokens the call will use
+            priority (int, optional): INTERACTIVE or BACKGROUND. Defaults to the priority
+                of the current context (see background()).
+            timeout (float, optional): Longest time to wait. Defaults by priority.
+
+        Returns:
+            float: The time.monotonic() the call was admitted at, for release()
+
+        Raises:
+            Overloaded: If the queue is full or the wait timed out
+        """
+        priority = _priority.get() if priority is None else priority
+        if timeout is None:
+            timeout = INTERACTIVE_TIMEOUT if priority == INTERACTIVE else BACKGROUND_TIMEOUT
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._condition:
+            self._refill()
+            has_tokens = not self.tokens_per_minute or self._tokens >= tokens
+            can_start = not self._waiters and self._in_flight < self.max_concurrent and has_tokens
+            if not can_start and len(self._waiters) >= self.max_queue:
+                self.rejected[priority] += 1
+                raise Overloaded(f"Too many {self.name} requests waiting", self.retry_after())
+            waiter = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    self._refill()
+                    first = self._waiters[0] == waiter
+                    has_tokens = not self.tokens_per_minute or self._tokens >= tokens
+                    if first and self._in_flight < self.max_concurrent and has_tokens:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[priority] += 1
+                        raise Overloaded(f"Timed out waiting for a {self.name} slot", self.retry_after())
+                    if first and not has_tokens:
+                        # Sleep until the bucket has refilled enough
+                        remaining = min(remaining, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                # The next waiter may be able to go now
+                self._condition.notify_all()
+            self._in_flight += 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+            self.admitted[priority] += 1
+            now = time.monotonic()
+            self.wait_seconds += now - start
+            return now
+
+    def release(self, admitted_at):
+        """
+        Free the slot taken by acquire().
+
+        Args:
+            admitted_at (float): The value acquire() returned
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * (time.monotonic() - admitted_at)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, tokens=0, priority=None, timeout=None):
+        """Context manager around acquire() and release(). See acquire() for the arguments."""
+        admitted_at = self.acquire(tokens, priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def stats(self):
+        """
+        Get the controller's counters.
+
+        Returns:
+            dict: Limits, calls in flight and waiting, admitted and rejected calls per
+                priority, and the average wait for a slot
+        """
+        with self._condition:
+            admitted = sum(self.admitted.values())
+            return {
+                "max_concurrent": self.max_concurrent,
+                "tokens_per_minute": self.tokens_per_minute,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "admitted": {"interactive": self.admitted[INTERACTIVE], "background": self.admitted[BACKGROUND]},
+                "rejected": {"interactive": self.rejected[INTERACTIVE], "background": self.rejected[BACKGROUND]},
+                "avg_wait_ms": round(self.wait_seconds / admitted * 1000, 1) if admitted else None,
+            }
+
+_controllers = {name: AdmissionController(name, **limits) for name, limits in LIMITS.items()}
+
+def get_controller(name):
+    """
+    Get the process-wide controller for one API.
+
+    Args:
+        name (str): "chat", "tts" or "transcribe"
+
+    Returns:
+        AdmissionController: The shared controller
+    """
+    return _controllers[name]
+
+def rate_limit_retry_after(error, default=1):
+    """
+    Read the Retry-After of an API rate-limit error.
+
+    Args:
+        error (Exception): The error raised by the API client
+        default (float, optional): Seconds to use when the response has no Retry-After
+
+    Returns:
+        float: Seconds to wait before retrying
+    """
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+def stats():
+    """Get the counters of every controller. See AdmissionController.stats."""
+    return {name: controller.stats() for name, controller in _controllers.items()}
+
+def _percentiles(latencies):
+    ordered = sorted(latencies)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 1)
+    return {"p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99)}
+
+def load_test(clients=48, requests_per_client=10, capacity=8, service_seconds=0.2, use_admission=True):
+    """
+    Offer more load than a simulated upstream can serve and measure the latency clients see.
+
+    The simulated API serves `capacity` calls at its base speed; beyond that every call
+    slows down in proportion to the calls in flight, as a saturated upstream does.
+
+    Args:
+        clients (int, optional): Concurrent client threads
+        requests_per_client (int, optional): Calls each client makes back to back
+        capacity (int, optional): Calls the upstream serves without slowing down
+        service_seconds (float, optional): Base time of one call
+        use_admission (bool, optional): Put an AdmissionController with max_concurrent=capacity
+            in front of the upstream
+
+    Returns:
+        dict: Calls completed and rejected, and p50/p95/p99 latency of completed calls
+    """
+    controller = AdmissionController("load-test", capacity, max_queue=capacity * 2)
+    lock = threading.Lock()
+    in_flight = [0]
+    latencies = []
+    rejected = [0]
+
+    def upstream():
+        with lock:
+            in_flight[0] += 1
+            load = in_flight[0]
+        time.sleep(service_seconds * max(1.0, load / capacity) * random.uniform(0.8, 1.2))
+        with lock:
+            in_flight[0] -= 1
+
+    def client():
+        for _ in range(requests_per_client):
+            start = time.monotonic()
+            try:
+                if use_admission:
+                    with controller.slot(timeout=service_seconds * 10):
+                        upstream()
+                else:
+                    upstream()
+            except Overloaded as e:
+                with lock:
+                    rejected[0] += 1
+                # A client told to back off waits before trying again
+                time.sleep(min(e.retry_after, service_seconds * 2))
+                continue
+            with lock:
+                latencies.append(time.monotonic() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "completed": len(latencies),
+        "rejected": rejected[0],
+        "seconds": round(time.monotonic() - start, 1),
+        **_percentiles(latencies),
+    }
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.admission
+    # Six times more clients than the simulated upstream can serve, with and without admission control
+    print(json.dumps({
+        "without_admission": load_test(use_admission=False),
+        "with_admission": load_test(use_admission=True),
+    }, indent=2))
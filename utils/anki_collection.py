@@ -0,0 +1,341 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .config import DATA_DIR
+
+# Collection files an .apkg may contain, newest format first. Packages exported by
+# recent Anki versions also carry a stub collection.anki2 asking the user to upgrade,
+# so the newest format present is the one to read.
+COLLECTION_MEMBERS = ("collection.anki21b", "collection.anki21", "collection.anki2")
+# collection.anki21b (and its media) are zstd-compressed
+ZSTD_MEMBERS = {"collection.anki21b"}
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Decompressed collections are kept here, one per package version
+COLLECTION_CACHE_DIR = DATA_DIR / "collections"
+# Bytes decompressed per iteration; the whole collection is never held in memory
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+def collection_member(names):
+    """
+    Pick the collection file to read from a package's member names.
+
+    Args:
+        names (list): Names of the zip members
+
+    Returns:
+        str: The newest collection member present
+
+    Raises:
+        ValueError: If the package contains no collection
+    """
+    for member in COLLECTION_MEMBERS:
+        if member in names:
+            return member
+    raise ValueError(f"Missing collection file (expected one of {', '.join(COLLECTION_MEMBERS)})")
+
+def zstd_reader(src):
+    """
+    Wrap a file object so that reading it decompresses a zstd stream.
+
+    Args:
+        src (file object): The compressed stream
+
+    Returns:
+        file object: Stream of decompressed bytes
+    """
+    if zstandard is None:
+        raise RuntimeError("Reading zstd-compressed Anki packages requires the zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(src, read_size=DECOMPRESS_CHUNK_SIZE)
+
+def _cache_path(apkg_path, signature, member):
+    apkg_path = Path(apkg_path).resolve()
+    digest = hashlib.sha256(str(apkg_path).encode('utf-8')).hexdigest()[:12]
+    mtime_ns, size = signature
+    return COLLECTION_CACHE_DIR / f"{apkg_path.stem}-{digest}-{mtime_ns:x}-{size:x}{Path(member).suffix}"
+
+def extract_collection(zf, apkg_path, signature):
+    """
+    Decompress a package's collection into the cache directory, if it isn't there yet.
+
+    The collection is streamed from the zip (and through zstd for .anki21b) in
+    DECOMPRESS_CHUNK_SIZE chunks, so memory use doesn't grow with the collection.
+    Copies left by earlier versions of the same package are removed.
+
+    Args:
+        zf (zipfile.ZipFile): The open package
+        apkg_path (str or Path): Path to the package
+        signature (tuple): (mtime_ns, size) of the package, see deck_index.file_signature
+
+    Returns:
+        Path: The decompressed SQLite database
+    """
+    try:
+        member = collection_member(zf.namelist())
+    except ValueError as e:
+        raise ValueError(f"Invalid APKG file: {apkg_path}. {e}") from None
+    path = _cache_path(apkg_path, signature, member)
+    if path.exists():
+        return path
+
+    COLLECTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+    try:
+        with zf.open(member) as src, open(partial_path, 'wb') as dst:
+            reader = zstd_reader(src) if member in ZSTD_MEMBERS else src
+            shutil.copyfileobj(reader, dst, DECOMPRESS_CHUNK_SIZE)
+        os.replace(partial_path, path)
+    finally:
+        if partial_path.exists():
+            partial_path.unlink()
+
+    prefix = path.name.rsplit("-", 2)[0] + "-"
+    for stale in COLLECTION_CACHE_DIR.iterdir():
+        if stale.name.startswith(prefix) and stale != path:
+            with contextlib.suppress(OSError):
+                stale.unlink()
+    return path
+
+def _has_table(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+def read_decks(conn):
+    """
+    Read the deck names of a collection.
+
+    Newer collections (schema 18) keep decks in a `decks` table with the name components
+    separated by \\x1f; older ones keep a JSON object in `col.decks`.
+
+    Args:
+        conn (sqlite3.Connection): The open collection
+
+    Returns:
+        dict: {deck_id: full deck name, with '::' separators}
+    """
+    if _has_table(conn, "decks"):
+        return {did: name.replace("\x1f", "::") for did, name in conn.execute("SELECT id, name FROM decks")}
+    decks_json, = conn.execute("SELECT decks FROM col").fetchone()
+    return {int(did): d.get('name', '') for did, d in json.loads(decks_json).items()}
+
+def read_note_types(conn):
+    """
+    Read the note type names of a collection, from the `notetypes` table (schema 18)
+    or the `col.models` JSON.
+
+    Args:
+        conn (sqlite3.Connection): The open collection
+
+    Returns:
+        dict: {note type id: name}
+    """
+    if _has_table(conn, "notetypes"):
+        return dict(conn.execute("SELECT id, name FROM notetypes"))
+    models_json, = conn.execute("SELECT models FROM col").fetchone()
+    return {int(mid): m['name'] for mid, m in json.loads(models_json).items()}
+
+def collection_day(conn, now=None):
+    """
+    Get the collection's current day number, which review cards' due dates count in.
+
+    Args:
+        conn (sqlite3.Connection): The open collection
+        now (float, optional): Unix time. Defaults to now.
+
+    Returns:
+        int: Days since the collection was created
+    """
+    crt, = conn.execute("SELECT crt FROM col").fetchone()
+    return int(((time.time() if now is None else now) - crt) // 86400)
+
+@contextlib.contextmanager
+def open_collection(zf, apkg_path, signature):
+    """
+    Open a package's collection, in whichever format it was exported.
+
+    Args:
+        zf (zipfile.ZipFile): The open package
+        apkg_path (str or Path): Path to the package
+        signature (tuple): (mtime_ns, size) of the package
+
+    Yields:
+        sqlite3.Connection: Connection to the decompressed collection
+    """
+    path = extract_collection(zf, apkg_path, signature)
+    conn = sqlite3.connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+def _protobuf_fields(data):
+    """Yield (field number, value) for a protobuf message's varint and length-delimited fields."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field, value
+
+def read_media_map(zf):
+    """
+    Read which zip member holds each media file of a package.
+
+    Legacy packages list the members as JSON. Newer ones store a zstd-compressed
+    protobuf list of entries (name = 1, size = 2), where entry i is member "i" and the
+    member itself is zstd-compressed.
+
+    Args:
+        zf (zipfile.ZipFile): The open package
+
+    Returns:
+        tuple: ({media file name: zip member name}, {media file name: decompressed size}).
+            The sizes are only filled in for zstd-compressed media.
+    """
+    if 'media' not in zf.namelist():
+        return {}, {}
+    data = zf.read('media')
+    if not data.startswith(ZSTD_MAGIC):
+        return {name: member for member, name in json.loads(data).items()}, {}
+    with zstd_reader(zf.open('media')) as reader:
+        data = reader.read()
+    media, sizes = {}, {}
+    entries = (value for field, value in _protobuf_fields(data) if field == 1)
+    for number, entry in enumerate(entries):
+        fields = dict(_protobuf_fields(entry))
+        name = fields.get(1, b"").decode('utf-8')
+        if name:
+            media[name] = str(number)
+            sizes[name] = fields.get(2, 0)
+    return media, sizes
+
+def _write_benchmark_package(path, notes, field_bytes=400):
+    """Write a schema 18 .anki21b package with the given number of notes, for benchmarking."""
+    db_path = path.with_suffix(".anki21b.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE col (id INTEGER PRIMARY KEY, crt INTEGER, decks TEXT, models TEXT);
+        CREATE TABLE decks (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE notetypes (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER, flds TEXT);
+        CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, did INTEGER, queue INTEGER, due INTEGER);
+    """)
+    conn.execute("INSERT INTO col VALUES (1, ?, '', '')", (int(time.time()) - 365 * 86400,))
+    conn.executemany("INSERT INTO decks VALUES (?, ?)",
+                     [(d, f"Benchmark\x1fSection {d}") for d in range(1, 21)])
+    conn.execute("INSERT INTO notetypes VALUES (1, 'Basic')")
+    filler = "x" * field_bytes
+    conn.executemany("INSERT INTO notes VALUES (?, 1, ?)",
+                     ((n, f"Question {n} {filler}\x1fAnswer {n}") for n in range(notes)))
+    conn.executemany("INSERT INTO cards VALUES (?, ?, ?, ?, ?)",
+                     ((n, n, n % 20 + 1, n % 3 and 2, n % 730) for n in range(notes)))
+    conn.commit()
+    conn.close()
+    with zipfile.ZipFile(path, 'w') as zf, open(db_path, 'rb') as src:
+        zf.writestr("collection.anki2", b"")
+        with zf.open("collection.anki21b", 'w') as dst:
+            with zstandard.ZstdCompressor().stream_writer(dst, closefd=False) as writer:
+                shutil.copyfileobj(src, writer, DECOMPRESS_CHUNK_SIZE)
+        zf.writestr("media", zstandard.ZstdCompressor().compress(b""))
+    size = db_path.stat().st_size
+    db_path.unlink()
+    return size
+
+def _measure(step):
+    """Run a step, returning its seconds and peak Python memory in MB."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    step()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(seconds, 2), "peak_mb": round(peak / 2**20, 1)}
+
+def benchmark(notes=500_000):
+    """
+    Measure loading a large .anki21b package: streamed decompression against
+    decompressing the whole collection in memory, and the full deck index build.
+
+    Args:
+        notes (int, optional): Notes (and cards) in the synthetic package
+
+    Returns:
+        dict: Collection size, and seconds and peak Python memory of each step
+    """
+    import tempfile
+
+    # The package's own copy of this module, which build_deck_index uses too
+    from . import anki_collection
+    from .deck_index import build_deck_index, file_signature
+
+    cache_dir = anki_collection.COLLECTION_CACHE_DIR
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        anki_collection.COLLECTION_CACHE_DIR = tmpdir / "collections"
+        try:
+            apkg_path = tmpdir / "benchmark.apkg"
+            results["collection_mb"] = round(_write_benchmark_package(apkg_path, notes) / 2**20, 1)
+            results["package_mb"] = round(apkg_path.stat().st_size / 2**20, 1)
+
+            def in_memory():
+                with zipfile.ZipFile(apkg_path) as zf:
+                    data = zstandard.ZstdDecompressor().decompressobj().decompress(zf.read("collection.anki21b"))
+                (tmpdir / "in_memory.sqlite").write_bytes(data)
+
+            def streamed():
+                with zipfile.ZipFile(apkg_path) as zf:
+                    anki_collection.extract_collection(zf, apkg_path, file_signature(apkg_path))
+
+            results["decompress_in_memory"] = _measure(in_memory)
+            results["decompress_streamed"] = _measure(streamed)
+            for path in anki_collection.COLLECTION_CACHE_DIR.iterdir():
+                path.unlink()
+            start = time.perf_counter()
+            index = build_deck_index(apkg_path)
+            results["build_deck_index"] = {"seconds": round(time.perf_counter() - start, 2),
+                                           "cards": len(index.cards), "decks": len(index.decks)}
+            start = time.perf_counter()
+            build_deck_index(apkg_path)
+            results["rebuild_from_cache_seconds"] = round(time.perf_counter() - start, 2)
+        finally:
+            anki_collection.COLLECTION_CACHE_DIR = cache_dir
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.anki_collection [notes]
+    print(json.dumps(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000), indent=2))
@@ -1,17 +1,36 @@
 from pathlib import Path
 import dotenv
-import os
-from openai import OpenAI
 from .text_to_speech import text_to_speech
-from .play_sound import play_sound
+from .audio_player import get_player
+from .play_sound import play_sound, start_sound
 
 dotenv.load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+SOUND_DIR = Path(__file__).parent.parent / "sound"
+FEEDBACK_SOUNDS = {True: SOUND_DIR / "correct.mp3", False: SOUND_DIR / "wrong.mp3"}
+
+def preload_feedback_sounds():
+    """
+    Decode the feedback sounds into memory so they start playing instantly.
+    
+    Returns:
+        bool: True if the in-process player is available and the sounds were loaded
+    """
+    player = get_player()
+    if player is None:
+        return False
+    for sound_file in FEEDBACK_SOUNDS.values():
+        try:
+            player.preload(str(sound_file))
+        except Exception as e:
+            print(f"Could not preload {sound_file.name}: {e}")
+            return False
+    return True
 
 def play_feedback_sound(is_correct):
     """
     Play the appropriate feedback sound based on whether the answer is correct or not.
+    The sound is started in the background when in-process playback is available.
     
     Args:
         is_correct (bool): True if the answer is correct, False otherwise
@@ -19,16 +38,11 @@ def play_feedback_sound(is_correct):
     Returns:
         Path: Path to the played sound file
     """
-    sound_dir = Path(__file__).parent.parent / "sound"
-    sound_dir.mkdir(parents=True, exist_ok=True)
-    
-    if is_correct:
-        sound_file = sound_dir / "correct.mp3"
-    else:
-        sound_file = sound_dir / "wrong.mp3"
+    SOUND_DIR.mkdir(parents=True, exist_ok=True)
+    sound_file = FEEDBACK_SOUNDS[bool(is_correct)]
     
     # Play the sound file
-    success = play_sound(sound_file)
+    success = start_sound(sound_file) is not None or play_sound(sound_file)
     if not success:
         print(f"Could not play sound: {sound_file}")
     
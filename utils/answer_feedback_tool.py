@@ -1,14 +1,11 @@
-from openai import OpenAI
-import os
 import dotenv
 from pathlib import Path
 import json
 from .answer_feedback import process_answer
+from .openai_client import get_client
 
 dotenv.load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Define the tool
 answer_feedback_tool = {
     "type": "function",
@@ -25,9 +22,44 @@ answer_feedback_tool = {
                 "explanation": {
                     "type": "string",
                     "description": "Brief explanation if the answer is incorrect"
+                },
+                "confidence": {
+                    "type": "number",
+                    "description": "How sure you are of the verdict, from 0 (guessing) to 1 (certain)"
+                }
+            },
+            "required": ["is_correct", "confidence"]
+        }
+    }
+}
+
+# Variant of the tool for batched evaluation: the model calls it once per numbered item
+batch_answer_feedback_tool = {
+    "type": "function",
+    "function": {
+        "name": "check_answer",
+        "description": "Check if the answer to one numbered item is correct and provide feedback",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "item": {
+                    "type": "integer",
+                    "description": "The number of the item being evaluated"
+                },
+                "is_correct": {
+                    "type": "boolean",
+                    "description": "Whether the answer is correct or not"
+                },
+                "explanation": {
+                    "type": "string",
+                    "description": "Brief explanation if the answer is incorrect"
+                },
+                "confidence": {
+                    "type": "number",
+                    "description": "How sure you are of the verdict, from 0 (guessing) to 1 (certain)"
                 }
             },
-            "required": ["is_correct"]
+            "required": ["item", "is_correct", "confidence"]
         }
     }
 }
@@ -45,7 +77,7 @@ def get_answer_feedback(user_question, user_answer, correct_answer):
         dict: Feedback information including correctness and explanation
     """
     # Ask the model to determine if the answer is correct
-    response = client.responses.create(
+    response = get_client().responses.create(
         model="gpt-4.1",
         input=f"Question: {user_question}\nUser's answer: {user_answer}\nCorrect answer: {correct_answer}\nIs the user's answer correct?",
         tools=[answer_feedback_tool]
@@ -81,7 +113,7 @@ def handle_followup(user_followup, original_question, correct_answer):
     Returns:
         str: Response to the followup
     """
-    response = client.responses.create(
+    response = get_client().responses.create(
         model="gpt-4.1",
         input=f"Original question: {original_question}\nCorrect answer: {correct_answer}\nUser followup: {user_followup}\nProvide a concise, helpful response to the followup."
     )
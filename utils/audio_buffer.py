@@ -0,0 +1,255 @@
+import asyncio
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import tracemalloc
+
+class AudioRingBuffer:
+    """
+    Fixed-size byte ring between an audio capture callback and an asyncio sender.
+
+    The capture side (a PortAudio callback, or any thread) copies audio into a
+    preallocated bytearray. The sender waits on the event loop until a whole batch is
+    available and copies it out into its own reusable buffer, so no per-chunk objects or
+    thread pool hops are needed. The loop is woken at most once per batch. When the
+    sender falls behind by more than the capacity, the oldest audio is overwritten and
+    counted in `dropped_bytes`.
+    """
+    def __init__(self, capacity):
+        """
+        Initialize the buffer.
+
+        Args:
+            capacity (int): Size of the ring in bytes
+        """
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._lock = threading.Lock()
+        self._read = 0  # Total bytes read so far
+        self._write = 0  # Total bytes written so far
+        self._waiter = None  # (loop, future, wanted bytes) of a sender waiting for data
+        self.dropped_bytes = 0
+        self.closed = False
+
+    def reset(self):
+        """Empty the buffer and reopen it for a new recording."""
+        with self._lock:
+            self._read = self._write = 0
+            self._waiter = None
+            self.dropped_bytes = 0
+            self.closed = False
+
+    def available(self):
+        """Return the number of bytes waiting to be read."""
+        return self._write - self._read
+
+    def write(self, data):
+        """
+        Copy audio into the ring. Safe to call from the capture thread.
+
+        Args:
+            data (bytes-like): The audio to append
+        """
+        data = memoryview(data).cast('B')
+        with self._lock:
+            if self.closed:
+                return
+            if len(data) > self.capacity:
+                self.dropped_bytes += len(data) - self.capacity
+                data = data[-self.capacity:]
+            start = self._write % self.capacity
+            first = min(len(data), self.capacity - start)
+            self._view[start:start + first] = data[:first]
+            self._view[:len(data) - first] = data[first:]
+            self._write += len(data)
+            overrun = self._write - self._read - self.capacity
+            if overrun > 0:
+                self._read += overrun
+                self.dropped_bytes += overrun
+            self._wake_if_ready()
+
+    def readinto(self, out):
+        """
+        Move up to len(out) bytes from the ring into a caller-owned buffer.
+
+        Args:
+            out (memoryview): Writable buffer to fill
+
+        Returns:
+            int: The number of bytes copied
+        """
+        with self._lock:
+            n = min(len(out), self._write - self._read)
+            start = self._read % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self._view[start:start + first]
+            out[first:n] = self._view[:n - first]
+            self._read += n
+            return n
+
+    async def wait(self, min_bytes):
+        """
+        Wait until at least min_bytes can be read or the buffer is closed.
+
+        Args:
+            min_bytes (int): Bytes wanted, e.g. one send batch
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.closed or self._write - self._read >= min_bytes:
+                return
+            future = loop.create_future()
+            self._waiter = (loop, future, min_bytes)
+        await future
+
+    def close(self):
+        """Stop accepting audio and wake the sender so it can drain what is left."""
+        with self._lock:
+            self.closed = True
+            self._wake_if_ready()
+
+    def _wake_if_ready(self):
+        # Called with the lock held
+        if self._waiter is None:
+            return
+        loop, future, wanted = self._waiter
+        if self.closed or self._write - self._read >= wanted:
+            self._waiter = None
+            loop.call_soon_threadsafe(_resolve, future)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+def batch_bytes(rate, batch_ms):
+    """Return the size in bytes of batch_ms of 16-bit mono audio."""
+    return rate * batch_ms // 1000 * 2
+
+class _FakeWebSocket:
+    """Records when audio leaves the pipeline, for the benchmark below."""
+    def __init__(self):
+        self.sent_bytes = 0
+        self.sends = []  # (time, total audio bytes sent)
+
+    async def send(self, message):
+        self.sent_bytes += len(base64.b64decode(json.loads(message)["audio"]))
+        self.sends.append((time.perf_counter(), self.sent_bytes))
+
+def _capture(write, chunk_bytes, seconds, rate, writes):
+    """Feed silence at real-time pace, recording when each byte offset was captured."""
+    chunk = bytes(chunk_bytes)
+    interval = chunk_bytes / 2 / rate
+    total = 0
+    next_time = time.perf_counter()
+    for _ in range(int(seconds / interval)):
+        next_time += interval
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+        total += chunk_bytes
+        writes.append((time.perf_counter(), total))
+        write(chunk)
+
+async def _queue_pipeline(websocket, seconds, rate, chunk_samples, writes):
+    """The previous design: one bytes object and one thread hop per 2048-sample read."""
+    audio_queue = queue.Queue()
+    def record():
+        _capture(lambda chunk: audio_queue.put(bytes(chunk)), chunk_samples * 2, seconds, rate, writes)
+        audio_queue.put(None)
+    thread = threading.Thread(target=record)
+    thread.start()
+    hops = 0
+    while True:
+        hops += 1
+        try:
+            chunk = await asyncio.to_thread(audio_queue.get, timeout=0.1)
+        except queue.Empty:
+            continue
+        if chunk is None:
+            break
+        await websocket.send(json.dumps({"type": "input_audio_buffer.append",
+                                         "audio": base64.b64encode(chunk).decode('utf-8')}))
+    thread.join()
+    return hops
+
+async def _ring_pipeline(websocket, seconds, rate, callback_samples, batch_ms, writes):
+    """The ring buffer design: small callback writes, batched sends from the event loop."""
+    ring = AudioRingBuffer(rate * 2 * 2)
+    def record():
+        _capture(ring.write, callback_samples * 2, seconds, rate, writes)
+        ring.close()
+    thread = threading.Thread(target=record)
+    thread.start()
+    size = batch_bytes(rate, batch_ms)
+    batch = memoryview(bytearray(size))
+    hops = 0
+    while True:
+        if ring.available() < size and not ring.closed:
+            hops += 1
+        await ring.wait(size)
+        n = ring.readinto(batch)
+        if not n and ring.closed:
+            break
+        if n:
+            await websocket.send(json.dumps({"type": "input_audio_buffer.append",
+                                             "audio": base64.b64encode(batch[:n]).decode('utf-8')}))
+    thread.join()
+    return hops
+
+def benchmark(seconds=10.0, rate=16000, batch_ms=100):
+    """
+    Compare the queue-based capture pipeline with the ring buffer one.
+
+    Both pipelines stream the same amount of real-time audio to a fake WebSocket.
+
+    Args:
+        seconds (float, optional): Audio duration per pipeline
+        rate (int, optional): Sample rate
+        batch_ms (int, optional): Send batch size for the ring buffer pipeline
+
+    Returns:
+        dict: Per pipeline: CPU milliseconds per second of audio, send messages and event
+            loop thread hops per second, peak traced memory, and p50/p95 latency from
+            the oldest audio in a send being spoken to the send
+    """
+    results = {}
+    pipelines = {
+        "queue": lambda ws, writes: _queue_pipeline(ws, seconds, rate, 2048, writes),
+        "ring": lambda ws, writes: _ring_pipeline(ws, seconds, rate, 320, batch_ms, writes),
+    }
+    for name, pipeline in pipelines.items():
+        websocket = _FakeWebSocket()
+        writes = []
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        hops = asyncio.run(pipeline(websocket, writes))
+        cpu = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Audio is captured in real time, so the byte at offset x was spoken at t0 + x / byte
+        # rate. A send's latency is the age of the oldest audio it carries, which includes
+        # the time spent waiting for the rest of its chunk or batch to be captured.
+        t0 = writes[0][0] - writes[0][1] / (2 * rate)
+        latencies = []
+        previous_total = 0
+        for sent_at, sent_total in websocket.sends:
+            latencies.append(sent_at - (t0 + previous_total / (2 * rate)))
+            previous_total = sent_total
+        latencies.sort()
+        results[name] = {
+            "cpu_ms_per_audio_s": round(cpu / seconds * 1000, 2),
+            "sends_per_s": round(len(websocket.sends) / seconds, 1),
+            # Worker thread round trips (queue) or cross-thread wake-ups (ring) of the event loop
+            "thread_hops_per_s": round(hops / seconds, 1),
+            "peak_traced_kib": round(peak / 1024, 1),
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        }
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.audio_buffer
+    print(json.dumps(benchmark(float(os.getenv("BENCHMARK_SECONDS", "10"))), indent=2))
@@ -0,0 +1,268 @@
+import collections
+import subprocess
+import sys
+import threading
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+try:
+    import miniaudio
+except ImportError:
+    miniaudio = None
+
+# Output format of the playback stream; every sound is decoded to this once
+OUTPUT_RATE = 24000
+# 20 ms per callback keeps the delay before a queued sound starts short
+FRAMES_PER_BUFFER = 480
+
+def _read_wav(path, rate):
+    """Decode a 16-bit WAV file to mono PCM at the given rate, without extra packages."""
+    with wave.open(str(path), 'rb') as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16-bit PCM")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        channels, source_rate = wf.getnchannels(), wf.getframerate()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if source_rate != rate:
+        positions = np.arange(0, len(samples), source_rate / rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return np.asarray(samples, dtype=np.int16).tobytes()
+
+def decode_sound(path, rate=OUTPUT_RATE):
+    """
+    Decode a sound file to mono 16-bit PCM.
+
+    MP3 (and other compressed formats) need the optional miniaudio package; WAV files
+    can always be decoded.
+
+    Args:
+        path (str or Path): Path to the sound file
+        rate (int, optional): Sample rate to convert to
+
+    Returns:
+        bytes: The PCM samples
+    """
+    path = Path(path)
+    if miniaudio is not None:
+        decoded = miniaudio.decode_file(str(path), output_format=miniaudio.SampleFormat.SIGNED16,
+                                        nchannels=1, sample_rate=rate)
+        return decoded.samples.tobytes()
+    if path.suffix.lower() == ".wav":
+        return _read_wav(path, rate)
+    raise ValueError(f"Decoding {path.suffix} files requires the miniaudio package")
+
+class PlayingSound:
+    """
+    Handle for a sound played (or queued) by the AudioPlayer.
+    """
+    def __init__(self, player, pcm, name=None):
+        self.name = name
+        self.duration = len(pcm) / 2 / OUTPUT_RATE
+        self.queued_at = time.perf_counter()
+        self.started_at = None  # perf_counter() when its first samples were handed to the device
+        self.stopped_at = None  # perf_counter() when it was cancelled part-way through
+        self._player = player
+        self._pcm = memoryview(pcm)
+        self._position = 0
+        self._done = threading.Event()
+
+    def is_playing(self):
+        """Return True while the sound is queued or playing."""
+        return not self._done.is_set()
+
+    def stop(self):
+        """Cancel the sound, whether it is playing or still queued."""
+        self._player.cancel(self)
+
+    def wait(self, timeout=None):
+        """
+        Block until the sound has finished or been cancelled.
+
+        Returns:
+            bool: True if it finished within the timeout
+        """
+        return self._done.wait(timeout)
+
+    def time_saved(self):
+        """
+        Get the part of the sound that was skipped by stopping it early.
+
+        Returns:
+            float: Seconds of audio that didn't have to be listened to
+        """
+        if self.stopped_at is None:
+            return 0.0
+        if self.started_at is None:
+            return self.duration
+        return max(0.0, self.duration - (self.stopped_at - self.started_at))
+
+class AudioPlayer:
+    """
+    In-process playback through one persistent output stream.
+
+    The stream runs for the life of the player and plays silence when idle, so a new
+    sound starts within one buffer (20 ms) of play() with no process spawn. Sounds
+    play one after another from a queue; play() never blocks. Frequently used sounds
+    (the feedback cues) are decoded once with preload() and kept in memory.
+    """
+    def __init__(self):
+        if pyaudio is None:
+            raise RuntimeError("PyAudio is not installed")
+        self._lock = threading.Lock()
+        self._queue = collections.deque()  # PlayingSound objects, the head is playing
+        self._sounds = {}  # {name: PCM bytes} of preloaded sounds
+        self._buffer = bytearray(FRAMES_PER_BUFFER * 2)
+        self._pyaudio = pyaudio.PyAudio()
+        self._stream = self._pyaudio.open(format=pyaudio.paInt16,
+                                          channels=1,
+                                          rate=OUTPUT_RATE,
+                                          output=True,
+                                          frames_per_buffer=FRAMES_PER_BUFFER,
+                                          stream_callback=self._callback)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        # Runs on the PortAudio thread: copy queued PCM into the output buffer
+        needed = frame_count * 2
+        if len(self._buffer) != needed:
+            self._buffer = bytearray(needed)
+        out = self._buffer
+        filled = 0
+        with self._lock:
+            while filled < needed and self._queue:
+                sound = self._queue[0]
+                if sound.started_at is None:
+                    sound.started_at = time.perf_counter()
+                chunk = sound._pcm[sound._position:sound._position + needed - filled]
+                out[filled:filled + len(chunk)] = chunk
+                filled += len(chunk)
+                sound._position += len(chunk)
+                if sound._position >= len(sound._pcm):
+                    self._queue.popleft()
+                    sound._done.set()
+        out[filled:needed] = bytes(needed - filled)
+        return (bytes(out), pyaudio.paContinue)
+
+    def preload(self, name, path=None):
+        """
+        Decode a sound once and keep it in memory.
+
+        Args:
+            name (str): Name to play it by
+            path (str or Path, optional): The file to decode. Defaults to name.
+        """
+        self._sounds[name] = decode_sound(path or name)
+
+    def can_play(self, sound):
+        """Return True if the sound is preloaded or its format can be decoded."""
+        return str(sound) in self._sounds or miniaudio is not None or Path(sound).suffix.lower() == ".wav"
+
+    def play(self, sound, interrupt=False):
+        """
+        Queue a sound and return immediately.
+
+        Args:
+            sound (str or Path): A preloaded sound's name or a file to decode
+            interrupt (bool, optional): Cancel whatever is playing or queued first
+
+        Returns:
+            PlayingSound: Handle for waiting on or cancelling the sound
+        """
+        name = str(sound)
+        pcm = self._sounds.get(name)
+        if pcm is None:
+            pcm = decode_sound(sound)
+        playing = PlayingSound(self, pcm, name)
+        with self._lock:
+            if interrupt:
+                self._cancel_all()
+            self._queue.append(playing)
+        return playing
+
+    def cancel(self, playing):
+        """
+        Cancel one sound.
+
+        Args:
+            playing (PlayingSound): The sound to cancel
+        """
+        with self._lock:
+            if playing in self._queue:
+                self._queue.remove(playing)
+                playing.stopped_at = time.perf_counter()
+            playing._done.set()
+
+    def stop_all(self):
+        """Cancel everything that is playing or queued."""
+        with self._lock:
+            self._cancel_all()
+
+    def _cancel_all(self):
+        # Called with the lock held
+        now = time.perf_counter()
+        while self._queue:
+            playing = self._queue.popleft()
+            playing.stopped_at = now
+            playing._done.set()
+
+    def close(self):
+        """Stop playback and close the output stream."""
+        self.stop_all()
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pyaudio.terminate()
+
+_player = None
+_player_lock = threading.Lock()
+_player_failed = False
+
+def get_player():
+    """
+    Get the process-wide audio player, opening the output stream on first use.
+
+    Returns:
+        AudioPlayer: The shared player, or None if audio output isn't available
+    """
+    global _player, _player_failed
+    if _player is None and not _player_failed:
+        with _player_lock:
+            if _player is None and not _player_failed:
+                try:
+                    _player = AudioPlayer()
+                except Exception as e:
+                    print(f"In-process audio playback unavailable ({e}); using external players.")
+                    _player_failed = True
+    return _player
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.audio_player [sound files...]
+    # Measures how long preloaded sounds take to start, against spawning a player process.
+    sound_dir = Path(__file__).parent.parent / "sound"
+    paths = sys.argv[1:] or [str(sound_dir / "correct.mp3"), str(sound_dir / "wrong.mp3")]
+    player = get_player()
+    if player is None:
+        sys.exit(1)
+    for path in paths:
+        start = time.perf_counter()
+        player.preload(path)
+        print(f"Decoded {path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for path in paths:
+        playing = player.play(path)
+        playing.wait()
+        print(f"{Path(path).name}: started {(playing.started_at - playing.queued_at) * 1000:.1f} ms after play()")
+    for command in (["aplay", "--version"], ["afplay", "-h"]):
+        try:
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            print(f"Spawning {command[0]} alone takes {(time.perf_counter() - start) * 1000:.1f} ms")
+        except OSError:
+            continue
+    player.close()
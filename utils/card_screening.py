@@ -0,0 +1,76 @@
+import collections
+import json
+import re
+import sys
+
+from .deck_media import image_references
+
+# How a card depends on pictures, decided once when its deck is loaded
+TEXTUAL = "textual"    # answerable from its text alone
+IMAGE = "image"        # refers to a picture that the text doesn't describe
+OCCLUDED = "occluded"  # the cloze deletion hides part of a picture
+VISUAL_KINDS = (TEXTUAL, IMAGE, OCCLUDED)
+
+# Questions with an image and fewer words than this are about the image itself
+MIN_TEXT_WORDS = 4
+
+# Cloze deletions over an <img> tag, or Anki's image occlusion shapes
+_OCCLUSION_RE = re.compile(r"\{\{c\d+::\s*(?:<img\b|image-occlusion:)", re.IGNORECASE)
+# Phrases that point at a picture on the card: a deictic word and a figure noun
+_VISUAL_PHRASE_RE = re.compile(
+    r"\b(?:this|these|following|above|below)\s+(?:diagram|image|picture|figure|photo|photograph|graph|chart|"
+    r"drawing|illustration|map|x-ray|scan|micrograph|slide)s?\b",
+    re.IGNORECASE
+)
+# Phrases that only point at a picture when the card has one ("shown", "labeled A", "the arrow", "in red")
+_IMAGE_PHRASE_RE = re.compile(
+    r"\b(?:[Ss]hown|[Pp]ictured|[Dd]epicted|[Ii]llustrated|[Hh]ighlighted|[Cc]ircled|[Oo]utlined|[Bb]oxed)\b"
+    r"|\b(?:[Ll]abell?ed|[Mm]arked|[Ii]ndicated|[Nn]umbered)\s+(?:with\s+|as\s+|by\s+)?(?:\{blank\}|[A-Z0-9]\b)"
+    r"|\b[Aa]rrows?\b"
+    r"|\b[Ii]n\s+(?:red|blue|green|yellow|orange|purple)\b"
+)
+
+def screen_card(model_name, question_html, question_text):
+    """
+    Decide whether a card can be answered without seeing a picture.
+
+    Args:
+        model_name (str): Name of the note type
+        question_html (str): The raw HTML of the question side (the cloze field for cloze notes)
+        question_text (str): The rendered question, with HTML removed and blanks as "{blank}"
+
+    Returns:
+        str: OCCLUDED, IMAGE or TEXTUAL
+    """
+    if "occlusion" in model_name.lower() or _OCCLUSION_RE.search(question_html):
+        return OCCLUDED
+    if _VISUAL_PHRASE_RE.search(question_text):
+        return IMAGE
+    if image_references(question_html):
+        if _IMAGE_PHRASE_RE.search(question_text):
+            return IMAGE
+        if len(re.findall(r"\w+", question_text.replace("{blank}", ""))) < MIN_TEXT_WORDS:
+            return IMAGE
+    return TEXTUAL
+
+def count_visual_kinds(cards):
+    """
+    Count the cards of each kind.
+
+    Args:
+        cards (dict): {card_id: card dict with a 'visual' key}
+
+    Returns:
+        dict: {kind: cards} for every kind in VISUAL_KINDS
+    """
+    counts = collections.Counter(card['visual'] for card in cards.values())
+    return {kind: counts.get(kind, 0) for kind in VISUAL_KINDS}
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.card_screening path/to/deck.apkg
+    from .deck_index import build_deck_index
+    index = build_deck_index(sys.argv[1])
+    print(json.dumps(count_visual_kinds(index.cards), indent=2))
+    for card in index.cards.values():
+        if card['visual'] != TEXTUAL:
+            print(f"[{card['visual']}] {card['question'][:100]}")
@@ -1,48 +1,40 @@
 import random
-import sqlite3
-import zipfile
-import json
-import os
-import tempfile
-import re
-import html
 import sys
 from pathlib import Path
 
 # Add parent directory to sys.path to make imports work when running as script
 sys.path.append(str(Path(__file__).parent.parent))
-from utils.extract_categories import get_categories_from_apkg
+from utils.card_screening import TEXTUAL
+from utils.deck_index import strip_html
+from utils.deck_registry import get_registry
 
-def strip_html(text):
-    """Remove HTML tags and decode HTML entities."""
-    # First remove HTML tags
-    text = re.sub(r'<.*?>', '', text)
-    # Then decode HTML entities
-    text = html.unescape(text)
-    # Replace non-breaking spaces (\xa0) with regular spaces
-    text = text.replace('\xa0', ' ')
-    return text
+# Best-ranked matches per deck that a query's problem is picked from
+QUERY_POOL_SIZE = 200
 
 def get_categories():
     """
     Get a list of available categories.
     
     Returns:
-        list: List of category names
+        list: List of full deck names, parents included
     """
-    return [cat.split("::")[-1] for cat in get_categories_from_apkg() if "::" in cat]
+    return get_registry().categories()
 
-def choose_random_problem(apkg_path=None, deck=None, debug=False):
+def choose_random_problem(apkg_path=None, deck=None, debug=False, textual_only=False):
     """
     Choose a random problem from the specified deck.
     
     Args:
-        apkg_path (str): Path to the Anki package file
-        deck (str): Name of the deck to choose from (without the "MileDown's MCAT Decks::" prefix)
+        apkg_path (str): Path to an Anki package file. If None, every deck in the registry is searched.
+        deck (str): Name of the deck to choose from (a full deck name or its last component).
+            Cards in its sub-decks are included.
         debug (bool): Whether to print debug info
+        textual_only (bool): Skip cards that can't be answered without seeing a picture
         
     Returns:
-        dict: A problem with 'question' and 'answer' keys
+        dict: A problem with 'question' and 'answer' keys, plus the 'deck' key and 'card_id' it
+            came from, the 'media'/'answer_media' file names each side references and
+            whether it depends on a picture ('visual')
     """
     if isinstance(deck, int):
         # If deck is an integer, treat it as a category index
@@ -51,79 +43,73 @@ def choose_random_problem(apkg_path=None, deck=None, debug=False):
             raise ValueError(f"Category index out of range: {deck}")
         deck = categories[deck]
     
-    # If apkg_path is None, use the default path
-    if apkg_path is None:
-        apkg_path = str(Path(__file__).parent.parent / "MCAT_Milesdown.apkg")
-    
-    # Add the prefix to the deck name
-    deck_prefix = "MileDown's MCAT Decks::"
-    target_deck_name = f"{deck_prefix}{deck}"
-
-    with zipfile.ZipFile(apkg_path, 'r') as zf:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            zf.extract('collection.anki2', tmpdir)
-            db_path = os.path.join(tmpdir, 'collection.anki2')
-            conn = sqlite3.connect(db_path)
-            cur = conn.cursor()
+    registry = get_registry()
+    if apkg_path is not None:
+        indexes = [registry.index_for_path(apkg_path)]
+    else:
+        indexes = list(registry.decks().values())
 
-            # Get deck info
-            cur.execute("SELECT decks FROM col")
-            decks = json.loads(cur.fetchone()[0])
-            # Find the deck id for the target deck
-            deck_id = None
-            for did, d in decks.items():
-                if d['name'] == target_deck_name:
-                    deck_id = int(did)
-                    break
-            if debug:
-                print(f"Deck found: {deck_id is not None}, deck_id: {deck_id}")
-            if deck_id is None:
-                conn.close()
-                return None
+    # Collect the card lists of every matching deck without copying them
+    pools = []
+    for index in indexes:
+        for deck_id in index.deck_ids_under(deck):
+            card_ids = (index.textual_cards_by_deck if textual_only else index.cards_by_deck).get(deck_id)
+            if card_ids:
+                pools.append((index, card_ids))
+    if debug:
+        print(f"Number of cards matching '{deck}': {sum(len(card_ids) for _, card_ids in pools)}")
+    return _pick_from_pools(pools, debug)
 
-            # Get note types (models)
-            cur.execute("SELECT models FROM col")
-            models = json.loads(cur.fetchone()[0])
-            model_names = {str(mid): m['name'] for mid, m in models.items()}
-
-            # Get all cards in the target deck
-            cur.execute("SELECT nid FROM cards WHERE did = ?", (deck_id,))
-            note_ids = [row[0] for row in cur.fetchall()]
-            if debug:
-                print(f"Number of cards in deck: {len(note_ids)}")
-            if not note_ids:
-                conn.close()
-                return None
+def choose_problem_for_query(query, debug=False, textual_only=False):
+    """
+    Choose a random problem from the best QUERY_POOL_SIZE cards of each deck matching a search query.
 
-            # Choose a random note id
-            chosen_nid = random.choice(note_ids)
+    Args:
+        query (str): Free-text query, e.g. "enzyme kinetics"
+        debug (bool): Whether to print debug info
+        textual_only (bool): Skip cards that can't be answered without seeing a picture
 
-            # Get the note info
-            cur.execute("SELECT id, mid, flds FROM notes WHERE id = ?", (chosen_nid,))
-            row = cur.fetchone()
-            if not row:
-                conn.close()
-                return None
-            note_id, mid, flds = row
-            model_name = model_names.get(str(mid), "Unknown")
-            if debug:
-                print(f"Note type: {model_name}")
-            fields = flds.split('\x1f')
+    Returns:
+        dict: A problem in the same format as choose_random_problem, or None if nothing matches
+    """
+    pools = []
+    for index in get_registry().decks().values():
+        if index.search_index is None:
+            continue
+        results, _ = index.search_index.search(query, limit=QUERY_POOL_SIZE)
+        card_ids = [card_id for card_id, _ in results
+                    if not textual_only or index.cards[card_id]['visual'] == TEXTUAL]
+        if card_ids:
+            pools.append((index, card_ids))
+    if debug:
+        print(f"Number of cards matching query '{query}': {sum(len(card_ids) for _, card_ids in pools)}")
+    return _pick_from_pools(pools, debug)
 
-            # Structure the output
-            model_name_lower = model_name.lower()
-            if 'cloze' in model_name_lower:
-                cloze_text = fields[0]
-                question = re.sub(r"{{c\d+::(.*?)}}", "{blank}", cloze_text)
-                answer = re.sub(r"{{c\d+::(.*?)}}", r"\1", cloze_text)
-                result = {'question': strip_html(question), 'answer': strip_html(answer)}
-            elif 'basic' in model_name_lower and len(fields) >= 2:
-                result = {'question': strip_html(fields[0]), 'answer': strip_html(fields[1])}
-            else:
-                result = None
+def _pick_from_pools(pools, debug=False):
+    """Pick a card uniformly across several (DeckIndex, [card_id, ...]) pools."""
+    total = sum(len(card_ids) for _, card_ids in pools)
+    if not total:
+        return None
+    pick = random.randrange(total)
+    for index, card_ids in pools:
+        if pick < len(card_ids):
+            card = index.cards[card_ids[pick]]
+            break
+        pick -= len(card_ids)
+    if debug:
+        print(f"Deck: {index.key}, note type: {card['model']}")
+    return _problem_from_card(index, card)
 
-            conn.close()
-            return result
+def _problem_from_card(index, card):
+    return {
+        'question': card['question'],
+        'answer': card['answer'],
+        'deck': index.key,
+        'card_id': card['id'],
+        'media': card['media'],
+        'answer_media': card['answer_media'],
+        'visual': card['visual'],
+    }
 
 if __name__ == "__main__":
     # Example usage
@@ -132,8 +118,8 @@ if __name__ == "__main__":
     for i, category in enumerate(categories):
         print(f"{i+1}. {category}")
     
-    category_index = int(input("Select a category (1-5): ")) - 1
+    category_index = int(input(f"Select a category (1-{len(categories)}): ")) - 1
     problem = choose_random_problem(deck=category_index)
     
     print(f"\nQuestion: {problem['question']}")
-    print(f"Answer: {problem['answer']}") 
\ No newline at end of file
+    print(f"Answer: {problem['answer']}")
@@ -0,0 +1,10 @@
+import os
+from pathlib import Path
+
+import dotenv
+
+dotenv.load_dotenv()
+
+PROJECT_ROOT = Path(__file__).parent.parent
+# Directory for runtime state such as saved queries and caches
+DATA_DIR = Path(os.getenv("DATA_DIR") or PROJECT_ROOT / "data")
@@ -1,82 +1,368 @@
-from openai import OpenAI
+from openai import RateLimitError
 import os
 import dotenv
+import contextlib
 import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from .answer_feedback import process_answer
+from . import metrics
+from . import model_router
+from . import admission
+from .verdict_cache import get_verdict_cache, verdict_key
+from .card_screening import TEXTUAL
+from .openai_client import get_client
+from prompts.prompts import related_cards_template
 
 dotenv.load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Token budget for follow-up conversation history, beyond the pinned card context
+FOLLOWUP_HISTORY_TOKENS = int(os.getenv("FOLLOWUP_HISTORY_TOKENS") or "1500")
+# How questions of cards screened as textual are presented: "short" sends them with the
+# short prompt, "skip" reads them out as written without a model call, "full" treats them
+# like every other card
+TEXTUAL_QUESTIONS = os.getenv("TEXTUAL_QUESTIONS") or "short"
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+# Returned when the model doesn't call the check_answer tool
+UNDETERMINED_VERDICT = {
+    "is_correct": False,
+    "explanation": "Could not determine answer correctness."
+}
+
+def is_undetermined(verdict):
+    """Return True for UNDETERMINED_VERDICT, which must not be recorded or cached as a wrong answer."""
+    return verdict == UNDETERMINED_VERDICT
+
+def create_chat_completion(call_type, **kwargs):
+    """
+    Create a chat completion and record its latency and token usage.
+
+    The call waits for a slot from the chat admission controller first.
+
+    Args:
+        call_type (str): What the call is for, used to group metrics (e.g. "evaluate")
+        **kwargs: Arguments for get_client().chat.completions.create
+
+    Returns:
+        The response from the OpenAI API
+
+    Raises:
+        admission.Overloaded: If too many calls are waiting, or the API's rate limit was hit
+    """
+    tokens = sum(count_message_tokens(m) for m in kwargs.get("messages", []))
+    with admission.get_controller("chat").slot(tokens):
+        start = time.perf_counter()
+        try:
+            response = get_client().chat.completions.create(**kwargs)
+        except RateLimitError as e:
+            raise admission.Overloaded(f"Chat API rate limit reached: {e}", admission.rate_limit_retry_after(e))
+        latency = time.perf_counter() - start
+    metrics.record_call(call_type, kwargs.get("model"), latency, getattr(response, "usage", None))
+    model_router.observe(call_type, kwargs.get("model"), latency)
+    return response
+
+def count_tokens(text):
+    """
+    Count the tokens in a piece of text.
+    
+    Uses tiktoken when it is installed, otherwise estimates ~4 characters per token.
+    
+    Args:
+        text (str): The text to count
+        
+    Returns:
+        int: The number of tokens
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+def count_message_tokens(message):
+    """Count the tokens of one chat message, including the per-message overhead."""
+    return count_tokens(message.get("content") or "") + 4
 
 class Conversation:
-    def __init__(self, system_prompt):
+    """
+    A chat history with pinned context and a token budget for the turns after it.
+
+    One conversation may be shared by concurrent requests (see ConversationStore), so
+    every change to its history is made under the conversation's own lock, and a turn
+    (the user's message and the reply) is added as a whole.
+    """
+    def __init__(self, system_prompt, max_history_tokens=None, summarize=False, call_type="conversation"):
         """
         Initialize a conversation with a system prompt.
         
         Args:
             system_prompt (str): The system prompt to use for the conversation
+            max_history_tokens (int, optional): Token budget for the turns after the pinned
+                messages. Oldest turns are evicted once it is exceeded. None keeps everything.
+            summarize (bool, optional): Fold evicted turns into a running summary instead
+                of dropping them outright
+            call_type (str, optional): Name the conversation's calls are recorded under in metrics
         """
         self.system_prompt = system_prompt
+        self.call_type = call_type
+        self.max_history_tokens = max_history_tokens
+        self.summarize = summarize
+        self.summary = ""
         self.messages = []
-        self.add_message("system", system_prompt)
+        self.pinned = 0  # Number of leading messages that are never evicted
+        self._lock = threading.RLock()
+        self._trim_thread = None  # Trim started after the last reply, while it runs
+        self.add_message("system", system_prompt, pinned=True)
     
-    def add_message(self, role, content):
+    def add_message(self, role, content, pinned=False):
         """
         Add a message to the conversation.
         
         Args:
             role (str): The role of the message sender ("system", "user", or "assistant")
             content (str): The content of the message
+            pinned (bool, optional): Keep the message however long the conversation gets,
+                e.g. the card a follow-up conversation is about. Pinned messages must be
+                added before any unpinned ones.
         """
-        self.messages.append({"role": role, "content": content})
+        with self._lock:
+            self.messages.append({"role": role, "content": content})
+            if pinned:
+                self.pinned = len(self.messages)
     
-    def get_response(self, tools=None):
+    def history_tokens(self):
+        """Count the tokens in the evictable part of the conversation."""
+        return sum(count_message_tokens(m) for m in self.messages[self.pinned:])
+    
+    def trim_history(self):
         """
-        Get a response from the OpenAI API based on the conversation history.
+        Evict the oldest turns until the history fits in max_history_tokens.
         
-        Args:
-            tools (list, optional): List of tools to make available to the model
-            
-        Returns:
-            The response from the OpenAI API
+        The newest message is always kept. When summarize is set, evicted turns are
+        condensed into a summary message that takes their place. The lock isn't held
+        while the summary is written; turns wait for a trim in progress (see _turn_lock).
         """
+        with self._lock:
+            if self.max_history_tokens is None:
+                return
+            
+            evicted = []
+            while self.history_tokens() > self.max_history_tokens and len(self.messages) - self.pinned > 1:
+                start = self.pinned
+                # An existing summary message is folded into the next summary
+                if self.summary and self.messages[start].get("name") == "summary":
+                    self.messages.pop(start)
+                    continue
+                evicted.append(self.messages.pop(start))
+            if not evicted or not self.summarize:
+                return
+        
+        try:
+            summary = self._summarize(evicted)
+        except Exception as e:
+            # The evicted turns are dropped without a summary, as if summarize were off
+            print(f"Error summarizing conversation history: {e}")
+            return
+        with self._lock:
+            self.summary = summary
+            self.messages.insert(self.pinned, {
+                "role": "system",
+                "name": "summary",
+                "content": f"Summary of the earlier conversation: {self.summary}"
+            })
+            # The summary itself may push a tiny budget over; drop turns again if so
+            while self.history_tokens() > self.max_history_tokens and len(self.messages) - self.pinned > 2:
+                self.messages.pop(self.pinned + 1)
+    
+    def _summarize(self, evicted):
+        """Condense evicted messages (and any previous summary) into a short summary."""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in evicted)
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n{transcript}"
+        response = create_chat_completion(
+            "summarize",
+            model=model_router.choose_model("summarize"),
+            messages=[
+                {"role": "system", "content": "Summarize this conversation in at most three short sentences, keeping facts the student asked about."},
+                {"role": "user", "content": transcript}
+            ]
+        )
+        return response.choices[0].message.content
+    
+    @contextlib.contextmanager
+    def _turn_lock(self):
+        """Hold the lock for a turn, once a trim started after the previous turn has finished."""
+        self._lock.acquire()
+        try:
+            while self._trim_thread is not None:
+                thread = self._trim_thread
+                self._lock.release()
+                try:
+                    thread.join()
+                finally:
+                    self._lock.acquire()
+            yield
+        finally:
+            self._lock.release()
+    
+    def _get_response(self, tools=None):
+        # Called with the lock held
         kwargs = {
-            "model": "gpt-4.1",
-            "messages": self.messages
+            "model": model_router.choose_model(self.call_type),
+            "messages": list(self.messages)
         }
         
         if tools:
             kwargs["tools"] = tools
         
-        response = client.chat.completions.create(**kwargs)
+        response = create_chat_completion(self.call_type, **kwargs)
         
         # Add the model's response to the conversation history
         self.add_message("assistant", response.choices[0].message.content)
         
+        if self.max_history_tokens is not None and self.history_tokens() > self.max_history_tokens:
+            # The next turn waits for this trim, so it never goes out over budget
+            self._trim_thread = threading.Thread(target=self._trim_in_background, name="conversation-trim", daemon=True)
+            self._trim_thread.start()
         return response
     
+    def get_response(self, tools=None):
+        """
+        Get a response from the OpenAI API based on the conversation history.
+        
+        The history is brought back within the token budget after the reply, on a
+        background thread, so summarizing evicted turns doesn't hold up this response.
+        The next turn waits for that trim to finish.
+        
+        Args:
+            tools (list, optional): List of tools to make available to the model
+            
+        Returns:
+            The response from the OpenAI API
+        """
+        with self._turn_lock():
+            return self._get_response(tools)
+    
+    def _trim_in_background(self):
+        with admission.background():
+            try:
+                self.trim_history()
+            except Exception as e:
+                print(f"Error trimming conversation history: {e}")
+            finally:
+                with self._lock:
+                    self._trim_thread = None
+    
+    def ask(self, content, tools=None):
+        """
+        Add a user message and get the response to it, as one turn.
+        
+        If the call fails, the message is taken back out, so the history never holds a
+        question without its reply.
+        
+        Args:
+            content (str): The user's message
+            tools (list, optional): List of tools to make available to the model
+            
+        Returns:
+            The response from the OpenAI API
+        """
+        with self._turn_lock():
+            self.add_message("user", content)
+            try:
+                return self._get_response(tools)
+            except Exception:
+                self.messages.pop()
+                raise
+    
     def reset(self):
         """
-        Reset the conversation to just the system prompt.
+        Reset the conversation to just the pinned messages.
         """
-        self.messages = [{"role": "system", "content": self.system_prompt}]
+        with self._turn_lock():
+            self.messages = self.messages[:self.pinned]
+            self.summary = ""
 
-def get_question_response(question, answer, prompt_template):
+class ConversationStore:
+    """
+    Bounded, thread-safe store of live conversations keyed by id.
+    
+    Conversations idle for longer than ttl seconds, or beyond max_conversations,
+    are dropped oldest first.
+    """
+    def __init__(self, max_conversations=1000, ttl=3600):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict()  # {id: (last_used, Conversation)}
+        self._lock = threading.Lock()
+    
+    def get(self, conversation_id):
+        """Get a conversation by id, or None if it doesn't exist or has expired."""
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._conversations.pop(conversation_id, None)
+                return None
+            self._conversations[conversation_id] = (time.monotonic(), entry[1])
+            self._conversations.move_to_end(conversation_id)
+            return entry[1]
+    
+    def create(self, conversation):
+        """
+        Store a new conversation.
+        
+        Args:
+            conversation (Conversation): The conversation to store
+            
+        Returns:
+            str: The new conversation's id
+        """
+        conversation_id = uuid.uuid4().hex
+        with self._lock:
+            self._conversations[conversation_id] = (time.monotonic(), conversation)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        return conversation_id
+
+def get_question_response(question, answer, prompt_template, visual=None, textual_prompt_template=None):
     """
     Get a response for presenting a question to the user.
     
+    Cards screened as textual when their deck was loaded don't need prompt_template's
+    handling of visual dependencies; see TEXTUAL_QUESTIONS. The prompt tokens this saves
+    are recorded in metrics.
+    
     Args:
         question (str): The question to present
         answer (str): The correct answer (not shown to user)
         prompt_template (str): The prompt template to use
+        visual (str, optional): The card's 'visual' screening result, e.g. "textual"
+        textual_prompt_template (str, optional): The shorter template for textual cards
         
     Returns:
         str: The response text
     """
     prompt = prompt_template.format(question=question, answer=answer)
+    full_tokens = count_tokens(prompt)
+    kind = "full"
+    if visual == TEXTUAL and TEXTUAL_QUESTIONS == "skip":
+        metrics.record_prompt_savings("format_question", full_tokens, 0, "skipped")
+        return " ".join(question.replace("{blank}", "[blank]").split())
+    if visual == TEXTUAL and TEXTUAL_QUESTIONS == "short" and textual_prompt_template:
+        prompt = textual_prompt_template.format(question=question, answer=answer)
+        kind = "short"
+    metrics.record_prompt_savings("format_question", full_tokens, count_tokens(prompt), kind)
     
-    response = client.chat.completions.create(
-        model="gpt-4.1",
+    # Long cards and cards with several blanks go straight to the larger model
+    escalate = "complex_card" if model_router.is_complex_card(question, answer) else None
+    response = create_chat_completion(
+        "format_question",
+        model=model_router.choose_model("format_question", escalate),
         messages=[
             {"role": "system", "content": "You are a friendly study assistant."},
             {"role": "user", "content": prompt}
@@ -85,9 +371,26 @@ def get_question_response(question, answer, prompt_template):
     
     return response.choices[0].message.content
 
-def evaluate_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool):
+def _verdict_from_args(args):
+    """Build a verdict dict from check_answer tool arguments."""
+    verdict = {"is_correct": args.get("is_correct")}
+    if args.get("explanation"):
+        verdict["explanation"] = args["explanation"]
+    return verdict
+
+def _confidence_from_args(args):
+    """Read the optional confidence a check_answer tool call reports, or None."""
+    try:
+        return float(args["confidence"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def check_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool, escalate=None):
     """
-    Evaluate if the user's answer is correct.
+    Ask the model whether the user's answer is correct, without any side effects.
+    
+    The call is routed to the small model first; verdicts it isn't confident about, or
+    doesn't give at all, are checked again by the larger model.
     
     Args:
         question (str): The original question
@@ -95,9 +398,11 @@ def evaluate_answer(question, user_answer, correct_answer, evaluation_prompt, an
         correct_answer (str): The correct answer
         evaluation_prompt (str): The prompt template for evaluation
         answer_feedback_tool (dict): The tool definition for answer feedback
+        escalate (str, optional): Why to go straight to the larger model, e.g. "low_confidence"
         
     Returns:
-        dict: Feedback information including correctness and explanation
+        dict: The verdict, with 'is_correct' and optionally 'explanation', or None if the
+            model did not call the tool
     """
     prompt = evaluation_prompt.format(
         question=question,
@@ -105,8 +410,10 @@ def evaluate_answer(question, user_answer, correct_answer, evaluation_prompt, an
         answer=correct_answer
     )
     
-    response = client.chat.completions.create(
-        model="gpt-4.1",
+    model = model_router.choose_model("evaluate", escalate)
+    response = create_chat_completion(
+        "evaluate",
+        model=model,
         messages=[
             {"role": "system", "content": "You are a fair and helpful evaluator."},
             {"role": "user", "content": prompt}
@@ -115,24 +422,274 @@ def evaluate_answer(question, user_answer, correct_answer, evaluation_prompt, an
     )
     
     # Extract the tool call from the response
+    verdict, confidence = None, None
     if response.choices[0].message.tool_calls:
         tool_call = response.choices[0].message.tool_calls[0]
         if tool_call.function.name == "check_answer":
             args = json.loads(tool_call.function.arguments)
-            is_correct = args.get("is_correct")
-            explanation = args.get("explanation")
-            
-            # Process the answer and play appropriate sound
-            result = process_answer(is_correct, explanation)
-            return result
-    
-    # If no tool call was made, return default response
-    return {
-        "is_correct": False,
-        "explanation": "Could not determine answer correctness."
+            verdict, confidence = _verdict_from_args(args), _confidence_from_args(args)
+    if escalate is None and model_router.should_escalate("evaluate", model, confidence if verdict else None):
+        return check_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool,
+                            escalate="low_confidence")
+    return verdict
+
+def cached_check_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool,
+                        card_key=None):
+    """
+    Like check_answer, but reuse a verdict cached for the same answer to the card.
+    
+    Args:
+        question (str): The original question
+        user_answer (str): The user's answer
+        correct_answer (str): The correct answer
+        evaluation_prompt (str): The prompt template for evaluation
+        answer_feedback_tool (dict): The tool definition for answer feedback
+        card_key (str, optional): The card, as "deck:card_id"; without it the cache isn't used
+        
+    Returns:
+        dict: The verdict, or None if the model did not call the tool
+    """
+    if card_key is None:
+        return check_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool)
+    key = verdict_key(card_key, question, correct_answer, user_answer, evaluation_prompt, answer_feedback_tool)
+    verdict = get_verdict_cache().get(key)
+    if verdict is None:
+        verdict = check_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool)
+        if verdict is not None:
+            get_verdict_cache().put(key, verdict)
+    return verdict
+
+def evaluate_answer(question, user_answer, correct_answer, evaluation_prompt, answer_feedback_tool, card_key=None,
+                    verdict=None):
+    """
+    Evaluate if the user's answer is correct.
+    
+    Args:
+        question (str): The original question
+        user_answer (str): The user's answer
+        correct_answer (str): The correct answer
+        evaluation_prompt (str): The prompt template for evaluation
+        answer_feedback_tool (dict): The tool definition for answer feedback
+        card_key (str, optional): The card, as "deck:card_id". When given, a verdict cached
+            for the same answer to the card is reused instead of calling the model.
+        verdict (dict, optional): A verdict already checked for this answer, e.g. by
+            speculative evaluation; only the feedback is given
+        
+    Returns:
+        dict: Feedback information including correctness and explanation
+    """
+    if verdict is None:
+        verdict = cached_check_answer(question, user_answer, correct_answer, evaluation_prompt,
+                                      answer_feedback_tool, card_key)
+    if verdict is None:
+        # If no tool call was made, return default response
+        return dict(UNDETERMINED_VERDICT)
+    
+    # Process the answer and play appropriate sound
+    return process_answer(verdict["is_correct"], verdict.get("explanation"))
+
+def evaluate_answers_batch(items, batch_evaluation_prompt, batch_item_template, batch_answer_feedback_tool,
+                           evaluation_prompt=None, answer_feedback_tool=None, measure_baseline=False):
+    """
+    Evaluate several answers with a single request, one check_answer tool call per item.
+    
+    Items the model skips are re-evaluated individually when evaluation_prompt and
+    answer_feedback_tool are given. Items with a 'card_key' are looked up in the verdict
+    cache first, and only the misses are sent to the model.
+    
+    Args:
+        items (list): Dicts with 'question', 'answer' (the correct answer), 'user_answer'
+            and optionally 'card_key' ("deck:card_id")
+        batch_evaluation_prompt (str): The prompt template for the whole batch
+        batch_item_template (str): The template for one numbered item in the batch
+        batch_answer_feedback_tool (dict): The check_answer tool definition with an 'item' number
+        evaluation_prompt (str, optional): The per-card prompt template, for fallbacks and the baseline
+        answer_feedback_tool (dict, optional): The per-card tool definition, for fallbacks and the baseline
+        measure_baseline (bool, optional): Also evaluate every item individually to measure
+            the latency and tokens the batch saved. This doubles the cost; use it for benchmarking.
+        
+    Returns:
+        tuple: (results, report) where results is a list of verdict dicts in item order and
+            report holds the batch's latency and token usage and, when known, the per-card
+            baseline it is compared against
+    """
+    if not items:
+        return [], {"items": 0}
+    
+    # Verdicts are cached under the batch prompt that produced them, apart from the
+    # single-card evaluations' verdicts
+    keys = [None] * len(items)
+    cached = [None] * len(items)
+    for i, item in enumerate(items):
+        if item.get("card_key") is not None:
+            keys[i] = verdict_key(item["card_key"], item["question"], item["answer"], item["user_answer"],
+                                  f"{batch_evaluation_prompt}\0{batch_item_template}", batch_answer_feedback_tool)
+            cached[i] = get_verdict_cache().get(keys[i])
+    if any(key is not None for key in keys):
+        misses = [i for i, verdict in enumerate(cached) if verdict is None]
+        results = list(cached)
+        if misses:
+            miss_results, report = evaluate_answers_batch(
+                [{key: value for key, value in items[i].items() if key != "card_key"} for i in misses],
+                batch_evaluation_prompt, batch_item_template, batch_answer_feedback_tool,
+                evaluation_prompt=evaluation_prompt, answer_feedback_tool=answer_feedback_tool,
+                measure_baseline=measure_baseline
+            )
+        else:
+            miss_results, report = [], {"latency_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+        for i, verdict in zip(misses, miss_results):
+            results[i] = verdict
+            if keys[i] is not None and not is_undetermined(verdict):
+                get_verdict_cache().put(keys[i], verdict)
+        report["items"] = len(items)
+        report["cache_hits"] = len(items) - len(misses)
+        return results, report
+    
+    item_text = "\n".join(
+        batch_item_template.format(
+            number=number,
+            question=item["question"],
+            user_answer=item["user_answer"],
+            answer=item["answer"]
+        )
+        for number, item in enumerate(items, start=1)
+    )
+    prompt = batch_evaluation_prompt.format(count=len(items), items=item_text)
+    
+    start = time.perf_counter()
+    model = model_router.choose_model("evaluate_batch")
+    response = create_chat_completion(
+        "evaluate_batch",
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a fair and helpful evaluator."},
+            {"role": "user", "content": prompt}
+        ],
+        tools=[batch_answer_feedback_tool],
+        parallel_tool_calls=True
+    )
+    
+    # Reconcile the tool calls with the items by their number
+    verdicts = {}
+    confidences = {}
+    for tool_call in response.choices[0].message.tool_calls or []:
+        if tool_call.function.name != "check_answer":
+            continue
+        try:
+            args = json.loads(tool_call.function.arguments)
+            number = int(args["item"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if 1 <= number <= len(items) and number not in verdicts:
+            verdict = _verdict_from_args(args)
+            verdict["is_correct"] = bool(verdict["is_correct"])
+            verdicts[number] = verdict
+            confidences[number] = _confidence_from_args(args)
+    
+    results = []
+    fallbacks = 0
+    escalations = 0
+    for number, item in enumerate(items, start=1):
+        verdict = verdicts.get(number)
+        if evaluation_prompt and answer_feedback_tool:
+            if verdict is None:
+                verdict = check_answer(item["question"], item["user_answer"], item["answer"],
+                                       evaluation_prompt, answer_feedback_tool)
+                fallbacks += 1
+            elif model_router.should_escalate("evaluate_batch", model, confidences[number]):
+                # Re-check verdicts the small model wasn't sure of with the larger model
+                verdict = check_answer(item["question"], item["user_answer"], item["answer"],
+                                       evaluation_prompt, answer_feedback_tool,
+                                       escalate="low_confidence") or verdict
+                escalations += 1
+        results.append(verdict if verdict is not None else dict(UNDETERMINED_VERDICT))
+    # End-to-end time for the batch, including any per-item fallbacks
+    batch_latency = time.perf_counter() - start
+    
+    usage = getattr(response, "usage", None)
+    report = {
+        "items": len(items),
+        "latency_ms": round(batch_latency * 1000, 1),
+        "prompt_tokens": metrics.usage_value(usage, "prompt_tokens"),
+        "completion_tokens": metrics.usage_value(usage, "completion_tokens"),
+        "cached_tokens": metrics.cached_tokens(usage),
+        "model": model,
+        "fallbacks": fallbacks,
+        "escalations": escalations,
     }
+    
+    if measure_baseline and evaluation_prompt and answer_feedback_tool:
+        # Benchmarking calls must not hold up other students' requests
+        with admission.background():
+            for item in items:
+                check_answer(item["question"], item["user_answer"], item["answer"],
+                             evaluation_prompt, answer_feedback_tool)
+    
+    # Compare against the average observed per-card evaluation
+    per_card = metrics.average("evaluate")
+    if per_card is not None:
+        baseline_latency_ms = per_card["latency_s"] * len(items) * 1000
+        baseline_tokens = (per_card["prompt_tokens"] + per_card["completion_tokens"]) * len(items)
+        batch_tokens = report["prompt_tokens"] + report["completion_tokens"]
+        report["per_card_baseline"] = {
+            "latency_ms": round(baseline_latency_ms, 1),
+            "tokens": round(baseline_tokens),
+            "requests": len(items),
+        }
+        report["latency_saved_ms"] = round(baseline_latency_ms - report["latency_ms"], 1)
+        report["tokens_saved"] = round(baseline_tokens - batch_tokens)
+    
+    return results, report
 
-def handle_followup_question(question, correct_answer, followup, followup_prompt):
+def format_related_cards(related_cards):
+    """
+    Format related cards as a context block for the follow-up prompt.
+
+    Args:
+        related_cards (list): Card dicts with 'question' and 'answer' keys
+
+    Returns:
+        str: The formatted block, or an empty string if there are no cards
+    """
+    if not related_cards:
+        return ""
+    cards = "\n".join(f"- Q: {card['question']} A: {card['answer']}" for card in related_cards)
+    return related_cards_template.format(cards=cards)
+
+def start_followup_conversation(question, correct_answer, followup_conversation_prompt, related_cards=None,
+                                max_history_tokens=FOLLOWUP_HISTORY_TOKENS, summarize=True):
+    """
+    Start a multi-turn follow-up conversation about one card.
+    
+    The card context is pinned, so it survives however many turns the conversation
+    has, while older turns are evicted (and summarized) to stay within the token budget.
+    
+    Args:
+        question (str): The original question
+        correct_answer (str): The correct answer
+        followup_conversation_prompt (str): The prompt template holding the card context
+        related_cards (list, optional): Related card dicts whose text is given to the model as context
+        max_history_tokens (int, optional): Token budget for the conversation turns
+        summarize (bool, optional): Summarize evicted turns instead of dropping them
+        
+    Returns:
+        Conversation: The new conversation
+    """
+    conversation = Conversation(
+        "You are a helpful study partner.",
+        max_history_tokens=max_history_tokens,
+        summarize=summarize,
+        call_type="followup"
+    )
+    conversation.add_message("system", followup_conversation_prompt.format(
+        question=question,
+        answer=correct_answer,
+        related=format_related_cards(related_cards)
+    ), pinned=True)
+    return conversation
+
+def handle_followup_question(question, correct_answer, followup, followup_prompt, related_cards=None,
+                             conversation=None):
     """
     Handle a follow-up question from the user.
     
@@ -141,18 +698,26 @@ def handle_followup_question(question, correct_answer, followup, followup_prompt
         correct_answer (str): The correct answer
         followup (str): The user's follow-up question
         followup_prompt (str): The prompt template for follow-up questions
+        related_cards (list, optional): Related card dicts whose text is given to the model as context
+        conversation (Conversation, optional): A conversation from start_followup_conversation.
+            When given, the follow-up is answered as the next turn of that conversation.
         
     Returns:
         str: The response to the follow-up question
     """
+    if conversation is not None:
+        return conversation.ask(followup).choices[0].message.content
+    
     prompt = followup_prompt.format(
         question=question,
         answer=correct_answer,
-        followup=followup
+        followup=followup,
+        related=format_related_cards(related_cards)
     )
     
-    response = client.chat.completions.create(
-        model="gpt-4.1",
+    response = create_chat_completion(
+        "followup",
+        model=model_router.choose_model("followup"),
         messages=[
             {"role": "system", "content": "You are a helpful study partner."},
             {"role": "user", "content": prompt}
@@ -0,0 +1,308 @@
+import zipfile
+import json
+import os
+import re
+import html
+import sys
+import time
+from pathlib import Path
+
+from .anki_collection import collection_day, open_collection, read_decks, read_note_types, read_media_map
+from .card_screening import TEXTUAL, count_visual_kinds, screen_card
+from .deck_media import media_references, strip_sound_tags
+from .search_index import SearchIndex
+from .related_cards import RelatedCardIndex
+
+def strip_html(text):
+    """Remove HTML tags and decode HTML entities."""
+    # Drop [sound:...] tags; the sound files are served separately as media
+    text = strip_sound_tags(text)
+    # Then remove HTML tags
+    text = re.sub(r'<.*?>', '', text)
+    # Then decode HTML entities
+    text = html.unescape(text)
+    # Replace non-breaking spaces (\xa0) with regular spaces
+    text = text.replace('\xa0', ' ')
+    return text
+
+def is_supported_note_type(model_name):
+    """Return True for note types render_note can turn into questions (cloze and basic)."""
+    model_name_lower = model_name.lower()
+    return 'cloze' in model_name_lower or 'basic' in model_name_lower
+
+def render_note(model_name, flds):
+    """
+    Render a note's fields into a question/answer pair.
+
+    Args:
+        model_name (str): Name of the note type (model)
+        flds (str): The raw note fields, separated by '\\x1f'
+
+    Returns:
+        dict: A dict with 'question', 'answer', 'media', 'answer_media' and 'visual' keys, or None
+            if the note type is unsupported. The media lists hold file names referenced by each
+            side, and 'visual' tells whether the question depends on a picture (see screen_card).
+    """
+    fields = flds.split('\x1f')
+    model_name_lower = model_name.lower()
+    if 'cloze' in model_name_lower:
+        cloze_text = fields[0]
+        question = re.sub(r"{{c\d+::(.*?)}}", "{blank}", cloze_text)
+        answer = re.sub(r"{{c\d+::(.*?)}}", r"\1", cloze_text)
+        question_source, answer_source = cloze_text, "\x1f".join(fields[1:])
+    elif 'basic' in model_name_lower and len(fields) >= 2:
+        question, answer = fields[0], fields[1]
+        question_source, answer_source = fields[0], fields[1]
+    else:
+        return None
+    media = media_references(question_source)
+    answer_media = [name for name in media_references(answer_source) if name not in media]
+    question = strip_html(question)
+    return {
+        'question': question,
+        'answer': strip_html(answer),
+        'media': media,
+        'answer_media': answer_media,
+        'visual': screen_card(model_name, question_source, question),
+    }
+
+def _estimate_size(obj, seen=None):
+    """Roughly estimate the memory held by nested dicts/lists/strings."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _estimate_size(k, seen) + _estimate_size(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _estimate_size(item, seen)
+    return size
+
+class DeckIndex:
+    """
+    Read-only, pre-rendered index of one Anki package.
+
+    An index is never mutated after it has been built, so it can be shared between
+    request threads freely; reloading a deck builds a new index and swaps it in.
+    """
+    def __init__(self, key, apkg_path, decks, cards, cards_by_deck, signature, media=None, media_sizes=None):
+        self.key = key
+        self.apkg_path = Path(apkg_path)
+        self.decks = decks  # {deck_id: full deck name}
+        self.cards = cards  # {card_id: {'id', 'note_id', 'deck_id', 'model', 'question', 'answer', 'media', 'answer_media', 'visual'}}
+        self.cards_by_deck = cards_by_deck  # {deck_id: [card_id, ...]}
+        # {deck_id: [card_id, ...]} of the cards answerable without seeing a picture
+        self.textual_cards_by_deck = {
+            deck_id: [card_id for card_id in card_ids if cards[card_id]['visual'] == TEXTUAL]
+            for deck_id, card_ids in cards_by_deck.items()
+        }
+        self.deck_counts = {}  # {deck_id: {'new', 'due', 'total'}} of the deck's own cards, when loaded
+        self.subdecks = subdecks_by_deck(decks)  # {deck_id: [deck_id and its descendants' ids]}
+        self.signature = signature  # (mtime_ns, size) of the package when it was read
+        self.media = media or {}  # {media file name: zip member name}
+        self.media_sizes = media_sizes or {}  # {media file name: size listed in the package}, for zstd-compressed media only
+        self.search_index = None  # SearchIndex over the rendered card text
+        self.related_index = None  # RelatedCardIndex for follow-up context retrieval
+        self.build_seconds = 0.0
+        self.memory_bytes = 0
+
+    def deck_ids_named(self, name):
+        """
+        Find the ids of decks matching a category name.
+
+        Args:
+            name (str): A full deck name or the last component of one
+
+        Returns:
+            list: The deck with that full name, or else the one deck whose last component
+                it is. Empty when several decks share the last component (e.g. Bio::Review
+                and Chem::Review), since there is no telling which was meant.
+        """
+        exact = [did for did, deck_name in self.decks.items() if deck_name == name]
+        if exact:
+            return exact
+        by_leaf = [did for did, deck_name in self.decks.items() if deck_name.split("::")[-1] == name]
+        return by_leaf if len(by_leaf) == 1 else []
+
+    def deck_ids_under(self, name):
+        """
+        Find the ids of the decks matching a category name and of all their sub-decks.
+
+        Args:
+            name (str): A full deck name or the last component of one
+
+        Returns:
+            list: Matching deck ids and their descendants, without duplicates
+        """
+        found = {}
+        for did in self.deck_ids_named(name):
+            found.update(dict.fromkeys(self.subdecks.get(did, [did])))
+        return list(found)
+
+    def related_cards(self, card_id, text, k=3):
+        """
+        Find cards related to the current card and a follow-up question.
+
+        Args:
+            card_id (int): The current card, excluded from the results
+            text (str): Text to match, e.g. the card's question and answer plus the follow-up
+            k (int, optional): Number of cards to return
+
+        Returns:
+            list: Up to k card dicts, most related first
+        """
+        if self.related_index is None:
+            return []
+        return [self.cards[related_id] for related_id, _ in self.related_index.related(text, k, card_id)]
+
+    def stats(self):
+        """
+        Get load statistics for this deck.
+
+        Returns:
+            dict: Card/deck counts, build time and estimated memory
+        """
+        return {
+            "key": self.key,
+            "path": str(self.apkg_path),
+            "decks": len(self.decks),
+            "cards": len(self.cards),
+            "media_files": len(self.media),
+            "visual": count_visual_kinds(self.cards),
+            "build_ms": round(self.build_seconds * 1000, 1),
+            "search_build_ms": round(self.search_index.build_seconds * 1000, 1) if self.search_index else None,
+            "related_build_ms": round(self.related_index.build_seconds * 1000, 1) if self.related_index else None,
+            "memory_bytes": self.memory_bytes,
+        }
+
+def subdecks_by_deck(decks):
+    """
+    Map every deck to itself and its descendants.
+
+    Args:
+        decks (dict): {deck_id: full deck name}
+
+    Returns:
+        dict: {deck_id: [deck_id, descendant ids...]}
+    """
+    ids_by_name = {name: did for did, name in decks.items()}
+    subdecks = {did: [did] for did in decks}
+    for did, name in decks.items():
+        parts = name.split("::")
+        for depth in range(1, len(parts)):
+            parent = ids_by_name.get("::".join(parts[:depth]))
+            if parent is not None:
+                subdecks[parent].append(did)
+    return subdecks
+
+def count_cards_by_deck(conn, note_type_ids):
+    """
+    Count each deck's new, due and total cards in one aggregated query.
+
+    Only cards of the given note types are counted, so the counts match the cards that
+    can be studied. Suspended and buried cards count towards the total only.
+
+    Args:
+        conn (sqlite3.Connection): The open collection
+        note_type_ids (list): Ids of the note types to count
+
+    Returns:
+        dict: {deck_id: {'new', 'due', 'total'}} for decks that have such cards
+    """
+    if not note_type_ids:
+        return {}
+    placeholders = ", ".join("?" * len(note_type_ids))
+    rows = conn.execute(f"""
+        SELECT c.did, SUM(c.queue = 0),
+               SUM((c.queue IN (2, 3) AND c.due <= ?) OR (c.queue = 1 AND c.due <= ?)),
+               COUNT(*)
+        FROM cards c JOIN notes n ON n.id = c.nid
+        WHERE n.mid IN ({placeholders})
+        GROUP BY c.did
+    """, (collection_day(conn), int(time.time()), *note_type_ids))
+    return {did: {"new": new, "due": due, "total": total} for did, new, due, total in rows}
+
+def file_signature(path):
+    """Return a (mtime_ns, size) tuple used to detect changes to a package."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def build_deck_index(apkg_path, key=None):
+    """
+    Build a DeckIndex from an Anki .apkg file.
+
+    Args:
+        apkg_path (str or Path): Path to the .apkg file
+        key (str, optional): Registry key for the deck. Defaults to the file stem.
+
+    Returns:
+        DeckIndex: The built index
+    """
+    apkg_path = Path(apkg_path)
+    if not apkg_path.exists():
+        raise FileNotFoundError(f"APKG file not found: {apkg_path}")
+
+    start = time.perf_counter()
+    signature = file_signature(apkg_path)
+
+    with zipfile.ZipFile(apkg_path, 'r') as zf:
+        with open_collection(zf, apkg_path, signature) as conn:
+            cur = conn.cursor()
+            decks = read_decks(conn)
+            model_names = read_note_types(conn)
+            deck_counts = count_cards_by_deck(
+                conn, [mid for mid, name in model_names.items() if is_supported_note_type(name)]
+            )
+
+            # Render each note once; cloze notes can have several cards
+            rendered = {}
+            cur.execute("SELECT id, mid, flds FROM notes")
+            for note_id, mid, flds in cur:
+                model_name = model_names.get(mid, "Unknown")
+                result = render_note(model_name, flds)
+                if result is not None:
+                    result['model'] = model_name
+                    rendered[note_id] = result
+
+            cards = {}
+            cards_by_deck = {}
+            cur.execute("SELECT id, nid, did FROM cards")
+            for card_id, note_id, deck_id in cur:
+                note = rendered.get(note_id)
+                if note is None:
+                    continue
+                cards[card_id] = {
+                    'id': card_id,
+                    'note_id': note_id,
+                    'deck_id': deck_id,
+                    'model': note['model'],
+                    'question': note['question'],
+                    'answer': note['answer'],
+                    'media': note['media'],
+                    'answer_media': note['answer_media'],
+                    'visual': note['visual'],
+                }
+                cards_by_deck.setdefault(deck_id, []).append(card_id)
+
+        # Maps the zip members to the file names cards refer to
+        media, media_sizes = read_media_map(zf)
+
+    index = DeckIndex(key or apkg_path.stem, apkg_path, decks, cards, cards_by_deck, signature, media, media_sizes)
+    index.deck_counts = deck_counts
+    index.search_index = SearchIndex.build(cards)
+    index.related_index = RelatedCardIndex.build(cards)
+    index.build_seconds = time.perf_counter() - start
+    index.memory_bytes = sum(_estimate_size(part) for part in (index.cards, index.cards_by_deck, index.decks,
+                                                               index.media, index.deck_counts, index.subdecks,
+                                                               index.textual_cards_by_deck))
+    index.memory_bytes += index.search_index.memory_bytes() + index.related_index.memory_bytes()
+    return index
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.deck_index path/to/deck.apkg
+    index = build_deck_index(sys.argv[1])
+    print(json.dumps(index.stats(), indent=2))
@@ -0,0 +1,162 @@
+import mimetypes
+import re
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+from .anki_collection import zstd_reader
+
+# Bytes read from the package per iteration when streaming a media file
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+_IMG_SRC_RE = re.compile(r'<img[^>]*?src\s*=\s*["\']?([^"\'>\s]+)', re.IGNORECASE)
+_SOUND_RE = re.compile(r'\[sound:(.*?)\]')
+
+# Size of a zip local file header before the variable-length name and extra fields
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+def media_references(text):
+    """
+    Find the media files referenced by a card field.
+
+    Args:
+        text (str): Raw field HTML
+
+    Returns:
+        list: Referenced file names, images first, in order of appearance
+    """
+    return _IMG_SRC_RE.findall(text) + _SOUND_RE.findall(text)
+
+def image_references(text):
+    """Find the image files shown by a card field. See media_references."""
+    return _IMG_SRC_RE.findall(text)
+
+def strip_sound_tags(text):
+    """Remove Anki [sound:...] tags so they aren't shown or read aloud."""
+    return _SOUND_RE.sub('', text)
+
+class MediaMember:
+    """Location of one media file inside an .apkg package."""
+    def __init__(self, name, zip_name, compress_type, file_size, data_offset, crc, zstd=False):
+        self.name = name
+        self.zip_name = zip_name
+        self.compress_type = compress_type
+        self.file_size = file_size  # size of the media file itself, after any decompression; None if unknown
+        self.data_offset = data_offset  # only meaningful for stored (uncompressed) members
+        self.crc = crc
+        self.zstd = zstd  # the member holds zstd-compressed data (.anki21b packages)
+
+    @property
+    def seekable(self):
+        """Whether a byte range can be reached with a seek, i.e. the member is stored uncompressed."""
+        return self.compress_type == zipfile.ZIP_STORED and not self.zstd
+
+    @property
+    def etag(self):
+        return f'"{self.crc:08x}-{self.file_size or 0:x}"'
+
+    @property
+    def mimetype(self):
+        return mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+
+_members = OrderedDict()  # {(apkg_path, signature, name): MediaMember}
+_members_lock = threading.Lock()
+_MAX_CACHED_MEMBERS = 4096
+
+def resolve_media(deck_index, name):
+    """
+    Resolve a media file name to its member in the deck's package.
+
+    Args:
+        deck_index (DeckIndex): The deck the card belongs to
+        name (str): Media file name as referenced by the card
+
+    Returns:
+        MediaMember: The member, or None if the deck has no such media file
+    """
+    zip_name = deck_index.media.get(name)
+    if zip_name is None:
+        return None
+
+    key = (str(deck_index.apkg_path), deck_index.signature, name)
+    with _members_lock:
+        member = _members.get(key)
+        if member is not None:
+            _members.move_to_end(key)
+            return member
+
+    with open(deck_index.apkg_path, 'rb') as f:
+        with zipfile.ZipFile(f) as zf:
+            info = zf.getinfo(zip_name)
+        # The data starts after the local header, whose name/extra lengths can differ
+        # from the central directory, so read them from the local header itself
+        f.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+        name_len, extra_len = header[-2], header[-1]
+        data_offset = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+    if name not in deck_index.media_sizes:
+        member = MediaMember(name, zip_name, info.compress_type, info.file_size, data_offset, info.CRC)
+    else:
+        # Media of .anki21b packages is zstd-compressed inside the zip member; 0 means no size was listed
+        size = deck_index.media_sizes[name] or None
+        member = MediaMember(name, zip_name, info.compress_type, size, data_offset, info.CRC, zstd=True)
+    with _members_lock:
+        _members[key] = member
+        while len(_members) > _MAX_CACHED_MEMBERS:
+            _members.popitem(last=False)
+    return member
+
+def iter_media(apkg_path, member, start=0, stop=None, chunk_size=MEDIA_CHUNK_SIZE):
+    """
+    Stream a byte range of a media file straight from the package.
+
+    Stored members are read directly from their offset in the .apkg, reaching the range
+    with a seek. Compressed members (deflate, or zstd in .anki21b packages) are
+    decompressed on the fly, so reaching a range inflates everything before it; /api/media
+    serves them whole for that reason. Nothing is copied to disk, and at most one chunk is
+    held in memory per request.
+
+    Args:
+        apkg_path (str or Path): Path to the .apkg file
+        member (MediaMember): The member to read
+        start (int, optional): First byte to send
+        stop (int, optional): One past the last byte to send. Defaults to the end of the file.
+        chunk_size (int, optional): Bytes per yielded chunk
+
+    Yields:
+        bytes: Consecutive chunks of the requested range
+    """
+    if stop is None:
+        stop = member.file_size
+    remaining = stop - start if stop is not None else float("inf")
+
+    with open(Path(apkg_path), 'rb') as f:
+        if member.seekable:
+            f.seek(member.data_offset + start)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            return
+
+        with zipfile.ZipFile(f) as zf, zf.open(member.zip_name) as src:
+            if member.zstd:
+                src = zstd_reader(src)
+            # Inflate and discard everything before the range
+            to_skip = start
+            while to_skip > 0:
+                skipped = src.read(min(chunk_size, to_skip))
+                if not skipped:
+                    return
+                to_skip -= len(skipped)
+            while remaining > 0:
+                chunk = src.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
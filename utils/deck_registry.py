@@ -0,0 +1,379 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import dotenv
+
+from .deck_index import build_deck_index, file_signature
+
+dotenv.load_dotenv()
+
+# Directory scanned for .apkg files. Defaults to the project root.
+DEFAULT_DECKS_DIR = Path(__file__).parent.parent
+DECKS_DIR = Path(os.getenv("DECKS_DIR") or DEFAULT_DECKS_DIR)
+# Seconds between checks of the decks directory for changed packages
+DECKS_POLL_INTERVAL = float(os.getenv("DECKS_POLL_INTERVAL", "2.0"))
+
+class DeckRegistry:
+    """
+    Loads every .apkg file in a directory and keeps their indexes up to date.
+
+    Each deck has its own immutable DeckIndex. When a package changes on disk only that
+    deck is rebuilt, on a background thread, and the finished index is swapped in by
+    replacing the registry's dict in a single assignment. Readers take a reference to
+    the dict (or to one index) and never observe a partially built index.
+    """
+    def __init__(self, decks_dir=None, poll_interval=DECKS_POLL_INTERVAL):
+        """
+        Initialize the registry.
+
+        Args:
+            decks_dir (str or Path, optional): Directory containing .apkg files
+            poll_interval (float, optional): Seconds between change checks when watching
+        """
+        self.decks_dir = Path(decks_dir or DECKS_DIR)
+        self.poll_interval = poll_interval
+        self.version = 0
+        self._decks = {}  # {key: DeckIndex}, replaced wholesale on every change
+        self._categories = (None, [])  # (version, category names) computed for that version
+        self._deck_tree = (None, [])  # (version, deck tree) computed for that version
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="deck-reload")
+        self._pending = {}  # {path: signature seen on the previous poll}
+        self._building = set()
+        self._errors = {}
+        self._failed = {}  # {path: signature that failed to load}, skipped until the file changes
+        self._stop_event = threading.Event()
+        self._watch_thread = None
+
+    def _scan(self):
+        """Return {path: signature} for the .apkg files currently in the directory."""
+        found = {}
+        if not self.decks_dir.exists():
+            return found
+        for path in sorted(self.decks_dir.glob("*.apkg")):
+            try:
+                found[path] = file_signature(path)
+            except OSError:
+                continue
+        return found
+
+    def _swap(self, key, index=None):
+        """Publish a new decks dict with one entry replaced (or removed)."""
+        with self._lock:
+            decks = dict(self._decks)
+            if index is None:
+                decks.pop(key, None)
+            else:
+                decks[key] = index
+            self._decks = decks
+            self.version += 1
+
+    def _rebuild(self, path, signature=None):
+        """Build the index for one package and swap it in."""
+        key = path.stem
+        try:
+            index = build_deck_index(path, key=key)
+        except Exception as e:
+            print(f"Error loading deck {path}: {e}")
+            with self._lock:
+                self._errors[key] = str(e)
+                self._failed[path] = signature
+                self._building.discard(path)
+            return None
+        with self._lock:
+            self._errors.pop(key, None)
+            self._failed.pop(path, None)
+            self._building.discard(path)
+        self._swap(key, index)
+        stats = index.stats()
+        print(f"Loaded deck '{key}': {stats['cards']} cards in {stats['build_ms']} ms, "
+              f"~{stats['memory_bytes'] / (1024 * 1024):.1f} MiB")
+        return index
+
+    def load_all(self):
+        """
+        Synchronously load every package in the decks directory.
+
+        Returns:
+            DeckRegistry: self, for chaining
+        """
+        for path, signature in self._scan().items():
+            self._rebuild(path, signature)
+        return self
+
+    def poll(self):
+        """
+        Check the decks directory once and schedule rebuilds for changed packages.
+
+        A package is only rebuilt once its signature is the same on two consecutive polls,
+        so a file that is still being copied into place is not read half-written. A
+        package that failed to load is not retried until it changes again.
+        """
+        found = self._scan()
+        current = self._decks
+        loaded = {index.apkg_path: index for index in current.values()}
+
+        rebuild = []
+        with self._lock:
+            for path, signature in found.items():
+                index = loaded.get(path)
+                if (index is not None and index.signature == signature) or self._failed.get(path) == signature:
+                    self._pending.pop(path, None)
+                    continue
+                if self._pending.get(path) != signature:
+                    # Changed since the last poll; wait for it to settle
+                    self._pending[path] = signature
+                    continue
+                if path in self._building:
+                    continue
+                self._pending.pop(path, None)
+                self._building.add(path)
+                rebuild.append((path, signature))
+            for path in [path for path in self._failed if path not in found]:
+                del self._failed[path]
+        for path, signature in rebuild:
+            self._executor.submit(self._rebuild, path, signature)
+
+        for path, index in loaded.items():
+            if path not in found:
+                print(f"Deck removed: {path}")
+                self._swap(index.key)
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error watching decks directory: {e}")
+
+    def start_watching(self):
+        """Start a daemon thread that hot-reloads changed packages."""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._watch_thread = threading.Thread(target=self._watch, name="deck-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        """Stop the watcher thread."""
+        self._stop_event.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join(timeout=self.poll_interval + 1)
+            self._watch_thread = None
+
+    def decks(self):
+        """
+        Get a consistent snapshot of the loaded decks.
+
+        Returns:
+            dict: {key: DeckIndex}
+        """
+        return self._decks
+
+    def get(self, key):
+        """Get one deck's index by key, or None."""
+        return self._decks.get(key)
+
+    def index_for_path(self, apkg_path):
+        """
+        Get the index for a specific package, loading it into the registry if needed.
+
+        Args:
+            apkg_path (str or Path): Path to the .apkg file
+
+        Returns:
+            DeckIndex: The deck's index
+        """
+        apkg_path = Path(apkg_path).resolve()
+        for index in self._decks.values():
+            if index.apkg_path.resolve() == apkg_path:
+                return index
+        return self._rebuild(apkg_path)
+
+    def categories(self):
+        """
+        Get the full names of the decks across all loaded packages.
+
+        Selecting a deck includes its sub-decks, so parent decks are listed too; decks
+        without any cards to study are left out. The list is computed once per registry
+        version.
+
+        Returns:
+            list: Sorted list of full deck names, e.g. "MCAT::Biology::Cells"
+        """
+        version, categories = self._categories
+        if version == self.version:
+            return categories
+        version, decks = self.version, self._decks
+        names = set()
+        for index in decks.values():
+            for did, name in index.decks.items():
+                # Skip decks with nothing to study, such as an empty "Default"
+                if name and any(index.cards_by_deck.get(sub) for sub in index.subdecks.get(did, [did])):
+                    names.add(name)
+        categories = sorted(names)
+        self._categories = (version, categories)
+        return categories
+
+    def deck_tree(self):
+        """
+        Get the deck hierarchy across all loaded packages, with card counts.
+
+        Decks with the same full name in different packages are merged into one node.
+        Counts are rolled up from each deck's own counts (see count_cards_by_deck), so a
+        node's counts include all of its descendants. The tree is computed once per
+        registry version.
+
+        Returns:
+            list: Top-level nodes of {'name', 'path', 'ids', 'counts', 'children'}, where
+                'ids' are "deck key:deck id" strings and 'counts' has 'new', 'due', 'total'
+        """
+        version, tree = self._deck_tree
+        if version == self.version:
+            return tree
+        version, decks = self.version, self._decks
+        tree = build_deck_tree(decks.values())
+        self._deck_tree = (version, tree)
+        return tree
+
+    def search(self, query, limit=50):
+        """
+        Search the cards of every loaded deck.
+
+        Args:
+            query (str): Free-text query
+            limit (int, optional): Maximum number of results. None returns every match.
+
+        Returns:
+            dict: 'total' matches, match 'counts' per deck name, and ranked 'results' of
+                {'deck', 'card_id', 'score', 'question'}. bm25 scores from different decks'
+                indexes aren't comparable, so each deck's are divided by its best match's:
+                'score' is the relevance relative to that, 1.0 for each deck's top card.
+        """
+        results = []
+        counts = {}
+        for index in self._decks.values():
+            if index.search_index is None:
+                continue
+            deck_results, deck_counts = index.search_index.search(query, limit)
+            if deck_results:
+                # bm25 is negative, lower is better; the best match comes first
+                best = deck_results[0][1] or -1.0
+                results.extend((score / best, index, card_id) for card_id, score in deck_results)
+            for deck_id, count in deck_counts.items():
+                name = index.decks.get(deck_id, str(deck_id))
+                counts[name] = counts.get(name, 0) + count
+        results.sort(key=lambda item: item[0], reverse=True)
+        if limit is not None:
+            results = results[:limit]
+        return {
+            "total": sum(counts.values()),
+            "counts": counts,
+            "results": [
+                {"deck": index.key, "card_id": card_id, "score": round(score, 4),
+                 "question": index.cards[card_id]['question']}
+                for score, index, card_id in results
+            ],
+        }
+
+    def _errors_snapshot(self):
+        with self._lock:
+            return dict(self._errors)
+
+    def stats(self):
+        """
+        Get reload statistics for every deck.
+
+        Returns:
+            dict: Registry version, per-deck stats and load errors
+        """
+        decks = self._decks
+        return {
+            "version": self.version,
+            "decks_dir": str(self.decks_dir),
+            "decks": [index.stats() for index in decks.values()],
+            "total_memory_bytes": sum(index.memory_bytes for index in decks.values()),
+            "errors": self._errors_snapshot(),
+        }
+
+def build_deck_tree(indexes):
+    """
+    Build the merged deck hierarchy of several packages. See DeckRegistry.deck_tree.
+
+    Args:
+        indexes (iterable): DeckIndex objects
+
+    Returns:
+        list: Top-level nodes, sorted by name at every level
+    """
+    nodes = {}  # {full name: node}
+    roots = []
+
+    def node_for(path):
+        node = nodes.get(path)
+        if node is None:
+            parent, _, name = path.rpartition("::")
+            node = nodes[path] = {"name": name, "path": path, "ids": [],
+                                  "counts": {"new": 0, "due": 0, "total": 0}, "children": []}
+            # Anki always stores parent decks, but don't rely on it
+            (node_for(parent)["children"] if parent else roots).append(node)
+        return node
+
+    for index in indexes:
+        for did, name in index.decks.items():
+            if not name:
+                continue
+            node = node_for(name)
+            node["ids"].append(f"{index.key}:{did}")
+            counts = index.deck_counts.get(did)
+            if counts:
+                # Add the deck's own counts to it and every ancestor
+                parts = name.split("::")
+                for depth in range(len(parts), 0, -1):
+                    ancestor = nodes["::".join(parts[:depth])]["counts"]
+                    for field, value in counts.items():
+                        ancestor[field] += value
+
+    for node in nodes.values():
+        node["children"].sort(key=lambda child: child["name"].lower())
+    roots.sort(key=lambda node: node["name"].lower())
+    return roots
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry(load=True):
+    """
+    Get the process-wide deck registry, loading the decks directory on first use.
+
+    Args:
+        load (bool, optional): Load the decks when the registry is created. Pass False
+            to create it empty and call load_all() later, e.g. from a warm-up thread.
+
+    Returns:
+        DeckRegistry: The shared registry
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = DeckRegistry()
+                _registry = registry.load_all() if load else registry
+    return _registry
+
+if __name__ == "__main__":
+    # Example usage: watch the decks directory and print stats as decks reload
+    registry = get_registry()
+    registry.start_watching()
+    last_version = None
+    try:
+        while True:
+            if registry.version != last_version:
+                last_version = registry.version
+                print(registry.stats())
+            time.sleep(1)
+    except KeyboardInterrupt:
+        registry.stop_watching()
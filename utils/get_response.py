@@ -1,10 +1,8 @@
-from openai import OpenAI
-import os
 import dotenv
 
-dotenv.load_dotenv()
+from .openai_client import get_client
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+dotenv.load_dotenv()
 
 def get_response(prompt):
     """
@@ -16,7 +14,7 @@ def get_response(prompt):
     Returns:
         The response from the OpenAI API
     """
-    response = client.responses.create(
+    response = get_client().responses.create(
         model="gpt-4.1",
         input=prompt
     )
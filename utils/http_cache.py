@@ -0,0 +1,145 @@
+import gzip
+import json
+import os
+import re
+
+# JSON bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 512
+GZIP_LEVEL = 6
+# Content-addressed files never change, so browsers may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Speech clips named after a hash of their text and voice settings (see text_to_speech)
+CONTENT_ADDRESSED_AUDIO = re.compile(r"^audio/speech_[0-9a-f]{16}\.mp3$")
+
+def body_bytes(response):
+    """Return the number of body bytes a response sends (0 for a 304)."""
+    if response.status_code == 304:
+        return 0
+    length = response.headers.get("Content-Length")
+    if length is not None:
+        return int(length)
+    if response.is_streamed or response.direct_passthrough:
+        return 0
+    return len(response.get_data())
+
+def cache_content_addressed(response, filename):
+    """
+    Mark a content-addressed static file as cacheable forever.
+
+    Args:
+        response (flask.Response): Response from the static file view
+        filename (str): The requested file, relative to the static folder
+
+    Returns:
+        bool: True if the file is content-addressed and the headers were set
+    """
+    if not CONTENT_ADDRESSED_AUDIO.match(filename) or response.status_code not in (200, 206, 304):
+        return False
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.headers["Accept-Ranges"] = "bytes"
+    return True
+
+def compress_response(response, accept_encodings):
+    """
+    Gzip a JSON response in place when the client accepts it.
+
+    A compressed response's ETag is made weak, since its bytes differ from the
+    uncompressed representation; weak comparison still matches it on revalidation.
+
+    Args:
+        response (flask.Response): The response to compress
+        accept_encodings (werkzeug.datastructures.Accept): The request's Accept-Encoding
+
+    Returns:
+        bool: True if the response was compressed
+    """
+    if (response.status_code != 200 or response.mimetype != "application/json"
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or not accept_encodings["gzip"]):
+        return False
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return False
+    response.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return True
+
+def measure_session(client, urls, use_cache=True):
+    """
+    Replay a browsing session against a Flask test client and count the bytes received.
+
+    With use_cache the client behaves like a browser: it asks for gzip, revalidates
+    cached responses with If-None-Match and doesn't request immutable responses again.
+    Without it every request is a plain, uncompressed fetch, as before any caching.
+
+    Args:
+        client (flask.testing.FlaskClient): Test client of the app
+        urls (list): Paths requested in order. Audio paths are fetched with a Range header,
+            the way <audio> elements request them.
+        use_cache (bool, optional): Whether to use caching and compression
+
+    Returns:
+        dict: Requests sent, requests served from the local cache, 304 responses and
+            body bytes received
+    """
+    cache = {}  # {url: (etag, immutable)}
+    stats = {"requests": 0, "from_cache": 0, "not_modified": 0, "bytes": 0}
+    for url in urls:
+        headers = {"Accept-Encoding": "gzip" if use_cache else "identity"}
+        if url.endswith(".mp3"):
+            headers["Range"] = "bytes=0-"
+        cached = cache.get(url) if use_cache else None
+        if cached is not None:
+            etag, immutable = cached
+            if immutable:
+                stats["from_cache"] += 1
+                continue
+            if etag:
+                headers["If-None-Match"] = etag
+        response = client.get(url, headers=headers)
+        stats["requests"] += 1
+        stats["not_modified"] += response.status_code == 304
+        stats["bytes"] += len(response.get_data())
+        if response.status_code in (200, 206):
+            cache[url] = (response.headers.get("ETag"), bool(response.cache_control.immutable))
+        response.close()
+    return stats
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.http_cache
+    # Replays a typical study session (three page loads, 30 questions over 12 distinct
+    # clips, each clip played and replayed) without and with caching and compression.
+    from pathlib import Path
+
+    from app import app
+    from utils.text_to_speech import speech_filename
+
+    audio_dir = Path(app.static_folder) / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    clips = []
+    for i in range(12):
+        path = audio_dir / speech_filename(f"benchmark question {i}", "benchmark", "alloy", 1.0)
+        path.write_bytes(os.urandom(48 * 1024))
+        clips.append(f"/static/audio/{path.name}")
+    page_load = ["/", "/static/js/script.js", "/api/categories", "/api/saved_queries"]
+    urls = page_load[:]
+    for i in range(30):
+        urls += [clips[i % len(clips)], clips[i % len(clips)]]
+        if i in (10, 20):
+            urls += page_load
+    try:
+        results = {}
+        for use_cache in (False, True):
+            with app.test_client() as client:
+                results["after" if use_cache else "before"] = measure_session(client, urls, use_cache)
+        print(json.dumps(results, indent=2))
+    finally:
+        for clip in clips:
+            (audio_dir / Path(clip).name).unlink()
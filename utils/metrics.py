@@ -0,0 +1,187 @@
+import threading
+
+_lock = threading.Lock()
+_calls = {}  # {call_type: running totals}
+_transfers = {}  # {endpoint: running totals of HTTP response bytes}
+_prompt_savings = {}  # {call_type: prompt tokens a shorter or skipped prompt saved}
+
+def usage_value(usage, name):
+    """Read a token count from usage data given as an object or a dict."""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return usage.get(name) or 0
+    return getattr(usage, name, 0) or 0
+
+def cached_tokens(usage):
+    """Read the number of prompt tokens served from the provider's prompt cache."""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details")
+    else:
+        details = getattr(usage, "prompt_tokens_details", None)
+    return usage_value(details, "cached_tokens")
+
+def record_call(call_type, model, latency, usage=None):
+    """
+    Record one API call for the metrics summary.
+
+    Args:
+        call_type (str): What the call was for, e.g. "evaluate" or "format_question"
+        model (str): The model used
+        latency (float): Wall-clock seconds the call took
+        usage (object or dict, optional): The response's usage data
+    """
+    with _lock:
+        totals = _calls.setdefault(call_type, {
+            "calls": 0,
+            "latency_s": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached_tokens": 0,
+            "cache_hits": 0,
+            "cache_hit_latency_s": 0.0,
+            "models": {},
+        })
+        cached = cached_tokens(usage)
+        totals["calls"] += 1
+        totals["latency_s"] += latency
+        totals["prompt_tokens"] += usage_value(usage, "prompt_tokens")
+        totals["completion_tokens"] += usage_value(usage, "completion_tokens")
+        totals["cached_tokens"] += cached
+        if cached:
+            totals["cache_hits"] += 1
+            totals["cache_hit_latency_s"] += latency
+        totals["models"][model] = totals["models"].get(model, 0) + 1
+
+def average(call_type):
+    """
+    Get the average latency and token usage of one call type.
+
+    Args:
+        call_type (str): The call type
+
+    Returns:
+        dict: Average 'latency_s', 'prompt_tokens', 'completion_tokens' and 'cached_tokens' per call, or None
+            if no call of this type has been recorded
+    """
+    with _lock:
+        totals = _calls.get(call_type)
+        if not totals or not totals["calls"]:
+            return None
+        n = totals["calls"]
+        return {
+            "latency_s": totals["latency_s"] / n,
+            "prompt_tokens": totals["prompt_tokens"] / n,
+            "completion_tokens": totals["completion_tokens"] / n,
+            "cached_tokens": totals["cached_tokens"] / n,
+        }
+
+def summary():
+    """
+    Get a snapshot of all recorded call metrics.
+
+    Returns:
+        dict: {call_type: totals and averages}. 'cached_token_rate' is the share of prompt
+            tokens served from the prompt cache, and the hit/miss latencies show what a
+            cache hit saves.
+    """
+    with _lock:
+        result = {}
+        for call_type, totals in _calls.items():
+            n = totals["calls"] or 1
+            hits = totals["cache_hits"]
+            misses = totals["calls"] - hits
+            result[call_type] = {
+                **totals,
+                "models": dict(totals["models"]),
+                "avg_latency_ms": round(totals["latency_s"] / n * 1000, 1),
+                "avg_prompt_tokens": round(totals["prompt_tokens"] / n, 1),
+                "cached_token_rate": round(totals["cached_tokens"] / totals["prompt_tokens"], 3)
+                    if totals["prompt_tokens"] else 0.0,
+                "avg_cache_hit_latency_ms": round(totals["cache_hit_latency_s"] / hits * 1000, 1)
+                    if hits else None,
+                "avg_cache_miss_latency_ms": round((totals["latency_s"] - totals["cache_hit_latency_s"]) / misses * 1000, 1)
+                    if misses else None,
+            }
+        return result
+
+def record_prompt_savings(call_type, full_tokens, sent_tokens, kind):
+    """
+    Record the prompt tokens saved by sending a shorter prompt, or none at all.
+
+    Args:
+        call_type (str): The call type, e.g. "format_question"
+        full_tokens (int): Tokens the full prompt would have had
+        sent_tokens (int): Tokens actually sent; 0 if the call was skipped
+        kind (str): What was sent, e.g. "full", "short" or "skipped"
+    """
+    with _lock:
+        totals = _prompt_savings.setdefault(call_type, {"calls": {}, "full_tokens": 0, "sent_tokens": 0})
+        totals["calls"][kind] = totals["calls"].get(kind, 0) + 1
+        totals["full_tokens"] += full_tokens
+        totals["sent_tokens"] += sent_tokens
+
+def prompt_savings_summary():
+    """
+    Get the prompt tokens saved per call type since the process started.
+
+    Returns:
+        dict: {call_type: calls by kind, full and sent prompt tokens, 'tokens_saved' and
+            'saved_rate' (the share of full-prompt tokens not sent)}
+    """
+    with _lock:
+        return {
+            call_type: {
+                "calls": dict(totals["calls"]),
+                "full_tokens": totals["full_tokens"],
+                "sent_tokens": totals["sent_tokens"],
+                "tokens_saved": totals["full_tokens"] - totals["sent_tokens"],
+                "saved_rate": round(1 - totals["sent_tokens"] / totals["full_tokens"], 3)
+                    if totals["full_tokens"] else 0.0,
+            }
+            for call_type, totals in _prompt_savings.items()
+        }
+
+def record_transfer(endpoint, status, body_bytes, sent_bytes):
+    """
+    Record one HTTP response for the transfer summary.
+
+    Args:
+        endpoint (str): The route that served it, e.g. "api_get_categories" or "static"
+        status (int): HTTP status code
+        body_bytes (int): Size of the response body before compression
+        sent_bytes (int): Body bytes actually sent (0 for a 304)
+    """
+    with _lock:
+        totals = _transfers.setdefault(endpoint, {
+            "responses": 0,
+            "not_modified": 0,
+            "partial": 0,
+            "body_bytes": 0,
+            "sent_bytes": 0,
+        })
+        totals["responses"] += 1
+        totals["not_modified"] += status == 304
+        totals["partial"] += status == 206
+        totals["body_bytes"] += body_bytes
+        totals["sent_bytes"] += sent_bytes
+
+def transfer_summary():
+    """
+    Get a snapshot of the bytes sent per endpoint.
+
+    Returns:
+        dict: {endpoint: totals}, plus a 'total' entry. 'compression_ratio' compares the
+            bytes sent with the uncompressed bodies; 304 responses count as 0 bytes sent.
+    """
+    with _lock:
+        result = {endpoint: dict(totals) for endpoint, totals in _transfers.items()}
+    total = {key: sum(totals[key] for totals in result.values())
+             for key in ("responses", "not_modified", "partial", "body_bytes", "sent_bytes")}
+    result["total"] = total
+    for totals in result.values():
+        totals["compression_ratio"] = round(totals["sent_bytes"] / totals["body_bytes"], 3) \
+            if totals["body_bytes"] else None
+    return result
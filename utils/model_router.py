@@ -0,0 +1,241 @@
+import collections
+import json
+import os
+import threading
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Cheap, fast model for simple calls and the larger model calls escalate to
+SMALL_MODEL = os.getenv("SMALL_MODEL") or "gpt-4.1-mini"
+LARGE_MODEL = os.getenv("LARGE_MODEL") or "gpt-4.1"
+# Speech models aren't routed, but their latencies are tracked alongside the chat models
+TTS_MODEL = os.getenv("TTS_MODEL") or "gpt-4o-mini-tts"
+TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL") or "gpt-4o-mini-transcribe"
+UPLOAD_TRANSCRIBE_MODEL = os.getenv("UPLOAD_TRANSCRIBE_MODEL") or "whisper-1"
+
+# Per call type: the models it may use, cheapest first (the cost budget), the one it
+# prefers, and the p95 latency it should stay within
+ROUTES = {
+    "format_question": {"models": [SMALL_MODEL, LARGE_MODEL], "prefer": SMALL_MODEL, "budget_ms": 2000},
+    "evaluate": {"models": [SMALL_MODEL, LARGE_MODEL], "prefer": SMALL_MODEL, "budget_ms": 1500},
+    "evaluate_batch": {"models": [SMALL_MODEL, LARGE_MODEL], "prefer": SMALL_MODEL, "budget_ms": 5000},
+    "followup": {"models": [SMALL_MODEL, LARGE_MODEL], "prefer": LARGE_MODEL, "budget_ms": 4000},
+    "summarize": {"models": [SMALL_MODEL], "prefer": SMALL_MODEL, "budget_ms": 3000},
+}
+
+# Verdicts the small model is less sure of than this are re-checked by the large model
+ESCALATE_CONFIDENCE = float(os.getenv("ESCALATE_CONFIDENCE") or "0.7")
+# Cards longer than this, or with this many cloze blanks, are formatted by the large model
+COMPLEX_CARD_CHARS = 400
+COMPLEX_CARD_BLANKS = 3
+# Latencies kept per call type and model, and how many are needed before they count
+LATENCY_WINDOW = 100
+MIN_SAMPLES = 5
+# While a call type is routed away from its preferred model, every Nth call still goes to
+# it. A probe that comes back within budget discards the model's stale latencies.
+PROBE_EVERY = 20
+
+def is_complex_card(question, answer):
+    """
+    Decide whether a card is too involved for the small model to format.
+
+    Args:
+        question (str): The card's question, with cloze deletions shown as {blank}
+        answer (str): The card's answer
+
+    Returns:
+        bool: True for long cards and cards with several cloze blanks
+    """
+    return (len(question) + len(answer) > COMPLEX_CARD_CHARS
+            or question.count("{blank}") >= COMPLEX_CARD_BLANKS)
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+class ModelRouter:
+    """
+    Chooses a model for each call type within its latency and cost budget.
+
+    Each call type starts on its preferred model. When that model's observed p95 latency
+    goes over the budget, calls move to another allowed model whose p95 is within it
+    (trying models without enough samples yet), and every PROBE_EVERY calls one is sent
+    back to the preferred model to see whether it has recovered. Callers can escalate a
+    single call to the largest allowed model, e.g. for a complex card or a low-confidence
+    verdict, regardless of latency.
+    """
+    def __init__(self, routes=None):
+        """
+        Initialize the router.
+
+        Args:
+            routes (dict, optional): {call_type: {'models', 'prefer', 'budget_ms'}}. Defaults to ROUTES.
+        """
+        self.routes = routes or ROUTES
+        self._lock = threading.Lock()
+        self._latencies = {}  # {(call_type, model): deque of recent latencies in seconds}
+        self._calls = {}  # {(call_type, model): total calls observed}
+        self._decisions = {}  # {call_type: {"model/reason": count}}
+        self._routed_away = {}  # {call_type: calls routed away from the preferred model in a row}
+        self._probing = set()  # Call types with a probe of the preferred model in flight
+
+    def _p95(self, call_type, model):
+        window = self._latencies.get((call_type, model))
+        if window is None or len(window) < MIN_SAMPLES:
+            return None
+        return _percentile(window, 95)
+
+    def choose(self, call_type, escalate=None):
+        """
+        Choose the model for one call.
+
+        Args:
+            call_type (str): What the call is for, e.g. "evaluate"
+            escalate (str, optional): Why this call needs the largest allowed model,
+                e.g. "complex_card" or "low_confidence"
+
+        Returns:
+            str: The model to use
+        """
+        route = self.routes.get(call_type)
+        with self._lock:
+            if route is None:
+                model, reason = LARGE_MODEL, "unrouted"
+            elif escalate:
+                model, reason = route["models"][-1], escalate
+            else:
+                model, reason = self._choose_within_budget(call_type, route)
+            key = f"{model}/{reason}"
+            decisions = self._decisions.setdefault(call_type, {})
+            decisions[key] = decisions.get(key, 0) + 1
+        return model
+
+    def _choose_within_budget(self, call_type, route):
+        # Called with the lock held
+        preferred = route["prefer"]
+        budget = route["budget_ms"] / 1000
+        p95 = self._p95(call_type, preferred)
+        if p95 is None or p95 <= budget:
+            self._routed_away[call_type] = 0
+            return preferred, "preferred"
+
+        away = self._routed_away.get(call_type, 0) + 1
+        if away >= PROBE_EVERY:
+            self._routed_away[call_type] = 0
+            self._probing.add(call_type)
+            return preferred, "probe"
+        self._routed_away[call_type] = away
+
+        best, best_p95 = None, None
+        for model in route["models"]:
+            if model == preferred:
+                continue
+            other_p95 = self._p95(call_type, model)
+            if other_p95 is None:
+                return model, "explore"
+            if other_p95 <= budget and (best_p95 is None or other_p95 < best_p95):
+                best, best_p95 = model, other_p95
+        if best is None:
+            # Nothing is within budget; stay on the preferred model
+            return preferred, "over_budget"
+        return best, "latency"
+
+    def should_escalate(self, call_type, model, confidence):
+        """
+        Decide whether a result from a cheaper model should be redone by the largest one.
+
+        Args:
+            call_type (str): The call type
+            model (str): The model that produced the result
+            confidence (float or None): The model's reported confidence; None if it gave none
+                or didn't produce a usable result
+
+        Returns:
+            bool: True if a larger model is allowed and the confidence is too low
+        """
+        route = self.routes.get(call_type)
+        if route is None or model == route["models"][-1]:
+            return False
+        return confidence is None or confidence < ESCALATE_CONFIDENCE
+
+    def observe(self, call_type, model, latency):
+        """
+        Record the latency of one call.
+
+        Args:
+            call_type (str): The call type
+            model (str): The model used
+            latency (float): Wall-clock seconds the call took
+        """
+        key = (call_type, model)
+        route = self.routes.get(call_type)
+        with self._lock:
+            window = self._latencies.get(key)
+            if window is None:
+                window = self._latencies[key] = collections.deque(maxlen=LATENCY_WINDOW)
+            if call_type in self._probing and route and model == route["prefer"]:
+                self._probing.discard(call_type)
+                if latency <= route["budget_ms"] / 1000:
+                    # The preferred model has recovered; start its estimate afresh
+                    window.clear()
+            window.append(latency)
+            self._calls[key] = self._calls.get(key, 0) + 1
+
+    def summary(self):
+        """
+        Get the routing state of every call type.
+
+        Returns:
+            dict: {call_type: {'budget_ms', 'models': {model: calls and p50/p95 latency},
+                'decisions': {"model/reason": count}}}. Reasons are preferred, latency,
+                explore, probe, over_budget, unrouted, or the escalation reason.
+        """
+        with self._lock:
+            result = {}
+            call_types = {call_type for call_type, _ in self._latencies} | set(self._decisions)
+            for call_type in sorted(call_types):
+                route = self.routes.get(call_type)
+                models = {}
+                for (observed_type, model), window in self._latencies.items():
+                    if observed_type != call_type:
+                        continue
+                    models[model] = {
+                        "calls": self._calls[(observed_type, model)],
+                        "p50_ms": round(_percentile(window, 50) * 1000, 1),
+                        "p95_ms": round(_percentile(window, 95) * 1000, 1),
+                    }
+                result[call_type] = {
+                    "budget_ms": route["budget_ms"] if route else None,
+                    "models": models,
+                    "decisions": dict(self._decisions.get(call_type, {})),
+                }
+            return result
+
+_router = ModelRouter()
+
+def choose_model(call_type, escalate=None):
+    """Choose the model for one call with the shared router. See ModelRouter.choose."""
+    return _router.choose(call_type, escalate)
+
+def should_escalate(call_type, model, confidence):
+    """Decide whether to redo a result with the largest model. See ModelRouter.should_escalate."""
+    return _router.should_escalate(call_type, model, confidence)
+
+def observe(call_type, model, latency):
+    """Record one call's latency with the shared router."""
+    _router.observe(call_type, model, latency)
+
+def summary():
+    """Get the shared router's routing state. See ModelRouter.summary."""
+    return _router.summary()
+
+if __name__ == "__main__":
+    # Example usage: simulate the small model slowing down past the evaluation budget
+    router = ModelRouter()
+    for i in range(100):
+        model = router.choose("evaluate")
+        slow = 20 <= i < 45
+        router.observe("evaluate", model, (2.5 if slow else 0.6) if model == SMALL_MODEL else 1.1)
+    print(json.dumps(router.summary(), indent=2))
@@ -0,0 +1,28 @@
+import os
+import threading
+
+import dotenv
+from openai import OpenAI
+
+dotenv.load_dotenv()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Get the process-wide OpenAI client, creating it on first use.
+
+    The client is created lazily so that importing utils (e.g. to run one of the
+    offline benchmarks) doesn't need OPENAI_API_KEY; it is only needed once a call is
+    made. Every module shares the client and its connection pool.
+
+    Returns:
+        OpenAI: The shared client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
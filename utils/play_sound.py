@@ -1,30 +1,199 @@
 from pathlib import Path
 import platform
+import shutil
 import subprocess
+import time
+import wave
+
+from .audio_player import get_player
+from .config import PROJECT_ROOT
+
+# MPEG audio layer III bitrates (kbps) and sample rates, by MPEG version
+_MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+def resolve_sound_path(sound_file_path):
+    """
+    Map a web path such as /static/audio/speech_<hash>.mp3 (as returned by text_to_speech)
+    to the file on disk. Other paths are returned unchanged.
+    """
+    path = Path(sound_file_path)
+    if not path.exists() and str(sound_file_path).startswith("/static/"):
+        path = PROJECT_ROOT / str(sound_file_path).lstrip("/")
+    return path
+
+def _mp3_duration(path):
+    """Estimate an MP3's duration from its first frame header (and Xing/Info frame count)."""
+    with open(path, 'rb') as f:
+        data = f.read(64 * 1024)
+        size = f.seek(0, 2)
+    offset = 0
+    if data[:3] == b"ID3":
+        offset = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+    while offset + 4 <= len(data):
+        if data[offset] == 0xFF and data[offset + 1] & 0xE0 == 0xE0:
+            break
+        offset += 1
+    else:
+        return None
+    header = int.from_bytes(data[offset:offset + 4], 'big')
+    version = {3: 1, 2: 2, 0: 2.5}.get((header >> 19) & 3)
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 3
+    if version is None or (header >> 17) & 3 != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    samples_per_frame = 1152 if version == 1 else 576
+
+    # A Xing/Info frame gives the exact frame count, which also covers VBR files
+    mono = (header >> 6) & 3 == 3
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    tag = offset + 4 + side_info
+    if data[tag:tag + 4] in (b"Xing", b"Info") and int.from_bytes(data[tag + 4:tag + 8], 'big') & 1:
+        frames = int.from_bytes(data[tag + 8:tag + 12], 'big')
+        return frames * samples_per_frame / sample_rate
+    bitrate = _MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    return (size - offset) * 8 / bitrate
+
+def sound_duration(sound_file_path):
+    """
+    Get the duration of a WAV or MP3 file without decoding it.
+
+    Args:
+        sound_file_path (str or Path): Path to the sound file
+
+    Returns:
+        float: Duration in seconds, or None if it can't be determined
+    """
+    path = resolve_sound_path(sound_file_path)
+    try:
+        if path.suffix.lower() == ".wav":
+            with wave.open(str(path), 'rb') as wf:
+                return wf.getnframes() / wf.getframerate()
+        if path.suffix.lower() == ".mp3":
+            return _mp3_duration(path)
+    except (OSError, EOFError, wave.Error):
+        pass
+    return None
+
+class Playback:
+    """
+    A sound playing in the background, which can be stopped early.
+    """
+    def __init__(self, process, duration):
+        self._process = process
+        self.duration = duration  # Seconds, or None if unknown
+        self.started_at = time.monotonic()
+        self.stopped_at = None  # When the sound was cut off, if it was
+
+    def is_playing(self):
+        """Return True while the sound is still playing."""
+        return self._process.poll() is None
+
+    def stop(self):
+        """Stop the sound now, if it is still playing."""
+        if self.is_playing():
+            self._process.terminate()
+            self.stopped_at = time.monotonic()
+
+    def wait(self):
+        """Block until the sound has finished (or been stopped)."""
+        self._process.wait()
+
+    def time_saved(self):
+        """
+        Get the part of the sound that was skipped by stopping it early.
+
+        Returns:
+            float: Seconds of audio that didn't have to be listened to
+        """
+        if self.stopped_at is None or self.duration is None:
+            return 0.0
+        return max(0.0, self.duration - (self.stopped_at - self.started_at))
+
+def _player_command(sound_file_path):
+    """Choose a command-line player for the file on this platform, or None."""
+    system = platform.system()
+    if system == "Darwin":  # macOS
+        return ["afplay", str(sound_file_path)]
+    if system == "Linux":
+        # aplay only understands WAV; use an MP3-capable player when one is installed
+        if sound_file_path.suffix.lower() != ".wav":
+            if shutil.which("mpg123"):
+                return ["mpg123", "-q", str(sound_file_path)]
+            if shutil.which("ffplay"):
+                return ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", str(sound_file_path)]
+        return ["aplay", "-q", str(sound_file_path)]
+    return None
+
+def start_sound(sound_file_path, interrupt=False):
+    """
+    Start playing a sound file without waiting for it to finish.
+
+    Sounds are played in-process by the shared AudioPlayer when audio output is
+    available, queued behind anything already playing; otherwise an external player
+    process is started.
+
+    Args:
+        sound_file_path (str or Path): Path to the sound file, or a /static/ web path
+        interrupt (bool, optional): Cut off whatever the in-process player is playing first
+
+    Returns:
+        PlayingSound or Playback: Handle for the playing sound, or None if it can't be
+            played in the background on this platform (use play_sound instead)
+    """
+    sound_file_path = resolve_sound_path(sound_file_path)
+    player = get_player()
+    if player is not None and player.can_play(sound_file_path):
+        try:
+            return player.play(sound_file_path, interrupt=interrupt)
+        except Exception as e:
+            if not sound_file_path.exists():
+                print(f"Sound file not found: {sound_file_path}")
+                return None
+            print(f"Falling back to an external player for {sound_file_path.name}: {e}")
+    if not sound_file_path.exists():
+        print(f"Sound file not found: {sound_file_path}")
+        return None
+    command = _player_command(sound_file_path)
+    if command is None:
+        return None
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        print(f"Error playing sound: {e}")
+        return None
+    return Playback(process, sound_duration(sound_file_path))
 
 def play_sound(sound_file_path):
     """
     Play a sound file. Platform-independent.
     
     Args:
-        sound_file_path (str or Path): Path to the sound file to play
+        sound_file_path (str or Path): Path to the sound file to play, or a /static/ web path
     
     Returns:
         bool: True if the sound was played successfully, False otherwise
     """
-    sound_file_path = Path(sound_file_path)
+    sound_file_path = resolve_sound_path(sound_file_path)
     
     if not sound_file_path.exists():
         print(f"Sound file not found: {sound_file_path}")
         return False
     
+    playback = start_sound(sound_file_path)
+    if playback is not None:
+        playback.wait()
+        return True
+    
     system = platform.system()
     
     try:
-        if system == "Darwin":  # macOS
-            subprocess.call(["afplay", str(sound_file_path)])
-        elif system == "Linux":
-            subprocess.call(["aplay", str(sound_file_path)])
+        if system in ("Darwin", "Linux"):
+            subprocess.call(_player_command(sound_file_path))
         elif system == "Windows":
             import winsound
             winsound.PlaySound(str(sound_file_path), winsound.SND_FILENAME)
@@ -0,0 +1,195 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import dotenv
+
+from .config import DATA_DIR, PROJECT_ROOT
+
+dotenv.load_dotenv()
+
+# Requests are only profiled when they carry this secret; without it the hooks aren't installed
+PROFILE_SECRET = os.getenv("PROFILE_SECRET") or ""
+# Profiles are written here, keeping only the newest PROFILE_KEEP
+PROFILE_DIR = DATA_DIR / "profiles"
+PROFILE_KEEP = max(1, int(os.getenv("PROFILE_KEEP") or "100"))
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.002
+# "sample" records wall-clock stacks as folded text (flamegraph.pl, speedscope);
+# "trace" runs cProfile and writes .pstats (snakeviz, flameprof, python -m pstats)
+MODES = {"sample": ".folded", "trace": ".pstats"}
+
+def _frame_name(code):
+    """Name a frame as 'function (path:line)', with paths relative to the project or site-packages."""
+    path = code.co_filename
+    root = str(PROJECT_ROOT) + os.sep
+    if path.startswith(root):
+        path = path[len(root):]
+    elif "site-packages" + os.sep in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+class _Sampler(threading.Thread):
+    """Samples one thread's stack at a fixed interval and counts identical stacks."""
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()  # {"root;...;leaf": samples}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        names = {}  # Code objects repeat from sample to sample, so name each once
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class Profile:
+    """One profiled block: its id, mode, duration and where its profile was written."""
+    def __init__(self, name, mode="sample"):
+        self.mode = mode if mode in MODES else "sample"
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}"
+        self.path = PROFILE_DIR / f"{self.id}{MODES[self.mode]}"
+        self.seconds = None
+
+def _write_profile(profile, write):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = profile.path.with_name(f".{profile.path.name}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, profile.path)
+    # Keep only the newest profiles
+    profiles = sorted((path for path in PROFILE_DIR.iterdir() if path.suffix in MODES.values()),
+                      key=lambda path: path.stat().st_mtime)
+    for path in profiles[:-PROFILE_KEEP]:
+        with contextlib.suppress(OSError):
+            path.unlink()
+
+@contextlib.contextmanager
+def profile_block(name, mode="sample"):
+    """
+    Profile the code run in the block on the current thread and write the profile.
+
+    Args:
+        name (str): What is being profiled, e.g. the endpoint; part of the profile id
+        mode (str, optional): "sample" or "trace", see MODES
+
+    Yields:
+        Profile: The profile; its id is set at once, its path is written on exit
+    """
+    profile = Profile(name, mode)
+    start = time.perf_counter()
+    if profile.mode == "trace":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profile
+        finally:
+            profiler.disable()
+            profile.seconds = time.perf_counter() - start
+            _write_profile(profile, profiler.dump_stats)
+    else:
+        sampler = _Sampler(threading.get_ident())
+        sampler.start()
+        try:
+            yield profile
+        finally:
+            sampler.stop()
+            profile.seconds = time.perf_counter() - start
+
+            def write(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    for stack, count in sampler.stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+
+            _write_profile(profile, write)
+
+def profiled(view):
+    """
+    Let a Flask view be profiled on request.
+
+    A request is profiled when its X-Profile header (or ?profile= argument) matches
+    PROFILE_SECRET. X-Profile-Mode (or ?profile_mode=) picks the mode. The profile id
+    comes back in the X-Profile-Id response header. Without PROFILE_SECRET the view is
+    returned as is, so the hook costs nothing.
+
+    Args:
+        view (function): The view function
+
+    Returns:
+        function: The view, wrapped if profiling is enabled
+    """
+    if not PROFILE_SECRET:
+        return view
+    from flask import make_response, request
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-Profile") or request.args.get("profile")
+        if not token or not hmac.compare_digest(token.encode(), PROFILE_SECRET.encode()):
+            return view(*args, **kwargs)
+        mode = request.headers.get("X-Profile-Mode") or request.args.get("profile_mode", "sample")
+        with profile_block(request.endpoint, mode) as profile:
+            response = make_response(view(*args, **kwargs))
+        response.headers["X-Profile-Id"] = profile.id
+        response.headers["Server-Timing"] = f"profiled;dur={profile.seconds * 1000:.1f}"
+        return response
+    return wrapper
+
+def _workload():
+    # A mix of Python work and waiting, like a request that calls the API
+    total = 0
+    for i in range(200_000):
+        total += i * i % 7
+    time.sleep(0.02)
+    return total
+
+def benchmark(runs=20):
+    """
+    Measure what profiling adds to a request-like workload.
+
+    Returns:
+        dict: Mean milliseconds per run without profiling and in each mode
+    """
+    global PROFILE_DIR
+    import tempfile
+
+    results = {}
+    saved_dir = PROFILE_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        PROFILE_DIR = Path(tmpdir)
+        try:
+            for mode in (None, "sample", "trace"):
+                start = time.perf_counter()
+                for _ in range(runs):
+                    with profile_block("benchmark", mode) if mode else contextlib.nullcontext():
+                        _workload()
+                results[mode or "off"] = round((time.perf_counter() - start) / runs * 1000, 1)
+        finally:
+            PROFILE_DIR = saved_dir
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.profiling
+    print(json.dumps(benchmark(), indent=2))
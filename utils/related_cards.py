@@ -0,0 +1,142 @@
+import re
+import time
+import zlib
+
+import numpy as np
+
+# Number of hashed term buckets. Collisions are rare at this size and the per-feature
+# offsets array stays at 2 MiB regardless of deck size.
+N_FEATURES = 2 ** 18
+# Multiplier applied to cards in the same sub-deck as the current card
+SAME_DECK_BOOST = 1.5
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its of on or "
+    "so that the their there this to was what when where which who why will with you blank".split()
+)
+
+def _tokens(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1]
+
+def _hash(token):
+    return zlib.crc32(token.encode()) & (N_FEATURES - 1)
+
+def _features(text):
+    """Hash the non-stopword terms of a text into (feature ids, term counts)."""
+    hashed = np.fromiter((_hash(t) for t in _tokens(text)), dtype=np.int64)
+    features, counts = np.unique(hashed, return_counts=True)
+    return features, counts.astype(np.float32)
+
+class RelatedCardIndex:
+    """
+    Local TF-IDF index over hashed terms for finding cards related to a follow-up.
+
+    The term matrix is stored column-major (one posting list per hashed term), so a
+    query only touches the postings of its own terms and scores every card in a single
+    vectorized pass. No network access is needed.
+    """
+    def __init__(self, card_ids, deck_ids, note_ids, indptr, rows, weights, idf):
+        self.card_ids = card_ids  # int64 [n_cards]
+        self.deck_ids = deck_ids  # int64 [n_cards]
+        self.note_ids = note_ids  # int64 [n_cards]
+        self.indptr = indptr  # int64 [N_FEATURES + 1], offsets of each term's postings
+        self.rows = rows  # int32 [nnz], card row of each posting
+        self.weights = weights  # float32 [nnz], L2-normalized tf-idf weight of each posting
+        self.idf = idf  # float32 [N_FEATURES]
+        self._row_of = {card_id: row for row, card_id in enumerate(card_ids.tolist())}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, cards):
+        """
+        Build the index over a deck's cards.
+
+        Args:
+            cards (dict): {card_id: card dict} as stored in DeckIndex.cards
+
+        Returns:
+            RelatedCardIndex: The built index
+        """
+        start = time.perf_counter()
+        card_ids = np.fromiter(cards.keys(), dtype=np.int64, count=len(cards))
+        deck_ids = np.fromiter((card['deck_id'] for card in cards.values()), dtype=np.int64, count=len(cards))
+        note_ids = np.fromiter((card['note_id'] for card in cards.values()), dtype=np.int64, count=len(cards))
+
+        # Hash every term once, then count (card, term) pairs in one vectorized pass
+        hashed, hashed_rows = [], []
+        for row, card in enumerate(cards.values()):
+            card_features = [_hash(t) for t in _tokens(f"{card['question']} {card['answer']}")]
+            hashed.extend(card_features)
+            hashed_rows.extend([row] * len(card_features))
+        pairs = np.array(hashed_rows, dtype=np.int64) * N_FEATURES + np.array(hashed, dtype=np.int64)
+        pairs, counts = np.unique(pairs, return_counts=True)
+        rows = (pairs // N_FEATURES).astype(np.int32)
+        features = pairs % N_FEATURES
+        counts = counts.astype(np.float32)
+
+        # Smoothed idf, sublinear tf, then L2-normalize each card's vector
+        n_cards = len(card_ids)
+        df = np.bincount(features, minlength=N_FEATURES).astype(np.float32)
+        idf = (np.log((1.0 + n_cards) / (1.0 + df)) + 1.0).astype(np.float32)
+        weights = (1.0 + np.log(counts)) * idf[features]
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=n_cards)).astype(np.float32)
+        norms[norms == 0] = 1.0
+        weights = (weights / norms[rows]).astype(np.float32)
+
+        # Group postings by term
+        order = np.argsort(features, kind='stable')
+        indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=N_FEATURES), out=indptr[1:])
+
+        index = cls(card_ids, deck_ids, note_ids, indptr, rows[order], weights[order], idf)
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def related(self, text, k=3, card_id=None):
+        """
+        Find the cards most similar to a text.
+
+        Args:
+            text (str): Query text, e.g. the current card plus the follow-up question
+            k (int, optional): Number of cards to return
+            card_id (int, optional): The current card. It and the other cards of its note
+                (e.g. sibling cloze deletions) are excluded from the results, and cards in
+                its sub-deck are boosted.
+
+        Returns:
+            list: Up to k (card_id, score) tuples, best first
+        """
+        features, counts = _features(text)
+        n_cards = len(self.card_ids)
+        if not len(features) or not n_cards:
+            return []
+
+        query_weights = (1.0 + np.log(counts)) * self.idf[features]
+        query_weights /= np.linalg.norm(query_weights)
+
+        # Gather the postings of the query's terms and accumulate cosine scores per card
+        starts = self.indptr[features]
+        lengths = self.indptr[features + 1] - starts
+        ends = np.cumsum(lengths)
+        if not ends[-1]:
+            return []
+        # Offset of every posting: its term's start plus its position within the term's postings
+        posting_idx = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1])
+        contributions = self.weights[posting_idx] * np.repeat(query_weights, lengths)
+        scores = np.bincount(self.rows[posting_idx], weights=contributions, minlength=n_cards)
+
+        row = self._row_of.get(card_id)
+        if row is not None:
+            scores[self.deck_ids == self.deck_ids[row]] *= SAME_DECK_BOOST
+            scores[self.note_ids == self.note_ids[row]] = 0.0
+
+        k = min(k, n_cards)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.card_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def memory_bytes(self):
+        """Return the bytes held by the index arrays."""
+        return sum(a.nbytes for a in (self.card_ids, self.deck_ids, self.note_ids, self.indptr,
+                                      self.rows, self.weights, self.idf))
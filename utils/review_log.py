@@ -0,0 +1,487 @@
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .config import DATA_DIR
+
+REVIEW_LOG_DIR = DATA_DIR / "reviews"
+# Attempts buffered in memory before they are written out as a chunk
+CHUNK_ROWS = 65536
+# Buffered attempts are also written out once the oldest is this many seconds old
+FLUSH_SECONDS = 30.0
+# Small chunks are merged into one once there are this many
+MAX_CHUNKS = 64
+# Cards need this many attempts to be ranked among the weakest
+MIN_CARD_ATTEMPTS = 3
+# Median response times are read from per-group histograms with bins this wide; longer
+# responses count in the last bin
+RESPONSE_BIN_MS = 10
+RESPONSE_BINS = 6000
+
+# Column name -> dtype. One .npy file per column per chunk, like a Parquet row group.
+COLUMNS = {
+    "timestamp": np.float64,  # Unix seconds
+    "card": np.int32,  # Index into the card dictionary
+    "category": np.int16,  # Index into the category dictionary
+    "correct": np.bool_,
+    "response_ms": np.float32,  # NaN when unknown
+}
+
+class ReviewLog:
+    """
+    Append-only columnar log of study attempts.
+
+    Attempts are buffered in memory and written out in chunks, each chunk a directory
+    with one .npy file per column. Cards and categories are dictionary-encoded into
+    small integers, so the aggregations in review_stats are bincounts and sorts over
+    flat arrays rather than Python loops over rows. New dictionary entries are appended
+    to dictionary.jsonl as chunks are written. Reads see the buffered attempts too, and
+    never write anything themselves.
+    """
+    def __init__(self, directory=None, chunk_rows=CHUNK_ROWS, flush_seconds=FLUSH_SECONDS):
+        """
+        Initialize the log, loading its dictionaries from disk.
+
+        Args:
+            directory (str or Path, optional): Where chunks are stored. Defaults to REVIEW_LOG_DIR.
+            chunk_rows (int, optional): Attempts buffered before a chunk is written
+            flush_seconds (float, optional): Longest time an attempt stays buffered
+        """
+        self.directory = Path(directory or REVIEW_LOG_DIR)
+        self.chunk_rows = chunk_rows
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._buffer = {name: [] for name in COLUMNS}
+        self._buffered_since = None
+        self._chunk_columns = None  # Cached concatenation of the written chunks
+        self._chunk_key = None
+        self._columns = None  # Cached chunks plus buffered attempts
+        self._columns_key = None
+        self.categories = []  # Category names, indexed by code
+        self.cards = []  # [deck, card_id, category code], indexed by code
+        self._load_dictionary()
+        self._remove_merged_chunks()
+        self._category_codes = {name: code for code, name in enumerate(self.categories)}
+        self._card_codes = {(deck, card_id): code for code, (deck, card_id, _) in enumerate(self.cards)}
+        # Dictionary entries already on disk
+        self._written_categories = len(self.categories)
+        self._written_cards = len(self.cards)
+
+    def _load_dictionary(self):
+        # Logs written before the dictionary became append-only keep their entries in
+        # dictionary.json; later entries follow in dictionary.jsonl
+        legacy_path = self.directory / "dictionary.json"
+        if legacy_path.exists():
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                dictionary = json.load(f)
+            self.categories = dictionary["categories"]
+            self.cards = dictionary["cards"]
+        path = self.directory / "dictionary.jsonl"
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash; no chunk refers to it
+                    break
+                if "category" in entry:
+                    self.categories.append(entry["category"])
+                else:
+                    self.cards.append(entry["card"])
+
+    def _all_chunk_dirs(self):
+        if not self.directory.exists():
+            return []
+        return sorted(path for path in self.directory.glob("chunk-*") if path.is_dir())
+
+    def _merged_chunk_names(self, chunks):
+        # Chunks a compaction merged, from the manifests of the chunks it wrote
+        merged = set()
+        for chunk in chunks:
+            manifest = chunk / "merged.json"
+            if manifest.exists():
+                merged.update(json.loads(manifest.read_text(encoding='utf-8')))
+        return merged
+
+    def _chunk_dirs(self):
+        # A compaction that stopped before deleting the chunks it merged leaves them
+        # behind; they are skipped so their attempts aren't counted twice
+        chunks = self._all_chunk_dirs()
+        merged = self._merged_chunk_names(chunks)
+        return [chunk for chunk in chunks if chunk.name not in merged]
+
+    def _remove_merged_chunks(self):
+        chunks = self._all_chunk_dirs()
+        merged = self._merged_chunk_names(chunks)
+        for chunk in chunks:
+            if chunk.name in merged:
+                for path in chunk.iterdir():
+                    path.unlink()
+                chunk.rmdir()
+
+    def record(self, deck, card_id, category, is_correct, response_ms=None, timestamp=None):
+        """
+        Append one study attempt.
+
+        Args:
+            deck (str): Registry key of the card's deck
+            card_id (int): The card's id
+            category (str): The card's category (its full deck name, as in get_categories)
+            is_correct (bool): The verdict from evaluate_answer
+            response_ms (float, optional): Time the student took to answer
+            timestamp (float, optional): Unix time of the attempt. Defaults to now.
+        """
+        with self._lock:
+            category_code = self._category_codes.get(category)
+            if category_code is None:
+                category_code = self._category_codes[category] = len(self.categories)
+                self.categories.append(category)
+            card_code = self._card_codes.get((deck, card_id))
+            if card_code is None:
+                card_code = self._card_codes[(deck, card_id)] = len(self.cards)
+                self.cards.append([deck, card_id, category_code])
+            buffer = self._buffer
+            buffer["timestamp"].append(time.time() if timestamp is None else timestamp)
+            buffer["card"].append(card_code)
+            buffer["category"].append(category_code)
+            buffer["correct"].append(bool(is_correct))
+            buffer["response_ms"].append(np.nan if response_ms is None else response_ms)
+            if self._buffered_since is None:
+                self._buffered_since = time.monotonic()
+            if (len(buffer["timestamp"]) >= self.chunk_rows
+                    or time.monotonic() - self._buffered_since >= self.flush_seconds):
+                self._flush()
+
+    def append_columns(self, columns):
+        """
+        Append many already-encoded attempts at once, e.g. when importing history.
+
+        Args:
+            columns (dict): {column name: array}, with card and category codes that are
+                already in self.cards and self.categories
+        """
+        with self._lock:
+            self._flush()
+            self._write_chunk({name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS.items()})
+
+    def flush(self):
+        """Write buffered attempts out to a chunk."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # Called with the lock held
+        if not self._buffer["timestamp"]:
+            return
+        columns = {name: np.asarray(values, dtype=COLUMNS[name]) for name, values in self._buffer.items()}
+        self._buffer = {name: [] for name in COLUMNS}
+        self._buffered_since = None
+        self._write_chunk(columns)
+
+    def _write_chunk(self, columns):
+        # Called with the lock held
+        chunks = self._chunk_dirs()
+        number = int(chunks[-1].name.split("-")[1]) + 1 if chunks else 1
+        chunk_dir = self.directory / f"chunk-{number:06d}"
+        partial_dir = self.directory / f".{chunk_dir.name}.tmp"
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        for name, values in columns.items():
+            np.save(partial_dir / f"{name}.npy", values)
+        self._append_dictionary()
+        # Rename into place so readers never see a partial chunk
+        partial_dir.rename(chunk_dir)
+        if len(chunks) + 1 > MAX_CHUNKS:
+            self._compact()
+
+    def _append_dictionary(self):
+        # Called with the lock held, before the chunk that uses the new entries is
+        # renamed into place
+        lines = [json.dumps({"category": name}) for name in self.categories[self._written_categories:]]
+        lines += [json.dumps({"card": card}) for card in self.cards[self._written_cards:]]
+        if not lines:
+            return
+        with open(self.directory / "dictionary.jsonl", 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        self._written_categories = len(self.categories)
+        self._written_cards = len(self.cards)
+
+    def _compact(self):
+        """Merge every chunk into one."""
+        chunks = self._chunk_dirs()
+        columns = self._read_chunks(chunks)
+        merged_dir = self.directory / f"chunk-{int(chunks[-1].name.split('-')[1]) + 1:06d}"
+        partial_dir = self.directory / f".{merged_dir.name}.tmp"
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        for name, values in columns.items():
+            np.save(partial_dir / f"{name}.npy", values)
+        with open(partial_dir / "merged.json", 'w', encoding='utf-8') as f:
+            json.dump([chunk.name for chunk in chunks], f)
+        partial_dir.rename(merged_dir)
+        self._remove_merged_chunks()
+
+    def _read_chunks(self, chunks):
+        parts = {name: [] for name in COLUMNS}
+        for chunk in chunks:
+            for name in COLUMNS:
+                parts[name].append(np.load(chunk / f"{name}.npy", mmap_mode='r'))
+        return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS[name])
+                for name, arrays in parts.items()}
+
+    def columns(self):
+        """
+        Get every attempt as columns, in the order they were recorded.
+
+        Attempts still in the buffer are included without writing them out, so reading
+        stays free of chunk writes and compactions.
+
+        Returns:
+            dict: {column name: np.ndarray}
+        """
+        with self._lock:
+            chunks = self._chunk_dirs()
+            chunk_key = tuple(chunk.name for chunk in chunks)
+            if chunk_key != self._chunk_key:
+                self._chunk_columns = self._read_chunks(chunks)
+                self._chunk_key = chunk_key
+            key = (chunk_key, len(self._buffer["timestamp"]))
+            if key != self._columns_key:
+                if key[1]:
+                    self._columns = {
+                        name: np.concatenate((self._chunk_columns[name], np.asarray(self._buffer[name], dtype=dtype)))
+                        for name, dtype in COLUMNS.items()
+                    }
+                else:
+                    self._columns = self._chunk_columns
+                self._columns_key = key
+            return self._columns
+
+    def stats(self, days=30, weakest=5, now=None):
+        """
+        Compute the review statistics. See review_stats.
+
+        Returns:
+            dict: The statistics
+        """
+        columns = self.columns()
+        with self._lock:
+            categories = list(self.categories)
+            card_categories = np.array([card[2] for card in self.cards], dtype=np.int32)
+            cards = [card[:2] for card in self.cards]
+        result = review_stats(columns, categories, card_categories, days=days, weakest=weakest, now=now)
+        for category in result["categories"].values():
+            category["weakest_cards"] = [
+                {"deck": cards[code][0], "card_id": cards[code][1], **card}
+                for code, card in category.pop("weakest_codes")
+            ]
+        return result
+
+def _response_histograms(response_ms, groups, n_groups):
+    """
+    Histogram the response times of each group code with a single bincount.
+
+    Args:
+        response_ms (np.ndarray): Response times, NaN when unknown
+        groups (np.ndarray): Group code of each response
+        n_groups (int): Number of group codes
+
+    Returns:
+        np.ndarray: (n_groups, RESPONSE_BINS) counts; unknown response times are left out
+    """
+    known = ~np.isnan(response_ms)
+    if not known.all():
+        response_ms, groups = response_ms[known], groups[known]
+    bins = np.minimum(response_ms * (1 / RESPONSE_BIN_MS), RESPONSE_BINS - 1).astype(np.int32)
+    return np.bincount(groups.astype(np.int32) * RESPONSE_BINS + bins,
+                       minlength=n_groups * RESPONSE_BINS).reshape(n_groups, RESPONSE_BINS)
+
+def _histogram_medians(histogram):
+    """
+    Median of each histogram row, to within RESPONSE_BIN_MS.
+
+    Returns:
+        np.ndarray: The middle of each row's median bin, NaN for empty rows
+    """
+    cumulative = histogram.cumsum(axis=1)
+    counts = cumulative[:, -1]
+    middle = (cumulative >= ((counts + 1) // 2)[:, None]).argmax(axis=1)
+    return np.where(counts > 0, (middle + 0.5) * RESPONSE_BIN_MS, np.nan)
+
+def _round(value, digits=1):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+def review_stats(columns, categories, card_categories, days=30, weakest=5, now=None):
+    """
+    Aggregate study attempts per category and per day with vectorized NumPy operations.
+
+    Nothing is sorted or looped over per row: counts are bincounts over the
+    dictionary-encoded category and card codes, median response times come from
+    per-group histograms, and days are found by binary search over the timestamps,
+    which are already in time order.
+
+    Args:
+        columns (dict): {column name: np.ndarray} as returned by ReviewLog.columns, in
+            recording order
+        categories (list): Category names by code
+        card_categories (np.ndarray): Category code of each card code
+        days (int, optional): Number of most recent days to report per day
+        weakest (int, optional): Weakest cards to report per category
+        now (float, optional): Unix time to report up to. Defaults to now.
+
+    Returns:
+        dict: 'total' attempts and accuracy, 'day_streak' (consecutive study days up to
+            today or yesterday, at most `days`), per-category 'categories' with accuracy,
+            median response time, current run of correct answers and weakest cards, and
+            per-day 'days'
+    """
+    now = time.time() if now is None else now
+    timestamp = columns["timestamp"]
+    category = columns["category"]
+    correct = columns["correct"]
+    response_ms = columns["response_ms"]
+    card = columns["card"]
+    n_categories = len(categories)
+    n = len(timestamp)
+    if n > 1 and not (timestamp[1:] >= timestamp[:-1]).all():
+        # Attempts imported out of order; put them in time order first
+        order = np.argsort(timestamp, kind='stable')
+        timestamp, category, correct, response_ms, card = (
+            timestamp[order], category[order], correct[order], response_ms[order], card[order])
+
+    # Per category
+    # One bincount over (code, correct) pairs gives both the attempts and the correct ones
+    outcomes = np.bincount(category.astype(np.int32) * 2 + correct, minlength=n_categories * 2).reshape(-1, 2)
+    attempts = outcomes.sum(axis=1)
+    correct_counts = outcomes[:, 1]
+    histograms = _response_histograms(response_ms, category, n_categories)
+    medians = _histogram_medians(histograms)
+    # Current streak: attempts in the category since its most recent wrong answer
+    wrong = np.flatnonzero(~correct)
+    last_wrong = np.full(n_categories, -1, dtype=np.int64)
+    np.maximum.at(last_wrong, category[wrong], wrong)
+    # Only rows after the earliest of those can be part of a streak
+    tail_start = int(last_wrong[attempts > 0].min()) + 1 if n else 0
+    tail = category[tail_start:]
+    streaks = np.bincount(tail[np.arange(tail_start, n) > last_wrong[tail]], minlength=n_categories)
+    nonempty = np.flatnonzero(attempts)
+
+    # Per card, for the weakest cards in each category
+    n_cards = len(card_categories)
+    card_outcomes = np.bincount(card * 2 + correct, minlength=n_cards * 2).reshape(-1, 2)
+    card_attempts = card_outcomes.sum(axis=1)
+    card_correct = card_outcomes[:, 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        card_accuracy = card_correct / card_attempts
+    eligible = np.flatnonzero(card_attempts >= MIN_CARD_ATTEMPTS)
+    # Sort by category, then accuracy, then most attempts first
+    ranked = eligible[np.lexsort((-card_attempts[eligible], card_accuracy[eligible], card_categories[eligible]))]
+    ranked_bounds = np.searchsorted(card_categories[ranked], np.arange(n_categories + 1))
+
+    per_category = {}
+    for code in nonempty:
+        weakest_codes = ranked[ranked_bounds[code]:ranked_bounds[code + 1]][:weakest]
+        per_category[categories[code]] = {
+            "attempts": int(attempts[code]),
+            "accuracy": round(float(correct_counts[code] / attempts[code]), 3),
+            "median_response_ms": _round(medians[code]),
+            "correct_streak": int(streaks[code]),
+            "weakest_codes": [
+                (int(c), {"attempts": int(card_attempts[c]), "accuracy": round(float(card_accuracy[c]), 3)})
+                for c in weakest_codes
+            ],
+        }
+
+    # Per day (UTC), over the most recent days
+    first_day = int(now // 86400) - days + 1
+    day_bounds = np.searchsorted(timestamp, (first_day + np.arange(days + 1)) * 86400.0)
+    day_attempts = np.diff(day_bounds)
+    correct_before = np.concatenate(([0], np.cumsum(correct[day_bounds[0]:day_bounds[-1]])))
+    day_correct = np.diff(correct_before[day_bounds - day_bounds[0]])
+    recent = slice(day_bounds[0], day_bounds[-1])
+    day_medians = _histogram_medians(_response_histograms(
+        response_ms[recent], np.repeat(np.arange(days, dtype=np.int32), day_attempts), days))
+    per_day = {}
+    for offset in np.flatnonzero(day_attempts):
+        date = time.strftime("%Y-%m-%d", time.gmtime((first_day + offset) * 86400))
+        per_day[date] = {
+            "attempts": int(day_attempts[offset]),
+            "accuracy": round(float(day_correct[offset] / day_attempts[offset]), 3),
+            "median_response_ms": _round(day_medians[offset]),
+        }
+
+    # Consecutive study days ending today (or yesterday, if nothing has been studied yet today)
+    studied = np.zeros(days + 1, dtype=bool)
+    studied[1:] = day_attempts > 0
+    end = days if studied[days] else days - 1
+    gaps = np.flatnonzero(~studied[:end + 1])
+    day_streak = end - gaps[-1]
+
+    return {
+        "total": {
+            "attempts": n,
+            "accuracy": round(float(np.count_nonzero(correct) / n), 3) if n else None,
+            "median_response_ms": _round(_histogram_medians(histograms.sum(axis=0, keepdims=True))[0]),
+        },
+        "day_streak": int(day_streak),
+        "categories": per_category,
+        "days": per_day,
+    }
+
+def _synthetic_columns(rows, n_categories=50, n_cards=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    card = rng.integers(0, n_cards, rows).astype(np.int32)
+    card_categories = (np.arange(n_cards) % n_categories).astype(np.int32)
+    start = time.time() - 365 * 86400
+    return {
+        "timestamp": np.sort(rng.uniform(start, time.time(), rows)),
+        "card": card,
+        "category": card_categories[card].astype(np.int16),
+        "correct": rng.random(rows) < 0.7,
+        "response_ms": rng.lognormal(8, 0.5, rows).astype(np.float32),
+    }, [f"Category {i}" for i in range(n_categories)], card_categories
+
+def _loop_stats(columns, categories):
+    """Per-row Python loop computing the per-category figures, for comparison."""
+    totals = {}
+    for category, correct, response_ms in zip(columns["category"].tolist(), columns["correct"].tolist(),
+                                              columns["response_ms"].tolist()):
+        entry = totals.setdefault(categories[category], [0, 0, [], 0])
+        entry[0] += 1
+        entry[1] += correct
+        entry[2].append(response_ms)
+        entry[3] = entry[3] + 1 if correct else 0
+    return {name: (attempts, right / attempts, sorted(times)[len(times) // 2], streak)
+            for name, (attempts, right, times, streak) in totals.items()}
+
+def benchmark(row_counts=(1_000_000, 10_000_000), loop_rows=1_000_000):
+    """
+    Time review_stats over synthetic attempts, against a per-row loop.
+
+    Args:
+        row_counts (tuple, optional): Attempt counts to time review_stats at
+        loop_rows (int, optional): Attempt count to time the per-row loop at
+
+    Returns:
+        dict: Milliseconds per run, keyed by what was measured
+    """
+    results = {}
+    for rows in row_counts:
+        columns, categories, card_categories = _synthetic_columns(rows)
+        start = time.perf_counter()
+        review_stats(columns, categories, card_categories)
+        results[f"vectorized_{rows}"] = round((time.perf_counter() - start) * 1000, 1)
+        if rows == loop_rows:
+            start = time.perf_counter()
+            _loop_stats(columns, categories)
+            results[f"python_loop_{rows}"] = round((time.perf_counter() - start) * 1000, 1)
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.review_log [rows ...]
+    rows = tuple(int(arg) for arg in sys.argv[1:]) or (1_000_000, 10_000_000)
+    print(json.dumps(benchmark(rows), indent=2))
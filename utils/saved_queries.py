@@ -0,0 +1,58 @@
+import json
+import threading
+
+from .config import DATA_DIR
+
+SAVED_QUERIES_PATH = DATA_DIR / "saved_queries.json"
+
+_lock = threading.Lock()
+
+def _load():
+    if not SAVED_QUERIES_PATH.exists():
+        return {}
+    with open(SAVED_QUERIES_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write(queries):
+    # Write to a temp file and rename so readers never see a partial file
+    SAVED_QUERIES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = SAVED_QUERIES_PATH.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(queries, f, indent=2)
+    tmp_path.replace(SAVED_QUERIES_PATH)
+
+def list_saved_queries():
+    """
+    Get all saved study-set queries.
+
+    Returns:
+        dict: {name: query}
+    """
+    with _lock:
+        return _load()
+
+def get_saved_query(name):
+    """Get the query saved under a name, or None."""
+    return list_saved_queries().get(name)
+
+def save_query(name, query):
+    """
+    Save a search query as a named study set, replacing any query with the same name.
+
+    Args:
+        name (str): Display name for the study set
+        query (str): The search query
+    """
+    with _lock:
+        queries = _load()
+        queries[name] = query
+        _write(queries)
+
+def delete_saved_query(name):
+    """Delete a saved query. Returns True if it existed."""
+    with _lock:
+        queries = _load()
+        if queries.pop(name, None) is None:
+            return False
+        _write(queries)
+        return True
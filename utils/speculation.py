@@ -0,0 +1,260 @@
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import threading
+import time
+
+import dotenv
+
+from .verdict_cache import normalize_answer
+
+dotenv.load_dotenv()
+
+# Evaluate answers on the partial transcript, before the final transcript arrives.
+# Set SPECULATIVE_EVALUATION=0 to wait for the final transcript.
+SPECULATIVE_EVALUATION = (os.getenv("SPECULATIVE_EVALUATION") or "1") != "0"
+# Milliseconds without a new delta after which the partial transcript counts as stable
+SPECULATE_STABLE_MS = int(os.getenv("SPECULATE_STABLE_MS") or "250")
+# Speculative evaluations started per answer at most, to bound the calls wasted on one answer
+MAX_SPECULATIONS = 2
+
+# Speculative calls run here so they never hold up the speech event loop
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculate")
+
+Speculation = collections.namedtuple("Speculation", "text transcript future")
+
+_totals_lock = threading.Lock()
+_totals = {
+    "answers": 0,
+    "speculated": 0,  # speculative calls started
+    "committed": 0,   # answers whose verdict came from a speculative call
+    "wasted": 0,      # speculative calls whose result was thrown away
+    "saved_seconds": 0.0,
+    "timed_answers": 0,
+    "end_to_verdict_seconds": 0.0,
+}
+
+class SpeculativeEvaluator:
+    """
+    Evaluates one answer on its partial transcript while the final transcript is pending.
+
+    on_partial() is fed the transcript as it grows. The evaluation is started early when
+    the partial transcript ends with the correct answer, or when no delta has arrived
+    for stable_seconds. verdict() takes the final transcript: if it normalizes (see
+    normalize_answer) to the speculated one, the speculative verdict is committed;
+    otherwise it is discarded and the final transcript is evaluated. A discarded call
+    can't be recalled from the API, so it counts as wasted.
+    """
+    def __init__(self, evaluate, correct_answer, stable_seconds=SPECULATE_STABLE_MS / 1000,
+                 max_speculations=MAX_SPECULATIONS):
+        """
+        Initialize the evaluator for one answer.
+
+        Args:
+            evaluate (callable): Takes a transcript and returns its verdict, without side
+                effects (e.g. cached_check_answer with the card's arguments bound)
+            correct_answer (str): The card's answer, to spot it in the partial transcript
+            stable_seconds (float, optional): Quiet time after which a partial transcript
+                is evaluated
+            max_speculations (int, optional): Speculative calls allowed for this answer
+        """
+        self._evaluate = evaluate
+        self._answer = normalize_answer(correct_answer)
+        self.stable_seconds = stable_seconds
+        self.max_speculations = max_speculations
+        self.speculated = 0
+        self._lock = threading.Lock()
+        self._latest = ""
+        self._timer = None
+        self._speculation = None
+        self._finished = False
+
+    def _ends_with_answer(self, text):
+        return bool(self._answer) and f" {text}".endswith(f" {self._answer}")
+
+    def on_partial(self, transcript):
+        """
+        Take the transcript so far. Returns at once; evaluations run on worker threads.
+
+        Args:
+            transcript (str): The partial transcript
+        """
+        text = normalize_answer(transcript)
+        with self._lock:
+            if self._finished or not text or text == self._latest:
+                return
+            self._latest = text
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._ends_with_answer(text):
+                self._start(text, transcript)
+            else:
+                self._timer = threading.Timer(self.stable_seconds, self._on_stable, (text, transcript))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _on_stable(self, text, transcript):
+        with self._lock:
+            if not self._finished and text == self._latest:
+                self._start(text, transcript)
+
+    def _start(self, text, transcript):
+        # Called with the lock held
+        if self._speculation is not None and self._speculation.text == text:
+            return
+        if self.speculated >= self.max_speculations:
+            return
+        self._discard()
+        self.speculated += 1
+        _count(speculated=1)
+        self._speculation = Speculation(text, transcript, _executor.submit(_timed, self._evaluate, transcript))
+
+    def _discard(self):
+        # Called with the lock held
+        if self._speculation is not None:
+            if not self._speculation.future.cancel():
+                _count(wasted=1)
+            self._speculation = None
+
+    def verdict(self, final_transcript, speech_end_time=None):
+        """
+        Get the verdict for the final transcript, from the speculation if it still applies.
+
+        Args:
+            final_transcript (str): The final transcript
+            speech_end_time (float, optional): time.time() at which the student stopped
+                speaking, to measure the time from the end of speech to the verdict
+
+        Returns:
+            dict: The verdict returned by evaluate
+        """
+        final_at = time.time()
+        text = normalize_answer(final_transcript)
+        with self._lock:
+            self._finished = True
+            if self._timer is not None:
+                self._timer.cancel()
+            speculation = self._speculation
+            if speculation is not None and speculation.text != text:
+                self._discard()
+                speculation = None
+        verdict, saved = None, 0.0
+        if speculation is not None:
+            try:
+                verdict, seconds = speculation.future.result()
+            except Exception as e:
+                # e.g. turned away by admission control; evaluate the final transcript instead
+                print(f"Speculative evaluation failed: {e}")
+                _count(wasted=1)
+                speculation = None
+            else:
+                # The call would have started now and taken as long
+                saved = max(0.0, final_at + seconds - time.time())
+                _count(committed=1, saved_seconds=saved)
+        if speculation is None:
+            verdict = self._evaluate(final_transcript)
+        _count(answers=1)
+        if speech_end_time is not None:
+            _count(timed_answers=1, end_to_verdict_seconds=time.time() - speech_end_time)
+        return verdict
+
+def _timed(evaluate, transcript):
+    start = time.perf_counter()
+    verdict = evaluate(transcript)
+    return verdict, time.perf_counter() - start
+
+def _count(**amounts):
+    with _totals_lock:
+        for name, amount in amounts.items():
+            _totals[name] += amount
+
+def summary():
+    """
+    Get the totals of speculative evaluation across the session.
+
+    Returns:
+        dict: Answers evaluated, speculative calls started, committed and wasted, the
+            wasted-call rate, the average time saved per answer and the average time
+            from the end of speech to the verdict
+    """
+    with _totals_lock:
+        totals = dict(_totals)
+    answers = totals["answers"]
+    timed = totals["timed_answers"]
+    return {
+        "answers": answers,
+        "speculated": totals["speculated"],
+        "committed": totals["committed"],
+        "wasted": totals["wasted"],
+        "wasted_rate": round(totals["wasted"] / totals["speculated"], 3) if totals["speculated"] else None,
+        "avg_saved_ms": round(totals["saved_seconds"] / answers * 1000, 1) if answers else None,
+        "avg_end_to_verdict_ms": round(totals["end_to_verdict_seconds"] / timed * 1000, 1) if timed else None,
+    }
+
+def simulate(answers=20, evaluate_seconds=0.6, done_after=0.15, seed=0):
+    """
+    Replay scripted transcription turns with and without speculation.
+
+    Each turn's deltas arrive over the first half second after the end of speech; the
+    final transcript follows done_after seconds after the last delta. Some students
+    trail off and add words after a pause, so their first speculation is wasted.
+
+    Args:
+        answers (int, optional): Turns to replay
+        evaluate_seconds (float, optional): Simulated latency of one evaluation call
+        done_after (float, optional): Seconds from the last delta to the final transcript
+        seed (int, optional): Seed for the scripted turns
+
+    Returns:
+        dict: Mean end-of-speech-to-verdict milliseconds with and without speculation,
+            and the speculative calls started and wasted
+    """
+    rng = random.Random(seed)
+    turns = []
+    for i in range(answers):
+        answer = f"answer {i}"
+        words = rng.choice([[answer], ["it's", answer], ["um", "it's", "probably", answer]])
+        if rng.random() < 0.25:
+            words = words + ["or", "maybe", "something", "else"]
+        gaps = [rng.uniform(0.05, 0.15) for _ in words]
+        if len(words) > 3 and rng.random() < 0.5:
+            gaps[-3] += 0.4  # A pause before trailing off
+        turns.append((answer, words, gaps))
+
+    def evaluate(transcript):
+        time.sleep(evaluate_seconds)
+        return {"is_correct": True}
+
+    results = {}
+    for mode in ("baseline", "speculative"):
+        durations = []
+        before = summary()
+        for answer, words, gaps in turns:
+            speech_end = time.time()
+            evaluator = SpeculativeEvaluator(evaluate, answer)
+            transcript = []
+            for word, gap in zip(words, gaps):
+                time.sleep(gap)
+                transcript.append(word)
+                if mode == "speculative":
+                    evaluator.on_partial(" ".join(transcript))
+            time.sleep(done_after)
+            evaluator.verdict(" ".join(transcript))
+            durations.append(time.time() - speech_end)
+        after = summary()
+        results[mode] = {
+            "mean_end_to_verdict_ms": round(sum(durations) / len(durations) * 1000, 1),
+            "speculated": after["speculated"] - before["speculated"],
+            "wasted": after["wasted"] - before["wasted"],
+        }
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.speculation
+    # With server VAD the final transcript also waits out the 0.5 s after speech_stopped
+    print(json.dumps({
+        "local_vad": simulate(done_after=0.15),
+        "server_vad": simulate(done_after=0.65),
+    }, indent=2))
@@ -1,149 +1,201 @@
 import asyncio
+import atexit
 import websockets
 import base64
+import collections
 import json
 import os
-import pyaudio
+import random
 import threading
-import queue
+import sys
+import time
+import uuid
+import numpy as np
+from .admission import Overloaded
+from .audio_buffer import AudioRingBuffer, batch_bytes
+from .model_router import TRANSCRIBE_MODEL, observe
+from .vad import Endpointer, read_wav
+
+try:
+    import pyaudio
+except ImportError:
+    # Only needed for the microphone; the server streams audio pushed by web clients
+    pyaudio = None
 
 # PyAudio constants
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000  # 16kHz for STT
-CHUNK_SIZE = 1024 * 2  # 2048 samples per chunk
+CHUNK_SIZE = 320  # 20 ms of audio per capture callback
 
 # OpenAI API details
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 REALTIME_TRANSCRIPTION_URL = "wss://api.openai.com/v1/realtime?intent=transcription"
 
-# Thread-safe queue for audio chunks
-audio_queue = queue.Queue()
-# Event to signal the recording thread to stop
-stop_recording_event = threading.Event()
-# Event to signal that speech has stopped (from VAD)
-speech_stopped_event = asyncio.Event()
+# Detect the end of speech locally and commit the audio right away, instead of waiting
+# for the server's VAD. Set LOCAL_VAD=0 to go back to server VAD.
+USE_LOCAL_VAD = os.getenv("LOCAL_VAD", "1") != "0"
+# Longest time to wait for the transcript after committing the audio
+TRANSCRIPT_TIMEOUT = 10.0
+# Audio sent per input_audio_buffer.append message
+SEND_BATCH_MS = int(os.getenv("SEND_BATCH_MS", "100"))
+# Size of the capture ring buffer; older audio is dropped if sending stalls this long
+RING_BUFFER_SECONDS = 2
+# Web client audio streams transcribed at once; more are turned away with Overloaded
+MAX_SPEECH_STREAMS = int(os.getenv("MAX_SPEECH_STREAMS") or "200")
+# Seconds after which a stream that got no audio is closed
+SPEECH_STREAM_IDLE_SECONDS = 30.0
+# Seconds between checks for idle streams
+SPEECH_STREAM_IDLE_CHECK_SECONDS = 5.0
 
+class _MicCapture:
+    """Callback-mode microphone stream that copies audio into the current ring buffer."""
+    def __init__(self):
+        if pyaudio is None:
+            raise RuntimeError("PyAudio is not installed; the microphone is unavailable")
+        self.ring = None
+        self._pyaudio = pyaudio.PyAudio()
+        self.stream = self._pyaudio.open(format=pyaudio.paInt16,
+                                         channels=CHANNELS,
+                                         rate=RATE,
+                                         input=True,
+                                         frames_per_buffer=CHUNK_SIZE,
+                                         start=False,
+                                         stream_callback=self._callback)
 
-def _record_audio():
-    """Captures audio from the microphone and puts it into a queue."""
-    global audio_queue, stop_recording_event
-    audio_queue = queue.Queue() # Clear queue for new session
-    stop_recording_event.clear()
-    
-    p = pyaudio.PyAudio()
-    stream = None
-    try:
-        stream = p.open(format=FORMAT,
-                        channels=CHANNELS,
-                        rate=RATE,
-                        input=True,
-                        frames_per_buffer=CHUNK_SIZE)
-        # print("Audio recording started. Speak now.")
-        while not stop_recording_event.is_set():
-            try:
-                data = stream.read(CHUNK_SIZE, exception_on_overflow=False)
-                audio_queue.put(data)
-            except IOError as e:
-                if e.errno == pyaudio.paInputOverflowed:
-                    print("Input overflowed. Skipping frame.")
-                    continue
-                else:
-                    raise
-            if speech_stopped_event.is_set(): # Early exit if VAD detected stop
-                break
-    except Exception as e:
-        print(f"Error during audio recording: {e}")
-    finally:
-        if stream:
-            stream.stop_stream()
-            stream.close()
-        p.terminate()
-        audio_queue.put(None) # Signal end of audio stream
-        # print("Audio recording stopped.")
-
-async def _send_audio_chunks(websocket):
-    """Sends audio chunks from the queue to the WebSocket."""
-    while True:
-        try:
-            chunk = await asyncio.to_thread(audio_queue.get, timeout=0.1)
-        except queue.Empty:
-            if stop_recording_event.is_set() or speech_stopped_event.is_set():
-                break
-            continue
-            
-        if chunk is None: # End of stream signal
-            break
-        
-        payload = {
-            "type": "input_audio_buffer.append",
-            "audio": base64.b64encode(chunk).decode('utf-8')
-        }
-        try:
-            await websocket.send(json.dumps(payload))
-        except websockets.exceptions.ConnectionClosed:
-            print("WebSocket connection closed while sending audio.")
-            break
-    # print("Finished sending audio chunks.")
-
-async def _receive_transcriptions(websocket, transcript_parts):
-    """Receives and processes messages from the WebSocket."""
-    global speech_stopped_event
-    speech_stopped_event.clear() # Reset for current session
-    try:
-        async for message_str in websocket:
-            message = json.loads(message_str)
-            # print(f"Received message: {message}") # For debugging
-
-            if message.get("type") == "input_audio_buffer.speech_started":
-                print("Speech started...")
-            elif message.get("type") == "input_audio_buffer.speech_stopped":
-                print("Speech stopped by VAD.")
-                speech_stopped_event.set()
-                # The API might send final transcriptions after speech_stopped
-                # Wait a brief moment for any final transcriptions
-                await asyncio.sleep(0.5) 
-                break 
-            elif message.get("type") == "transcription.text.delta":
-                transcript_parts.append(message.get("text", ""))
-            elif message.get("type") == "transcription.text.done":
-                # This might contain the full transcript sometimes
-                # but we are accumulating deltas
-                pass # Already handled by delta
-            elif message.get("type") == "error":
-                print(f"Error from OpenAI: {message.get('message')}")
-                speech_stopped_event.set() # Stop processing on error
+    def _callback(self, in_data, frame_count, time_info, status):
+        # Runs on the PortAudio thread: just copy into the preallocated ring
+        ring = self.ring
+        if ring is not None:
+            ring.write(in_data)
+        return (None, pyaudio.paContinue)
+
+    def start(self, ring):
+        self.ring = ring
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream.is_active():
+            self.stream.stop_stream()
+        self.ring = None
+
+    def close(self):
+        self.stop()
+        self.stream.close()
+        self._pyaudio.terminate()
+
+class _WavCapture:
+    """Feeds a WAV file into the ring buffer at real-time pace, then some silence."""
+    def __init__(self, wav_path, trailing_silence=3.0):
+        pcm, rate = read_wav(wav_path)
+        if rate != RATE:
+            raise ValueError(f"{wav_path} must be {RATE} Hz 16-bit mono PCM")
+        self.pcm = pcm + bytes(int(trailing_silence * RATE) * 2)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _feed(self, ring):
+        step = CHUNK_SIZE * 2
+        next_time = time.perf_counter()
+        for start in range(0, len(self.pcm), step):
+            next_time += CHUNK_SIZE / RATE
+            if self._stop_event.wait(max(0.0, next_time - time.perf_counter())):
                 break
-    except websockets.exceptions.ConnectionClosedOK:
-        print("WebSocket connection closed normally.")
-    except websockets.exceptions.ConnectionClosedError as e:
-        print(f"WebSocket connection closed with error: {e}")
-    finally:
-        speech_stopped_event.set() # Ensure loops dependent on this can exit
-        # print("Finished receiving transcriptions.")
+            ring.write(self.pcm[start:start + step])
+        ring.close()
 
+    def start(self, ring):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._feed, args=(ring,), daemon=True)
+        self._thread.start()
 
-async def _record_and_transcribe_session(prompt_message: str) -> str:
-    """Manages a single speech-to-text session."""
-    global stop_recording_event, speech_stopped_event
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
 
-    print(prompt_message)
-    input("Press Enter to start speaking, then speak. Recording will stop automatically when you pause...")
+    def close(self):
+        self.stop()
 
-    transcript_parts = []
-    
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
+class PushedAudio:
+    """
+    Audio source fed by the caller, e.g. with PCM frames streamed in by a web client.
+
+    push() and end() may be called from any thread. Frames pushed before the turn starts
+    are kept and written to the ring buffer when it does, up to the ring's capacity: like
+    the ring, the oldest audio is dropped beyond that. Once the turn is over (finished or
+    failed) pushed audio is discarded.
+    """
+    def __init__(self, max_pending_bytes=RATE * 2 * RING_BUFFER_SECONDS):
+        self._lock = threading.Lock()
+        self._ring = None
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self.max_pending_bytes = max_pending_bytes
+        self._ended = False
+        self._stopped = False
+        self.pushed_bytes = 0
+        self.dropped_bytes = 0
+        self.last_push = time.monotonic()
+
+    def push(self, frame):
+        """
+        Add audio.
+
+        Args:
+            frame (bytes-like): 16 kHz 16-bit mono PCM
+        """
+        with self._lock:
+            self.pushed_bytes += len(frame)
+            self.last_push = time.monotonic()
+            if self._ring is not None:
+                self._ring.write(frame)
+            elif self._stopped:
+                self.dropped_bytes += len(frame)
+            else:
+                self._pending.append(bytes(frame))
+                self._pending_bytes += len(frame)
+                while self._pending_bytes > self.max_pending_bytes:
+                    dropped = len(self._pending.popleft())
+                    self._pending_bytes -= dropped
+                    self.dropped_bytes += dropped
+
+    def end(self):
+        """Mark the end of the audio, e.g. the client stopped recording."""
+        with self._lock:
+            self._ended = True
+            if self._ring is not None:
+                self._ring.close()
 
-    session_config = {
+    def start(self, ring):
+        with self._lock:
+            self._ring = ring
+            for frame in self._pending:
+                ring.write(frame)
+            self._pending.clear()
+            self._pending_bytes = 0
+            if self._ended:
+                ring.close()
+
+    def stop(self):
+        with self._lock:
+            self._ring = None
+            self._stopped = True
+            self._pending.clear()
+            self._pending_bytes = 0
+
+    def close(self):
+        self.stop()
+
+def _session_config(use_local_vad):
+    """Build the transcription session configuration."""
+    return {
         "type": "transcription_session.update",
         "input_audio_format": "pcm16",
         "input_audio_transcription": {
-            "model": "gpt-4o-mini-transcribe", # Using mini for potentially faster response
+            "model": TRANSCRIBE_MODEL, # A mini model by default, for faster responses
             # "language": "en" # Optional: specify language
         },
-        "turn_detection": {
+        "turn_detection": None if use_local_vad else {
             "type": "server_vad",
             "threshold": 0.5,
             "prefix_padding_ms": 200,
@@ -151,95 +203,751 @@ async def _record_and_transcribe_session(prompt_message: str) -> str:
         }
     }
 
-    try:
-        async with websockets.connect(REALTIME_TRANSCRIPTION_URL, extra_headers=headers) as websocket:
-            # print("WebSocket connection established.")
-            await websocket.send(json.dumps(session_config))
-            # print("Session configuration sent.")
+def _print_connection_error(e):
+    print(f"WebSocket connection failed: {e.status_code} {e.headers.get('www-authenticate', '')}")
+    if e.status_code == 401:
+        print("Authentication error. Check your OPENAI_API_KEY.")
+
+class SpeechSession:
+    """
+    One realtime transcription session, with its own WebSocket, incoming message queue,
+    capture ring buffer, speech-stopped event and timings.
+
+    Nothing is shared between sessions, and every method runs on the event loop of the
+    caller, so one loop can drive hundreds of sessions at once. Each turn streams one
+    utterance from an audio source (the microphone, a WAV file or PushedAudio) and
+    collects its transcript. The connection is opened on the first turn and reopened if
+    the server closes it.
+    """
+    def __init__(self, use_local_vad=USE_LOCAL_VAD, url=None):
+        """
+        Initialize the session. Nothing is connected until the first turn.
+
+        Args:
+            use_local_vad (bool, optional): Detect the end of speech locally instead of on the server
+            url (str, optional): The realtime endpoint. Defaults to REALTIME_TRANSCRIPTION_URL.
+        """
+        self.use_local_vad = use_local_vad
+        self.url = url or REALTIME_TRANSCRIPTION_URL
+        self.ring = AudioRingBuffer(RATE * 2 * RING_BUFFER_SECONDS)
+        self.connects = 0
+        # Wall-clock time at which the last captured speech ended, for latency measurements
+        self.speech_end_time = None
+        # Seconds from the end of speech to the finished transcript in the last turn
+        self.last_transcript_latency = None
+        # Seconds from the start of the last turn until audio capture began (connection,
+        # session config and audio stream setup)
+        self.last_turn_setup = None
+        self._websocket = None
+        self._messages = None  # asyncio.Queue of incoming messages, filled by _read_messages
+        self._reader_task = None
+        self._speech_stopped = None  # Set when the turn's speech stopped; made per turn on the running loop
 
-            # Start recording in a separate thread
-            recording_thread = threading.Thread(target=_record_audio)
-            recording_thread.start()
-            # print("Recording thread started.")
+    async def _read_messages(self, websocket, messages):
+        """Move incoming messages into the queue; None marks a closed connection."""
+        try:
+            async for message_str in websocket:
+                await messages.put(message_str)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            await messages.put(None)
+
+    async def _iter_messages(self):
+        """Yield queued messages until the connection closes."""
+        while True:
+            message_str = await self._messages.get()
+            if message_str is None:
+                self._websocket = None
+                return
+            yield message_str
+
+    async def connect(self):
+        """Connect and configure the session unless a connection is already open."""
+        if self._websocket is not None and not self._websocket.closed:
+            return
+        headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+        self._websocket = await websockets.connect(self.url, extra_headers=headers)
+        await self._websocket.send(json.dumps(_session_config(self.use_local_vad)))
+        self._messages = asyncio.Queue()
+        self._reader_task = asyncio.create_task(self._read_messages(self._websocket, self._messages))
+        self.connects += 1
+
+    async def _send_audio(self, endpointer, batch_ms=SEND_BATCH_MS, playback=None):
+        """
+        Drains the capture ring buffer in batches and sends them to the WebSocket.
+
+        Runs entirely on the event loop: the ring wakes it once a batch is ready, and each
+        batch is copied into one reusable buffer and sent as a single append message. Every
+        batch also goes through the local endpointer to timestamp the end of speech.
+
+        With local VAD only the utterance, trimmed of leading and trailing silence, is sent,
+        and the input audio buffer is committed as soon as the speech ends, so transcription
+        starts without waiting for the server to detect the silence.
+
+        When a Playback is given (barge-in), speech detection is gated against echo while it
+        plays, and the playback is stopped as soon as the user starts speaking.
+        """
+        websocket, ring = self._websocket, self.ring
+        size = batch_bytes(RATE, batch_ms)
+        batch = memoryview(bytearray(size))
+        echo_gated = False
+        while True:
+            await ring.wait(size)
+            n = ring.readinto(batch)
+            if n:
+                data = batch[:n]
+                if playback is not None and playback.is_playing() != echo_gated:
+                    echo_gated = not echo_gated
+                    endpointer.set_echo_gate(echo_gated)
+                speech_frames = endpointer.speech_frames
+                audio, ended = endpointer.push(data)
+                if endpointer.speech_frames > speech_frames and not endpointer.ended:
+                    self.speech_end_time = time.time()
+                if echo_gated and endpointer.started:
+                    # The user is answering over the audio; cut it off
+                    playback.stop()
+                if not self.use_local_vad:
+                    audio, ended = data, False
+            elif ring.closed: # Recording stopped and everything has been sent
+                audio, ended = (endpointer.flush() if self.use_local_vad else b""), True
+            else:
+                continue
+
+            try:
+                if audio:
+                    await websocket.send(json.dumps({
+                        "type": "input_audio_buffer.append",
+                        "audio": base64.b64encode(audio).decode('utf-8')
+                    }))
+                if ended:
+                    if self.use_local_vad:
+                        await websocket.send(json.dumps({"type": "input_audio_buffer.commit"}))
+                    break
+            except websockets.exceptions.ConnectionClosed:
+                print("WebSocket connection closed while sending audio.")
+                break
+        if ring.dropped_bytes:
+            print(f"Audio sending fell behind; dropped {ring.dropped_bytes / 2 / RATE:.2f}s of audio.")
+        # print("Finished sending audio chunks.")
+
+    async def _receive_transcriptions(self, transcript_parts, on_partial=None):
+        """
+        Receives and processes the session's incoming messages.
+
+        With local VAD the turn ends when the committed audio's transcript is complete
+        rather than when the server detects the end of speech.
+
+        on_partial, if given, is called on the event loop with the transcript so far after
+        every delta, so it must return quickly (e.g. SpeculativeEvaluator.on_partial).
+        """
+        wait_for_transcript = self.use_local_vad
+        try:
+            async for message_str in self._iter_messages():
+                message = json.loads(message_str)
+                # print(f"Received message: {message}") # For debugging
+
+                if wait_for_transcript and message.get("type") in (
+                    "transcription.text.done", "conversation.item.input_audio_transcription.completed"
+                ):
+                    if not transcript_parts and message.get("transcript"):
+                        transcript_parts.append(message["transcript"])
+                    break
+                elif message.get("type") == "conversation.item.input_audio_transcription.delta":
+                    transcript_parts.append(message.get("delta", ""))
+                    if on_partial is not None:
+                        on_partial("".join(transcript_parts))
+                elif message.get("type") == "input_audio_buffer.speech_started":
+                    print("Speech started...")
+                elif message.get("type") == "input_audio_buffer.speech_stopped":
+                    print("Speech stopped by VAD.")
+                    self._speech_stopped.set()
+                    # The API might send final transcriptions after speech_stopped
+                    # Wait a brief moment for any final transcriptions
+                    await asyncio.sleep(0.5)
+                    break
+                elif message.get("type") == "transcription.text.delta":
+                    transcript_parts.append(message.get("text", ""))
+                    if on_partial is not None:
+                        on_partial("".join(transcript_parts))
+                elif message.get("type") == "transcription.text.done":
+                    # This might contain the full transcript sometimes
+                    # but we are accumulating deltas
+                    pass # Already handled by delta
+                elif message.get("type") == "error":
+                    print(f"Error from OpenAI: {message.get('message')}")
+                    break
+        finally:
+            self._speech_stopped.set() # Ensure the turn can finish
+            # print("Finished receiving transcriptions.")
+
+    async def turn(self, capture, playback=None, on_partial=None, end_on_silence=True):
+        """
+        Record one utterance, stream it over the session and collect its transcript.
+
+        With local VAD, listening overlaps the given playback and speech cuts it off
+        (barge-in). With server VAD the playback is left to finish before listening starts.
+
+        Args:
+            capture: The audio source (_MicCapture, _WavCapture or PushedAudio)
+            playback (Playback, optional): Audio playing while the turn starts, e.g. the question
+            on_partial (callable, optional): Called with the transcript so far as it grows
+            end_on_silence (bool, optional): End the turn at the first pause. False keeps the
+                turn going, pauses included, until the capture's audio ends; this needs local VAD,
+                since server VAD ends the turn on the server.
 
+        Returns:
+            str: The transcript
+        """
+        started_at = time.perf_counter()
+        self.last_turn_setup = None
+        self.last_transcript_latency = None
+        self.speech_end_time = None
+        self._speech_stopped = asyncio.Event()
+        await self.connect()
+        # Drop events left over from the previous turn and start from an empty buffer
+        while not self._messages.empty():
+            if self._messages.get_nowait() is None:
+                self._websocket = None
+                await self.connect()
+        await self._websocket.send(json.dumps({"type": "input_audio_buffer.clear"}))
+
+        transcript_parts = []
+        tasks = []
+        if playback is not None and not self.use_local_vad:
+            await asyncio.to_thread(playback.wait)
+            playback = None
+        self.ring.reset()
+        capture.start(self.ring)
+        self.last_turn_setup = time.perf_counter() - started_at
+        try:
             # Start tasks for sending audio and receiving transcriptions
-            send_task = asyncio.create_task(_send_audio_chunks(websocket))
-            receive_task = asyncio.create_task(_receive_transcriptions(websocket, transcript_parts))
+            endpointer = Endpointer(RATE) if end_on_silence else Endpointer(RATE, end_silence_ms=None)
+            send_task = asyncio.create_task(self._send_audio(endpointer, playback=playback))
+            receive_task = asyncio.create_task(self._receive_transcriptions(transcript_parts, on_partial))
+            tasks = [send_task, receive_task]
 
             # Wait for speech to stop or an error
-            await speech_stopped_event.wait()
+            if self.use_local_vad:
+                # Sending stops by itself at the end of speech, after committing the audio
+                await send_task
+                await asyncio.to_thread(capture.stop)
+                try:
+                    await asyncio.wait_for(self._speech_stopped.wait(), TRANSCRIPT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print("Timed out waiting for the transcript.")
+            else:
+                await self._speech_stopped.wait()
             # print("Speech stopped event triggered.")
-            
-            # Signal recording and sending to stop
-            stop_recording_event.set()
 
-            # Ensure tasks complete
-            await asyncio.gather(send_task, receive_task, return_exceptions=True)
+            # Stop capturing and let the sender drain what is left
+            self.ring.close()
+            await asyncio.gather(*tasks, return_exceptions=True)
             # print("Send and receive tasks completed.")
-            
-            recording_thread.join(timeout=2) # Wait for recording thread to finish
-            # print("Recording thread joined.")
+        finally:
+            self.ring.close()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.to_thread(capture.stop)
+
+        final_transcript = "".join(transcript_parts).strip()
+        if self.speech_end_time is not None:
+            self.last_transcript_latency = time.time() - self.speech_end_time
+            # Time from the end of speech to the final transcript
+            observe("transcribe_realtime", TRANSCRIBE_MODEL, self.last_transcript_latency)
+        return final_transcript
+
+    async def close(self):
+        """Close the connection. The session reconnects if it is used again."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._websocket is not None:
+            await self._websocket.close()
+            self._websocket = None
+
+async def _record_and_transcribe_session(prompt_message: str, use_local_vad: bool = USE_LOCAL_VAD,
+                                        wav_path: str = None):
+    """
+    Manages a single, self-contained speech-to-text session: its own connection,
+    session config and audio stream, all torn down afterwards.
+
+    Args:
+        prompt_message (str): Prompt shown to the user
+        use_local_vad (bool, optional): Detect the end of speech locally instead of on the server
+        wav_path (str, optional): Stream this 16 kHz mono WAV file instead of the microphone,
+            e.g. to measure latency on a recorded fixture
+
+    Returns:
+        tuple: (transcript, or '' if the session failed; the closed SpeechSession, with its timings)
+    """
+    print(prompt_message)
+    if not wav_path:
+        input("Press Enter to start speaking, then speak. Recording will stop automatically when you pause...")
 
+    session = SpeechSession(use_local_vad)
+    capture = None
+    try:
+        capture = _WavCapture(wav_path) if wav_path else _MicCapture()
+        final_transcript = await session.turn(capture)
     except websockets.exceptions.InvalidStatusCode as e:
-        print(f"WebSocket connection failed: {e.status_code} {e.headers.get('www-authenticate', '')}")
-        if e.status_code == 401:
-            print("Authentication error. Check your OPENAI_API_KEY.")
-        return ""
+        _print_connection_error(e)
+        return "", session
     except Exception as e:
         print(f"An error occurred during the speech-to-text session: {e}")
-        return ""
+        return "", session
     finally:
-        stop_recording_event.set() # Ensure it's set in all exit paths
-        if 'recording_thread' in locals() and recording_thread.is_alive():
-            recording_thread.join(timeout=1)
-
+        await session.close()
+        if capture is not None:
+            capture.close()
 
-    final_transcript = "".join(transcript_parts).strip()
     print(f"Transcription: {final_transcript}")
-    return final_transcript
+    return final_transcript, session
+
+class RealtimeTranscriber:
+    """
+    Long-lived speech-to-text for the CLI.
+
+    One event loop (on a background thread), one SpeechSession and one microphone
+    stream are kept open for the whole run. Each prompt is a turn on that session: the
+    input buffer is cleared, the utterance streamed, and the transcript collected.
+    """
+    def __init__(self, use_local_vad=USE_LOCAL_VAD):
+        """
+        Initialize the transcriber. Nothing is connected until the first turn.
+
+        Args:
+            use_local_vad (bool, optional): Detect the end of speech locally instead of on the server
+        """
+        self.session = SpeechSession(use_local_vad)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="speech-loop", daemon=True)
+        self._thread.start()
+        self._mic = None
+
+    def _microphone(self):
+        """Open the microphone stream on first use and keep it for later turns."""
+        if self._mic is None:
+            self._mic = _MicCapture()
+        return self._mic
 
-def get_speech_input(prompt_message: str) -> str:
+    def transcribe(self, prompt_message, wav_path=None, playback=None, on_partial=None):
+        """
+        Run one turn and return its transcript.
+
+        Args:
+            prompt_message (str): Prompt shown to the user
+            wav_path (str, optional): Stream this WAV file instead of the microphone
+            playback (Playback, optional): Audio that is playing now. Listening starts right
+                away, without waiting for Enter, and speaking cuts the audio off.
+            on_partial (callable, optional): Called on the speech thread with the transcript
+                so far as it grows
+
+        Returns:
+            str: The transcript, or '' if the turn failed
+        """
+        print(prompt_message)
+        if playback is not None:
+            print("Answer whenever you're ready; speaking will stop the audio.")
+        elif not wav_path:
+            input("Press Enter to start speaking, then speak. Recording will stop automatically when you pause...")
+        try:
+            capture = _WavCapture(wav_path) if wav_path else self._microphone()
+            future = asyncio.run_coroutine_threadsafe(self.session.turn(capture, playback, on_partial), self._loop)
+            final_transcript = future.result()
+        except websockets.exceptions.InvalidStatusCode as e:
+            _print_connection_error(e)
+            return ""
+        except Exception as e:
+            print(f"An error occurred during the speech-to-text session: {e}")
+            # Start over with a fresh connection on the next turn
+            asyncio.run_coroutine_threadsafe(self.session.close(), self._loop).result()
+            return ""
+        print(f"Transcription: {final_transcript}")
+        return final_transcript
+
+    def close(self):
+        """Close the connection, the microphone stream and the event loop."""
+        if self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.session.close(), self._loop).result()
+        if self._mic is not None:
+            self._mic.close()
+            self._mic = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+        self._loop.close()
+
+class StreamingTranscriber:
+    """
+    Server-side transcription of audio streamed in by web clients.
+
+    One event loop on a background thread drives every open stream. A stream is a
+    SpeechSession whose turn starts as soon as the stream is opened, fed by a PushedAudio
+    source, so audio is sent on while the client is still speaking and the transcript is
+    usually ready soon after it stops.
+
+    A stream's answer runs until the client finishes it, pauses included: the local
+    endpointer only trims silence, and the audio is committed when the stream ends, so
+    server-side turn detection is never used. Streams that get no audio for
+    SPEECH_STREAM_IDLE_SECONDS are closed by a timer on the event loop.
+    """
+    def __init__(self, max_streams=MAX_SPEECH_STREAMS, url=None):
+        """
+        Initialize the transcriber and start its event loop.
+
+        Args:
+            max_streams (int, optional): Streams open at once
+            url (str, optional): The realtime endpoint. Defaults to REALTIME_TRANSCRIPTION_URL.
+        """
+        self.max_streams = max_streams
+        self.url = url
+        self._lock = threading.Lock()
+        self._streams = {}  # {stream_id: (SpeechSession, PushedAudio, concurrent Future of the transcript)}
+        self.counts = {"opened": 0, "finished": 0, "failed": 0, "expired": 0, "rejected": 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="speech-streams", daemon=True)
+        self._thread.start()
+        self._loop.call_soon_threadsafe(self._expire_idle_periodically)
+
+    async def _run(self, session, audio):
+        try:
+            return await session.turn(audio, end_on_silence=False)
+        finally:
+            # Also when the turn failed before it started; later pushes are discarded
+            audio.stop()
+            await session.close()
+
+    def _expire_idle_periodically(self):
+        self._expire_idle()
+        self._loop.call_later(SPEECH_STREAM_IDLE_CHECK_SECONDS, self._expire_idle_periodically)
+
+    def open(self):
+        """
+        Open a stream and start transcribing it.
+
+        Returns:
+            str: The stream's id, for push() and finish()
+
+        Raises:
+            Overloaded: max_streams streams are already open
+        """
+        with self._lock:
+            if len(self._streams) >= self.max_streams:
+                self.counts["rejected"] += 1
+                raise Overloaded(f"{len(self._streams)} speech streams already open")
+            stream_id = uuid.uuid4().hex
+            session = SpeechSession(use_local_vad=True, url=self.url)
+            audio = PushedAudio()
+            future = asyncio.run_coroutine_threadsafe(self._run(session, audio), self._loop)
+            self._streams[stream_id] = (session, audio, future)
+            self.counts["opened"] += 1
+        return stream_id
+
+    def push(self, stream_id, frame):
+        """
+        Add audio to a stream.
+
+        Args:
+            stream_id (str): The id from open()
+            frame (bytes): 16 kHz 16-bit mono PCM
+
+        Returns:
+            bool: False if there is no such stream
+        """
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None:
+            return False
+        stream[1].push(frame)
+        return True
+
+    def finish(self, stream_id, timeout=TRANSCRIPT_TIMEOUT):
+        """
+        End a stream's audio and wait for its transcript.
+
+        Args:
+            stream_id (str): The id from open()
+            timeout (float, optional): Seconds to wait for the transcript
+
+        Returns:
+            str: The transcript ('' if transcription failed), or None if there is no such stream
+        """
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        _, audio, future = stream
+        audio.end()
+        try:
+            transcript = future.result(timeout)
+        except websockets.exceptions.InvalidStatusCode as e:
+            _print_connection_error(e)
+            transcript = None
+        except Exception as e:
+            print(f"An error occurred during the speech-to-text stream: {e}")
+            future.cancel()
+            transcript = None
+        with self._lock:
+            self.counts["finished" if transcript is not None else "failed"] += 1
+        return transcript or ""
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [stream_id for stream_id, (_, audio, _) in self._streams.items()
+                    if now - audio.last_push > SPEECH_STREAM_IDLE_SECONDS]
+            expired = [self._streams.pop(stream_id) for stream_id in idle]
+            self.counts["expired"] += len(expired)
+        for _, audio, future in expired:
+            audio.end()
+            future.cancel()
+
+    def stats(self):
+        """Get the number of open streams and the streams opened, finished, failed, expired and rejected."""
+        with self._lock:
+            return {"open": len(self._streams), "max_streams": self.max_streams, **self.counts}
+
+    async def _cancel_all(self):
+        # Cancel every stream and let them close their connections
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Cancel the open streams and stop the event loop."""
+        if self._loop.is_closed():
+            return
+        with self._lock:
+            self._streams.clear()
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result(timeout=5)
+        except Exception as e:
+            print(f"Error closing speech streams: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+        self._loop.close()
+
+_transcriber = None
+
+def get_transcriber():
+    """
+    Get the process-wide transcriber, creating it on first use.
+
+    Returns:
+        RealtimeTranscriber: The shared transcriber
+    """
+    global _transcriber
+    if _transcriber is None:
+        _transcriber = RealtimeTranscriber()
+        atexit.register(_transcriber.close)
+    return _transcriber
+
+def last_speech_end_time():
+    """Get the time.time() at which the last speech captured by the shared transcriber ended, or None."""
+    return _transcriber.session.speech_end_time if _transcriber is not None else None
+
+_streaming_transcriber = None
+_streaming_lock = threading.Lock()
+
+def get_streaming_transcriber():
+    """
+    Get the process-wide transcriber for audio streamed in by web clients, creating it on first use.
+
+    Returns:
+        StreamingTranscriber: The shared streaming transcriber
+    """
+    global _streaming_transcriber
+    if _streaming_transcriber is None:
+        with _streaming_lock:
+            if _streaming_transcriber is None:
+                _streaming_transcriber = StreamingTranscriber()
+                atexit.register(_streaming_transcriber.close)
+    return _streaming_transcriber
+
+def get_speech_input(prompt_message: str, playback=None, on_partial=None) -> str:
     """
     Gets user input via speech-to-text.
+    Each call is one turn on the shared, persistent transcription session.
+    If playback (a Playback from start_sound) is given, the user can answer while it is
+    still playing, and speaking stops it.
+    If on_partial is given, it is called with the partial transcript as it grows.
     Falls back to keyboard input if API key is missing or an error occurs.
     """
     if not OPENAI_API_KEY:
         print("Warning: OPENAI_API_KEY environment variable not set.")
         return input(prompt_message + " (Speech-to-text unavailable, fallback to keyboard): ")
     
-    # Clear events for the new session
-    stop_recording_event.clear()
-    speech_stopped_event.clear()
-
     try:
-        # asyncio.run can't be nested if an event loop is already running.
-        # Check if an event loop is running.
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError: # 'RuntimeError: There is no current event loop...'
-            loop = None
-
-        if loop and loop.is_running():
-            # This case is tricky for CLI apps. For simplicity, if a loop is running,
-            # we might fall back or raise an error.
-            # However, typical CLI usage won't have a persistent outer loop.
-            # If needed, this would require more complex asyncio management.
-            print("Detected running asyncio event loop. Speech input might behave unexpectedly or require main application to be async.")
-            # For now, we'll try to run it in a new thread if absolutely necessary, or just proceed.
-            # This part might need refinement based on how the main app uses asyncio, if at all.
-            # Let's assume for a simple CLI it's not an issue.
-            pass # Fall through to asyncio.run() which should work if no loop is current.
-            
-        transcript = asyncio.run(_record_and_transcribe_session(prompt_message))
-        return transcript
-    except RuntimeError as e:
-        if " asyncio.run() cannot be called from a running event loop" in str(e):
-             print("Error: Speech input cannot be called from a running asyncio event loop in this context.")
-             print("Please ensure the main application structure supports this or modify speech input.")
-             return input(prompt_message + " (Speech-to-text async error, fallback to keyboard): ")
-        else:
-            print(f"Speech input runtime error: {e}. Fallback to keyboard input.")
-            return input(prompt_message + " (Fallback to keyboard): ")
+        return get_transcriber().transcribe(prompt_message, playback=playback, on_partial=on_partial)
     except Exception as e:
         print(f"Speech input error: {e}. Fallback to keyboard input.")
-        return input(prompt_message + " (Fallback to keyboard): ") 
\ No newline at end of file
+        return input(prompt_message + " (Fallback to keyboard): ")
+
+def measure_latency(wav_paths):
+    """
+    Measure end-of-speech-to-transcript latency on recorded WAV fixtures.
+
+    Each file is streamed at real-time pace with local VAD and with server VAD.
+
+    Args:
+        wav_paths (list): Paths to 16 kHz 16-bit mono WAV files
+
+    Returns:
+        dict: {'local_vad': [seconds, ...], 'server_vad': [seconds, ...]} in file order,
+            None where no transcript was produced
+    """
+    results = {"local_vad": [], "server_vad": []}
+    for wav_path in wav_paths:
+        for mode, use_local_vad in (("local_vad", True), ("server_vad", False)):
+            transcript, session = asyncio.run(_record_and_transcribe_session(
+                f"[{mode}] {wav_path}", use_local_vad=use_local_vad, wav_path=wav_path
+            ))
+            latency = session.last_transcript_latency if transcript else None
+            results[mode].append(latency)
+            print(f"{mode}: {latency * 1000:.0f} ms" if latency is not None else f"{mode}: no transcript")
+    return results
+
+def measure_turn_setup(wav_path, turns=5):
+    """
+    Compare per-turn setup time of one-off sessions against the persistent transcriber.
+
+    Setup is the time from the start of a turn until audio capture begins.
+
+    Args:
+        wav_path (str): A 16 kHz 16-bit mono WAV file used as the audio for every turn
+        turns (int, optional): Number of turns in each mode
+
+    Returns:
+        dict: {'one_off': [seconds, ...], 'persistent': [seconds, ...]}
+    """
+    results = {"one_off": [], "persistent": []}
+    for _ in range(turns):
+        _, session = asyncio.run(_record_and_transcribe_session("[one_off]", wav_path=wav_path))
+        results["one_off"].append(session.last_turn_setup)
+    transcriber = RealtimeTranscriber()
+    try:
+        for _ in range(turns):
+            transcriber.transcribe("[persistent]", wav_path=wav_path)
+            results["persistent"].append(transcriber.session.last_turn_setup)
+    finally:
+        transcriber.close()
+    return results
+
+async def _fake_realtime(websocket, transcribe_seconds=0.1):
+    """
+    Stand-in for the realtime API in load_test: on each commit it replies, in deltas, with
+    the stream's name (from the ?stream= query) and the audio bytes it was sent.
+    """
+    name = websocket.path.rsplit("stream=", 1)[-1]
+    received = 0
+    async for message_str in websocket:
+        message = json.loads(message_str)
+        if message["type"] == "input_audio_buffer.append":
+            received += len(base64.b64decode(message["audio"]))
+        elif message["type"] == "input_audio_buffer.clear":
+            received = 0
+        elif message["type"] == "input_audio_buffer.commit":
+            await asyncio.sleep(transcribe_seconds)
+            transcript = f"stream {name} sent {received} bytes"
+            for word in transcript.split():
+                await websocket.send(json.dumps({"type": "conversation.item.input_audio_transcription.delta",
+                                                 "delta": word + " "}))
+            await websocket.send(json.dumps({"type": "conversation.item.input_audio_transcription.completed",
+                                             "transcript": transcript}))
+
+async def _load_test(streams, seconds, frame_ms):
+    server = await websockets.serve(_fake_realtime, "127.0.0.1", 0, max_queue=None)
+    port = server.sockets[0].getsockname()[1]
+    # An answer with a pause in the middle: two tones between short silences. The pause is
+    # longer than the endpointer's end of speech, so a stream cut off there sends only the first
+    t = np.arange(int(seconds / 2 * RATE)) / RATE
+    tone = np.sin(2 * np.pi * 220 * t) * 8000
+    silence, pause = np.zeros(int(0.3 * RATE)), np.zeros(int(0.8 * RATE))
+    pcm = (np.concatenate([silence, tone, pause, tone, silence])).astype('<i2').tobytes()
+    answer_bytes = (2 * len(tone) + len(pause)) * 2  # From the first tone's start to the second's end
+    step = batch_bytes(RATE, frame_ms)
+
+    async def stream(i):
+        # Start at random within the first second, then push frames at real-time pace
+        # as a web client would
+        await asyncio.sleep(random.random())
+        session = SpeechSession(use_local_vad=True, url=f"ws://127.0.0.1:{port}/?stream={i}")
+        audio = PushedAudio()
+        partials = []
+        turn = asyncio.create_task(session.turn(audio, on_partial=partials.append, end_on_silence=False))
+        for start in range(0, len(pcm), step):
+            audio.push(pcm[start:start + step])
+            await asyncio.sleep(frame_ms / 1000)
+        audio.end()
+        ended_at = time.perf_counter()
+        try:
+            transcript = await turn
+        finally:
+            await session.close()
+        sent = transcript.split()[3] if transcript.startswith(f"stream {i} sent ") else "0"
+        ok = int(sent) >= answer_bytes and all(transcript.startswith(partial.strip()) for partial in partials)
+        return ok, time.perf_counter() - ended_at
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(stream(i) for i in range(streams)), return_exceptions=True)
+    finally:
+        server.close()
+        await server.wait_closed()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(result[1] for result in results if not isinstance(result, BaseException) and result[0])
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        print(f"{len(errors)} streams failed, e.g.: {errors[0]!r}")
+    return {
+        "streams": streams,
+        "transcribed": len(latencies),
+        "seconds": round(elapsed, 2),
+        "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+    }
+
+def load_test(streams=200, seconds=2.0, frame_ms=100):
+    """
+    Drive many concurrent sessions on one event loop against a local fake realtime server.
+
+    Every stream is a SpeechSession fed by PushedAudio at real-time pace, as the server
+    would be by web clients, with a pause in the middle of each answer. A stream counts as
+    transcribed when its transcript, and every partial transcript before it, names that
+    stream and all of its answer up to the end of the second half, so audio or events
+    crossing between sessions, or an answer cut off at the pause, show up as failures.
+
+    Args:
+        streams (int, optional): Concurrent streams
+        seconds (float, optional): Speech per stream
+        frame_ms (int, optional): Audio per pushed frame
+
+    Returns:
+        dict: Streams started and transcribed, total seconds, and p50/p95 milliseconds from
+            the end of a stream's audio to its transcript
+    """
+    return asyncio.run(_load_test(streams, seconds, frame_ms))
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.speech_to_text fixtures/*.wav
+    #            or: python -m utils.speech_to_text --load-test 200
+    if sys.argv[1:2] == ["--load-test"]:
+        print(json.dumps(load_test(int(sys.argv[2]) if len(sys.argv) > 2 else 200), indent=2))
+        sys.exit(0)
+    if not OPENAI_API_KEY:
+        print("Set OPENAI_API_KEY to measure transcription latency.")
+        sys.exit(1)
+    setup = measure_turn_setup(sys.argv[1])
+    for mode, timings in setup.items():
+        measured = [t for t in timings if t is not None]
+        if measured:
+            print(f"{mode}: average setup {sum(measured) / len(measured) * 1000:.0f} ms per turn "
+                  f"(first {measured[0] * 1000:.0f} ms)")
+    results = measure_latency(sys.argv[1:])
+    for mode, latencies in results.items():
+        measured = sorted(latency for latency in latencies if latency is not None)
+        if measured:
+            print(f"{mode}: median {measured[len(measured) // 2] * 1000:.0f} ms over {len(measured)} files")
@@ -1,30 +1,48 @@
 from pathlib import Path
-from openai import OpenAI
+from openai import RateLimitError
+import hashlib
 import os
+import threading
 import dotenv
 import time
 
+from . import admission
+from . import model_router
+from .openai_client import get_client
+
 dotenv.load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+SPEECH_INSTRUCTIONS = "Speak quickly and efficiently as if trying to get through many questions in minimal time."
+
+def speech_filename(text, model, voice, speed, instructions=SPEECH_INSTRUCTIONS):
+    """
+    Name a speech clip after a hash of everything that determines its audio.
+
+    The same text spoken with the same settings always maps to the same file, so a clip is
+    only generated once and its URL can be cached by browsers forever.
+
+    Returns:
+        str: File name such as speech_3f2a9c0d1b7e4a56.mp3
+    """
+    key = "\x1f".join([model, voice, str(speed), instructions, text])
+    return f"speech_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.mp3"
 
-def text_to_speech(text, model="gpt-4o-mini-tts", voice="alloy", speed=3.0):
+def text_to_speech(text, model=model_router.TTS_MODEL, voice="alloy", speed=3.0):
     """
     Convert text to speech using OpenAI's TTS API and save to static/audio.
     
     Args:
         text (str): The text to convert to speech
-        model (str, optional): The TTS model to use. Default is "gpt-4o-mini-tts".
+        model (str, optional): The TTS model to use. Defaults to TTS_MODEL ("gpt-4o-mini-tts").
         voice (str, optional): The voice to use. Default is "alloy".
         speed (float, optional): The speed of the generated audio, from 0.25 to 4.0. Default is 1.0.
                                Note: Does not work with gpt-4o-mini-tts model.
         
     Returns:
-        str: Web-accessible path to the generated audio file (e.g., /static/audio/speech_timestamp.mp3)
+        str: Web-accessible path to the generated audio file (e.g., /static/audio/speech_<hash>.mp3)
     """
-    # Generate a unique filename using a timestamp
-    timestamp = int(time.time() * 1000)
-    filename = f"speech_{timestamp}.mp3"
+    # Content-addressed file name: repeated text reuses the clip that is already on disk
+    filename = speech_filename(text, model, voice, speed)
     
     # Define the output path within the static/audio directory
     static_audio_dir = Path(__file__).parent.parent / "static" / "audio"
@@ -33,14 +51,28 @@ def text_to_speech(text, model="gpt-4o-mini-tts", voice="alloy", speed=3.0):
     # Ensure the directory exists
     static_audio_dir.mkdir(parents=True, exist_ok=True)
     
-    with client.audio.speech.with_streaming_response.create(
-        model=model,
-        voice=voice,
-        input=text,
-        speed=speed,
-        instructions="Speak quickly and efficiently as if trying to get through many questions in minimal time."
-    ) as response:
-        response.stream_to_file(output_path)
+    if not output_path.exists():
+        # Write to a temporary name first so a half-written clip is never served
+        partial_path = output_path.with_name(f"{filename}.{os.getpid()}-{threading.get_ident()}.part")
+        try:
+            with admission.get_controller("tts").slot(len(text) // 4):
+                start = time.perf_counter()
+                try:
+                    with get_client().audio.speech.with_streaming_response.create(
+                        model=model,
+                        voice=voice,
+                        input=text,
+                        speed=speed,
+                        instructions=SPEECH_INSTRUCTIONS
+                    ) as response:
+                        response.stream_to_file(partial_path)
+                except RateLimitError as e:
+                    raise admission.Overloaded(f"TTS API rate limit reached: {e}", admission.rate_limit_retry_after(e))
+            os.replace(partial_path, output_path)
+        finally:
+            # Left behind only if the clip wasn't finished and moved into place
+            partial_path.unlink(missing_ok=True)
+        model_router.observe("tts", model, time.perf_counter() - start)
     
     # Return a web-accessible path
     return f"/static/audio/{filename}"
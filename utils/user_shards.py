@@ -0,0 +1,442 @@
+import atexit
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import dotenv
+
+from .config import DATA_DIR
+from .review_log import ReviewLog
+
+dotenv.load_dotenv()
+
+# Each user's shard is a directory under here, partitioned by a hash of the user id
+USERS_DIR = DATA_DIR / "users"
+# Shards kept open at once; the least recently used idle shard is closed beyond this
+MAX_OPEN_SHARDS = int(os.getenv("MAX_OPEN_SHARDS") or "256")
+# User of the command-line app, which has only one student
+LOCAL_USER = "local"
+# User ids are generated by the server, but cookies can be edited
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Review intervals double on every correct answer, up to this many days
+MAX_INTERVAL_DAYS = 365
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS card_state (
+    deck TEXT NOT NULL,
+    card_id INTEGER NOT NULL,
+    reps INTEGER NOT NULL,
+    lapses INTEGER NOT NULL,
+    interval_days REAL NOT NULL,
+    due REAL NOT NULL,
+    last_review REAL NOT NULL,
+    PRIMARY KEY (deck, card_id)
+);
+CREATE INDEX IF NOT EXISTS card_state_due ON card_state (due);
+"""
+
+def is_valid_user_id(user_id):
+    """Return True if a user id is safe to use."""
+    return isinstance(user_id, str) and USER_ID_PATTERN.match(user_id) is not None
+
+def shard_directory(user_id, users_dir=None):
+    """
+    Get the directory holding one user's shard.
+
+    Shards are spread over 256 partitions by the first byte of a hash of the user id,
+    so no directory grows to hundreds of thousands of entries.
+
+    Args:
+        user_id (str): The user
+        users_dir (str or Path, optional): Root of the shards. Defaults to USERS_DIR.
+
+    Returns:
+        Path: The shard's directory
+    """
+    digest = hashlib.sha256(user_id.encode('utf-8')).hexdigest()
+    return Path(users_dir or USERS_DIR) / digest[:2] / digest[:32]
+
+def next_interval(interval_days, is_correct):
+    """
+    Schedule a card again after an answer, Leitner style.
+
+    Args:
+        interval_days (float): The card's current interval; 0 for a new or lapsed card
+        is_correct (bool): The verdict
+
+    Returns:
+        float: The new interval in days; 0 means the card is due again right away
+    """
+    if not is_correct:
+        return 0.0
+    return min(MAX_INTERVAL_DAYS, max(1.0, interval_days * 2))
+
+class UserShard:
+    """
+    One user's state: a SQLite file with their profile and card scheduling state, and
+    their own review log, in a directory nobody else writes to.
+
+    Calls on a shard are serialized by its own lock, so students never wait on each
+    other's writes. The decks themselves are not part of the shard; every user reads
+    the shared deck registry.
+    """
+    def __init__(self, user_id, directory):
+        """
+        Open (or create) a user's shard.
+
+        Args:
+            user_id (str): The user
+            directory (str or Path): The shard's directory, see shard_directory
+        """
+        self.user_id = user_id
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.users = 0  # Requests currently using the shard, managed by ShardManager
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.directory / "state.sqlite", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("INSERT OR IGNORE INTO profile VALUES ('user_id', ?), ('created_at', ?)",
+                           (user_id, str(time.time())))
+        self._conn.commit()
+        self.review_log = ReviewLog(self.directory / "reviews")
+
+    def record_review(self, deck, card_id, category, is_correct, response_ms=None, now=None):
+        """
+        Record an answer: reschedule the card and append the attempt to the review log.
+
+        Args:
+            deck (str): Registry key of the card's deck
+            card_id (int): The card's id
+            category (str): The card's full deck name
+            is_correct (bool): The verdict from evaluate_answer
+            response_ms (float, optional): Time the student took to answer
+            now (float, optional): Unix time of the answer. Defaults to now.
+
+        Returns:
+            dict: The card's new scheduling state, see card_state
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reps, lapses, interval_days FROM card_state WHERE deck = ? AND card_id = ?",
+                (deck, card_id)
+            ).fetchone()
+            reps, lapses, interval = row or (0, 0, 0.0)
+            interval = next_interval(interval, is_correct)
+            state = {
+                "reps": reps + 1,
+                "lapses": lapses + (not is_correct and reps > 0),
+                "interval_days": interval,
+                "due": now + interval * 86400,
+                "last_review": now,
+            }
+            self._conn.execute(
+                "INSERT OR REPLACE INTO card_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (deck, card_id, state["reps"], state["lapses"], state["interval_days"], state["due"], now)
+            )
+            self._conn.commit()
+        self.review_log.record(deck, card_id, category, is_correct, response_ms, timestamp=now)
+        return state
+
+    def card_state(self, deck, card_id):
+        """
+        Get a card's scheduling state.
+
+        Returns:
+            dict: 'reps', 'lapses', 'interval_days', 'due' and 'last_review' (Unix times),
+                or None if the user hasn't answered the card yet
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reps, lapses, interval_days, due, last_review FROM card_state "
+                "WHERE deck = ? AND card_id = ?", (deck, card_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("reps", "lapses", "interval_days", "due", "last_review"), row))
+
+    def due_cards(self, now=None, limit=100):
+        """
+        Get the cards the user has seen that are due again, most overdue first.
+
+        Returns:
+            list: (deck, card_id) tuples
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT deck, card_id FROM card_state WHERE due <= ? ORDER BY due LIMIT ?", (now, limit)
+            )]
+
+    def set_profile(self, key, value):
+        """Store one profile setting, e.g. the user's display name."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO profile VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def summary(self, now=None):
+        """
+        Get the user's profile and scheduling totals.
+
+        Returns:
+            dict: 'profile' settings, and the numbers of cards 'seen' and 'due' now
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            profile = dict(self._conn.execute("SELECT key, value FROM profile"))
+            seen, due = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(due <= ?), 0) FROM card_state", (now,)
+            ).fetchone()
+        return {"profile": profile, "seen": seen, "due": due}
+
+    def close(self):
+        """Flush the review log and close the database."""
+        self.review_log.flush()
+        with self._lock:
+            self._conn.close()
+
+class ShardManager:
+    """
+    Opens user shards lazily and keeps at most max_open of them open.
+
+    Shards are kept in least-recently-used order. When too many are open the least
+    recently used one that no request is using is closed; a shard in use is never
+    closed, so a busy moment can briefly exceed max_open. Only opening and closing
+    shards takes the manager's lock; reads and writes use each shard's own lock.
+    """
+    def __init__(self, users_dir=None, max_open=MAX_OPEN_SHARDS):
+        """
+        Initialize the manager.
+
+        Args:
+            users_dir (str or Path, optional): Root of the shards. Defaults to USERS_DIR.
+            max_open (int, optional): Shards kept open at once
+        """
+        self.users_dir = Path(users_dir or USERS_DIR)
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._shards = collections.OrderedDict()  # {user_id: UserShard}, least recently used first
+        self.opened = 0
+        self.closed = 0
+
+    @contextlib.contextmanager
+    def open(self, user_id):
+        """
+        Use one user's shard for the duration of the block.
+
+        Args:
+            user_id (str): The user
+
+        Yields:
+            UserShard: The user's shard
+
+        Raises:
+            ValueError: If the user id isn't valid
+        """
+        if not is_valid_user_id(user_id):
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is None:
+                shard = self._shards[user_id] = UserShard(user_id, shard_directory(user_id, self.users_dir))
+                self.opened += 1
+            self._shards.move_to_end(user_id)
+            shard.users += 1
+            self._evict()
+        try:
+            yield shard
+        finally:
+            with self._lock:
+                shard.users -= 1
+                self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        excess = len(self._shards) - self.max_open
+        if excess <= 0:
+            return
+        for user_id in [user_id for user_id, shard in self._shards.items() if shard.users == 0][:excess]:
+            self._shards.pop(user_id).close()
+            self.closed += 1
+
+    def close_all(self):
+        """Close every open shard."""
+        with self._lock:
+            while self._shards:
+                self._shards.popitem(last=False)[1].close()
+                self.closed += 1
+
+    def stats(self):
+        """
+        Get the manager's counters.
+
+        Returns:
+            dict: Shards open now and in use, the limit, and shards opened and closed so far
+        """
+        with self._lock:
+            return {
+                "open": len(self._shards),
+                "in_use": sum(1 for shard in self._shards.values() if shard.users),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "closed": self.closed,
+            }
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_shards():
+    """
+    Get the process-wide shard manager; open shards are closed when the process exits.
+
+    Returns:
+        ShardManager: The shared manager
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ShardManager()
+                atexit.register(_manager.close_all)
+    return _manager
+
+class _SingleFileState:
+    """Every user's state in one SQLite file and one review log, for comparison."""
+    def __init__(self, directory):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(Path(directory) / "state.sqlite", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE card_state (user_id TEXT, deck TEXT, card_id INTEGER, reps INTEGER,
+                              lapses INTEGER, interval_days REAL, due REAL, last_review REAL,
+                              PRIMARY KEY (user_id, deck, card_id))""")
+        self.review_log = ReviewLog(Path(directory) / "reviews")
+
+    def record_review(self, user_id, deck, card_id, category, is_correct, response_ms):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reps, lapses, interval_days FROM card_state WHERE user_id = ? AND deck = ? AND card_id = ?",
+                (user_id, deck, card_id)
+            ).fetchone()
+            reps, lapses, interval = row or (0, 0, 0.0)
+            interval = next_interval(interval, is_correct)
+            self._conn.execute("INSERT OR REPLACE INTO card_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (user_id, deck, card_id, reps + 1, lapses + (not is_correct and reps > 0),
+                                interval, now + interval * 86400, now))
+            self._conn.commit()
+        self.review_log.record(deck, card_id, category, is_correct, response_ms, timestamp=now)
+
+    def stats(self, user_id):
+        # A shared log holds every user's attempts, so each user's stats cost a pass over all of them
+        return self.review_log.stats()
+
+def benchmark(users=100, reviews_per_user=200, stats_every=25, history_per_user=5000,
+              max_open=MAX_OPEN_SHARDS):
+    """
+    Record reviews from many concurrent users into one shared SQLite file and review
+    log, and into per-user shards, and compare the throughput.
+
+    Each simulated user is a thread that answers cards back to back and looks at their
+    statistics every stats_every answers, opening its shard per request as the app does.
+    Every user starts with history_per_user earlier answers in their review log.
+
+    Args:
+        users (int, optional): Concurrent simulated users
+        reviews_per_user (int, optional): Answers each user records
+        history_per_user (int, optional): Earlier answers per user, spread over 60 days
+        stats_every (int, optional): Answers between each user's statistics requests
+        max_open (int, optional): Shards kept open; fewer than users exercises eviction
+
+    Returns:
+        dict: Requests per second and p95 latency per request for each layout, plus the
+            shard manager's counters
+    """
+    def run(record, stats):
+        latencies = []
+        lock = threading.Lock()
+
+        def user(number):
+            rng = random.Random(number)
+            user_id = f"user-{number}"
+            own = []
+            for answered in range(1, reviews_per_user + 1):
+                card_id = rng.randrange(500)
+                start = time.perf_counter()
+                record(user_id, "deck", card_id, f"Deck::Part {card_id % 10}", rng.random() < 0.7,
+                       rng.uniform(800, 6000))
+                if answered % stats_every == 0:
+                    stats(user_id)
+                own.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(own)
+
+        threads = [threading.Thread(target=user, args=(number,)) for number in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        latencies.sort()
+        return {
+            "seconds": round(seconds, 2),
+            "answers_per_second": round(len(latencies) / seconds),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+            "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        }
+
+    def add_history(review_log, number):
+        rng = random.Random(-number)
+        start = time.time() - 60 * 86400
+        for i in range(history_per_user):
+            card_id = rng.randrange(500)
+            review_log.record("deck", card_id, f"Deck::Part {card_id % 10}", rng.random() < 0.7,
+                              rng.uniform(800, 6000), timestamp=start + i * 60 * 86400 / history_per_user)
+        review_log.flush()
+
+    results = {"users": users, "answers": users * reviews_per_user, "stats_every": stats_every,
+               "history_per_user": history_per_user}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        single = _SingleFileState(tmpdir)
+        for number in range(users):
+            add_history(single.review_log, number)
+        results["single_file"] = run(single.record_review, single.stats)
+
+        manager = ShardManager(Path(tmpdir) / "users", max_open=max_open)
+        for number in range(users):
+            with manager.open(f"user-{number}") as shard:
+                add_history(shard.review_log, number)
+
+        def record_sharded(user_id, *args):
+            with manager.open(user_id) as shard:
+                shard.record_review(*args)
+
+        def stats_sharded(user_id):
+            with manager.open(user_id) as shard:
+                shard.review_log.stats()
+
+        results["sharded"] = run(record_sharded, stats_sharded)
+        results["sharded"].update(manager.stats())
+        manager.close_all()
+    return results
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.user_shards
+    print(json.dumps(benchmark(), indent=2))
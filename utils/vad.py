@@ -0,0 +1,241 @@
+import sys
+import wave
+
+import numpy as np
+
+# Analysis frame length
+FRAME_MS = 20
+# A frame is speech when its energy is this far above the noise floor
+SPEECH_MARGIN_DB = 12.0
+# Frames quieter than this are never speech, however low the noise floor gets
+MIN_SPEECH_DBFS = -50.0
+# Quiet frames crossing zero more often than this are treated as hiss, not speech.
+# Loud frames count as speech regardless, so fricatives at the end of a word are kept.
+MAX_SPEECH_ZCR = 0.35
+# How quickly the noise floor rises towards the level of non-speech frames. It drops
+# immediately when the background gets quieter.
+NOISE_FLOOR_RISE = 0.05
+# While the CLI is playing audio, speech must be this much further above the noise floor,
+# and last at least this long, so the speaker's sound picked up by the microphone isn't
+# mistaken for the user talking over it
+ECHO_GATE_DB = 6.0
+ECHO_MIN_SPEECH_MS = 200
+
+def frame_features(samples, frame_length):
+    """
+    Compute per-frame energy and zero-crossing rate in one vectorized pass.
+
+    Args:
+        samples (np.ndarray): int16 PCM samples
+        frame_length (int): Samples per frame. A trailing partial frame is ignored.
+
+    Returns:
+        tuple: (energy_dbfs, zcr) float arrays with one value per frame
+    """
+    n_frames = len(samples) // frame_length
+    frames = samples[:n_frames * frame_length].reshape(n_frames, frame_length).astype(np.float32) / 32768.0
+    energy_dbfs = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    return energy_dbfs, zcr
+
+class Endpointer:
+    """
+    Local voice-activity detector that finds the end of an utterance in streamed PCM16 audio.
+
+    Audio is pushed in whatever chunk size the microphone delivers. Leading silence is held
+    back (apart from a short pre-roll) until speech starts, trailing silence is held back
+    until speech either resumes or is declared over, so only the utterance plus a little
+    padding on each side is ever returned for sending.
+    """
+    def __init__(self, rate=16000, end_silence_ms=400, min_speech_ms=100, padding_ms=200,
+                 margin_db=SPEECH_MARGIN_DB):
+        """
+        Initialize the endpointer.
+
+        Args:
+            rate (int, optional): Sample rate of the PCM16 mono audio
+            end_silence_ms (int, optional): Silence after speech that ends the utterance. None
+                never ends it on silence: pauses are kept, and only flush() ends the utterance.
+            min_speech_ms (int, optional): Continuous speech needed before an utterance starts,
+                so a single click or cough doesn't start one
+            padding_ms (int, optional): Audio kept before the start and after the end of speech
+            margin_db (float, optional): How far above the noise floor speech must be
+        """
+        self.rate = rate
+        self.frame_length = rate * FRAME_MS // 1000
+        self.frame_bytes = self.frame_length * 2
+        self.end_silence_frames = max(1, end_silence_ms // FRAME_MS) if end_silence_ms is not None else None
+        self.min_speech_frames = max(1, min_speech_ms // FRAME_MS)
+        self.padding_bytes = rate * padding_ms // 1000 * 2
+        self.margin_db = margin_db
+        self._base_margin_db = margin_db
+        self._base_min_speech_frames = self.min_speech_frames
+        self.noise_floor = None
+        self.started = False
+        self.ended = False
+        self.speech_frames = 0  # Speech frames seen so far
+        self.frames = 0  # Frames analysed so far
+        self.last_speech_frame = None  # Index of the most recent speech frame
+        self._carry = b""  # Samples that didn't fill a whole frame yet
+        self._pending = bytearray()  # Audio held back: pre-roll before speech, silence after it
+        self._run = 0  # Consecutive speech frames
+        self._silence = 0  # Consecutive silent frames since speech
+
+    def _classify(self, energy_dbfs, zcr):
+        """Mark each frame as speech or not and adapt the noise floor to the rest."""
+        if self.noise_floor is None:
+            self.noise_floor = float(energy_dbfs.min())
+        threshold = max(self.noise_floor + self.margin_db, MIN_SPEECH_DBFS)
+        is_speech = (energy_dbfs > threshold) & ((zcr < MAX_SPEECH_ZCR) | (energy_dbfs > threshold + self.margin_db))
+
+        background = energy_dbfs[~is_speech]
+        if len(background):
+            quietest = float(background.min())
+            if quietest < self.noise_floor:
+                self.noise_floor = quietest
+            else:
+                self.noise_floor += NOISE_FLOOR_RISE * len(background) * (float(background.mean()) - self.noise_floor)
+        return is_speech
+
+    def push(self, chunk):
+        """
+        Analyse the next chunk of audio.
+
+        Args:
+            chunk (bytes): PCM16 mono audio
+
+        Returns:
+            tuple: (audio, ended) where audio is the bytes ready to send (possibly empty) and
+                ended is True once the utterance is over. Audio pushed after that is ignored.
+        """
+        if self.ended:
+            return b"", True
+        data = self._carry + chunk
+        n_frames = len(data) // self.frame_bytes
+        usable = n_frames * self.frame_bytes
+        self._carry = data[usable:]
+        if not n_frames:
+            return b"", False
+
+        energy_dbfs, zcr = frame_features(np.frombuffer(data[:usable], dtype=np.int16), self.frame_length)
+        is_speech = self._classify(energy_dbfs, zcr)
+
+        ready = []
+        frame_bytes = self.frame_bytes
+        for i, speech in enumerate(is_speech.tolist()):
+            self._pending += data[i * frame_bytes:(i + 1) * frame_bytes]
+            if speech:
+                self.speech_frames += 1
+                self.last_speech_frame = self.frames + i
+                self._run += 1
+                self._silence = 0
+                if self.started:
+                    ready.append(bytes(self._pending))
+                    self._pending.clear()
+                elif self._run >= self.min_speech_frames:
+                    self.started = True
+                    ready.append(bytes(self._pending[-(self.padding_bytes + self._run * frame_bytes):]))
+                    self._pending.clear()
+            else:
+                self._run = 0
+                if not self.started:
+                    # Only the pre-roll before speech is worth keeping
+                    del self._pending[:-self.padding_bytes or len(self._pending)]
+                    continue
+                self._silence += 1
+                if self.end_silence_frames is not None and self._silence >= self.end_silence_frames:
+                    ready.append(bytes(self._pending[:self.padding_bytes]))
+                    self._pending.clear()
+                    self.ended = True
+                    break
+        self.frames += n_frames
+        return b"".join(ready), self.ended
+
+    def set_echo_gate(self, active):
+        """
+        Turn the stricter speech detection used during audio playback on or off.
+
+        Args:
+            active (bool): True while audio is playing through the speakers
+        """
+        if active:
+            self.margin_db = self._base_margin_db + ECHO_GATE_DB
+            self.min_speech_frames = max(self._base_min_speech_frames, ECHO_MIN_SPEECH_MS // FRAME_MS)
+        else:
+            self.margin_db = self._base_margin_db
+            self.min_speech_frames = self._base_min_speech_frames
+
+    def flush(self):
+        """
+        End the utterance at the end of the audio pushed so far.
+
+        Returns:
+            bytes: The held-back audio after the last speech, up to the padding, or b'' if
+                speech never started
+        """
+        audio = bytes(self._pending[:self.padding_bytes]) if self.started and not self.ended else b""
+        self._pending.clear()
+        self.ended = True
+        return audio
+
+    def speech_end_seconds(self):
+        """Return the offset of the end of the last speech frame, in seconds, or None."""
+        if self.last_speech_frame is None:
+            return None
+        return (self.last_speech_frame + 1) * FRAME_MS / 1000
+
+def read_wav(path):
+    """
+    Read a 16-bit mono WAV file.
+
+    Args:
+        path (str): Path to the WAV file
+
+    Returns:
+        tuple: (pcm bytes, sample rate)
+    """
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError(f"{path} must be 16-bit mono PCM")
+        return wf.readframes(wf.getnframes()), wf.getframerate()
+
+def trim_silence(pcm, rate=16000, chunk_size=2048, **kwargs):
+    """
+    Trim the leading and trailing silence from a recording.
+
+    Args:
+        pcm (bytes): PCM16 mono audio
+        rate (int, optional): Sample rate
+        chunk_size (int, optional): Samples pushed to the endpointer at a time
+        **kwargs: Further Endpointer settings
+
+    Returns:
+        bytes: The first utterance with its padding, or b'' if no speech was found
+    """
+    endpointer = Endpointer(rate, **kwargs)
+    out = []
+    for start in range(0, len(pcm), chunk_size * 2):
+        audio, ended = endpointer.push(pcm[start:start + chunk_size * 2])
+        out.append(audio)
+        if ended:
+            break
+    else:
+        out.append(endpointer.flush())
+    return b"".join(out)
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.vad recording.wav [...]
+    for path in sys.argv[1:]:
+        pcm, rate = read_wav(path)
+        endpointer = Endpointer(rate)
+        chunk = 2048 * 2
+        for start in range(0, len(pcm), chunk):
+            _, ended = endpointer.push(pcm[start:start + chunk])
+            if ended:
+                detected = (start + chunk) / 2 / rate
+                break
+        else:
+            detected = None
+        trimmed = trim_silence(pcm, rate)
+        print(f"{path}: {len(pcm) / 2 / rate:.2f}s, speech ends at {endpointer.speech_end_seconds()}s, "
+              f"end detected at {detected}s, {len(trimmed) / 2 / rate:.2f}s sent after trimming")
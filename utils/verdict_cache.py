@@ -0,0 +1,301 @@
+import collections
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import dotenv
+
+from .config import DATA_DIR
+
+dotenv.load_dotenv()
+
+# Persistent tier, shared by every student and kept across restarts
+VERDICT_CACHE_PATH = DATA_DIR / "verdicts.sqlite"
+# Verdicts kept in the in-memory tier; older ones are still read from disk
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE") or "10000")
+# Words that only fill pauses in a spoken answer. "er" and "mm" aren't among them: in
+# these decks they are answers (endoplasmic reticulum, millimetres).
+FILLER_WORDS = {"um", "umm", "uh", "uhh", "uhm", "erm", "hmm"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    card_key TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    explanation TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (card_key, prompt_hash, answer)
+);
+"""
+
+VerdictKey = collections.namedtuple("VerdictKey", "card_key prompt_hash answer content_hash")
+
+def _digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode('utf-8')).hexdigest()[:16]
+
+def normalize_answer(text):
+    """
+    Reduce a transcribed answer to the form it is cached under.
+
+    Case, accents written in different Unicode forms, punctuation, filler words and
+    spacing are dropped, so "Mitochondria." and "um, mitochondria" are the same answer.
+    Signs and decimal points in front of digits are kept ("-5", "3.14").
+
+    Args:
+        text (str): The student's answer
+
+    Returns:
+        str: The normalized answer
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = re.sub(r"[^\w\s](?!\d)", " ", text)
+    return " ".join(word for word in text.split() if word not in FILLER_WORDS)
+
+def prompt_hash(evaluation_prompt, answer_feedback_tool):
+    """Hash the evaluation prompt and tool, so changing either starts a fresh set of verdicts."""
+    return _digest(evaluation_prompt, json.dumps(answer_feedback_tool, sort_keys=True))
+
+def verdict_key(card_key, question, correct_answer, user_answer, evaluation_prompt, answer_feedback_tool):
+    """
+    Build the cache key of one evaluation.
+
+    Args:
+        card_key (str): The card, as "deck:card_id"
+        question (str): The card's question
+        correct_answer (str): The card's answer
+        user_answer (str): The student's answer
+        evaluation_prompt (str): The prompt template for evaluation
+        answer_feedback_tool (dict): The tool definition for answer feedback
+
+    Returns:
+        VerdictKey: The key. Its content_hash covers the card's text, so verdicts
+            cached before the card was edited no longer match.
+    """
+    return VerdictKey(card_key, prompt_hash(evaluation_prompt, answer_feedback_tool),
+                      normalize_answer(user_answer), _digest(question, correct_answer))
+
+class VerdictCache:
+    """
+    Two-tier cache of answer verdicts: an LRU dict in memory in front of a SQLite file.
+
+    Verdicts are looked up by (card, prompt hash, normalized answer). Each entry also
+    records a hash of the card's question and answer; an entry whose card text has
+    changed since is treated as a miss and deleted.
+    """
+    def __init__(self, path=None, max_memory=VERDICT_CACHE_SIZE):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path (str or Path, optional): The SQLite file. Defaults to VERDICT_CACHE_PATH.
+            max_memory (int, optional): Verdicts kept in memory
+        """
+        self.path = Path(path or VERDICT_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_memory = max_memory
+        self._memory = collections.OrderedDict()  # {(card_key, prompt_hash, answer): (content_hash, verdict)}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stale": 0, "stored": 0, "invalidated": 0}
+
+    def _remember(self, lookup, content_hash, verdict):
+        # Called with the lock held
+        self._memory[lookup] = (content_hash, verdict)
+        self._memory.move_to_end(lookup)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Look up a verdict.
+
+        Args:
+            key (VerdictKey): See verdict_key
+
+        Returns:
+            dict: A copy of the verdict, with 'is_correct' and optionally 'explanation',
+                or None on a miss. Answers that normalize to nothing always miss.
+        """
+        lookup = key[:3]
+        with self._lock:
+            if not key.answer:
+                self.counts["misses"] += 1
+                return None
+            entry = self._memory.get(lookup)
+            tier = "memory_hits"
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT content_hash, is_correct, explanation FROM verdicts "
+                    "WHERE card_key = ? AND prompt_hash = ? AND answer = ?", lookup
+                ).fetchone()
+                if row is not None:
+                    verdict = {"is_correct": bool(row[1])}
+                    if row[2]:
+                        verdict["explanation"] = row[2]
+                    entry = (row[0], verdict)
+                tier = "disk_hits"
+            if entry is None:
+                self.counts["misses"] += 1
+                return None
+            if entry[0] != key.content_hash:
+                # The card was edited after this verdict was cached
+                self._memory.pop(lookup, None)
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE card_key = ? AND prompt_hash = ? AND answer = ?", lookup
+                )
+                self._conn.commit()
+                self.counts["stale"] += 1
+                self.counts["misses"] += 1
+                return None
+            self._remember(lookup, *entry)
+            self.counts[tier] += 1
+            return dict(entry[1])
+
+    def put(self, key, verdict):
+        """
+        Cache a verdict.
+
+        Args:
+            key (VerdictKey): See verdict_key
+            verdict (dict): The verdict from check_answer. It isn't cached when the
+                answer normalizes to nothing, since that says nothing about the answer.
+        """
+        if not key.answer:
+            return
+        verdict = {"is_correct": bool(verdict["is_correct"]),
+                   **({"explanation": verdict["explanation"]} if verdict.get("explanation") else {})}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, verdict["is_correct"], verdict.get("explanation"), time.time())
+            )
+            self._conn.commit()
+            self._remember(key[:3], key.content_hash, verdict)
+            self.counts["stored"] += 1
+
+    def invalidate(self, card_key):
+        """
+        Drop every cached verdict for a card, e.g. after its text was changed.
+
+        Args:
+            card_key (str): The card, as "deck:card_id"
+
+        Returns:
+            int: Verdicts dropped from the persistent tier
+        """
+        with self._lock:
+            for lookup in [lookup for lookup in self._memory if lookup[0] == card_key]:
+                del self._memory[lookup]
+            dropped = self._conn.execute("DELETE FROM verdicts WHERE card_key = ?", (card_key,)).rowcount
+            self._conn.commit()
+            self.counts["invalidated"] += dropped
+        return dropped
+
+    def stats(self):
+        """
+        Get the cache's counters.
+
+        Returns:
+            dict: Hits per tier, misses (including stale entries), verdicts stored and
+                invalidated, entries in each tier and the hit rate
+        """
+        with self._lock:
+            counts = dict(self.counts)
+            stored = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            in_memory = len(self._memory)
+        hits = counts["memory_hits"] + counts["disk_hits"]
+        lookups = hits + counts["misses"]
+        return {
+            **counts,
+            "memory_entries": in_memory,
+            "disk_entries": stored,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_verdict_cache():
+    """
+    Get the process-wide verdict cache, opening it on first use.
+
+    Returns:
+        VerdictCache: The shared cache
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VerdictCache()
+    return _cache
+
+def simulate(students=200, cards=300, answers=5000, evaluate_seconds=0.8, path=None):
+    """
+    Replay simulated study sessions through the cache and measure what it saves.
+
+    Each answer is to a card picked with a Zipf-like skew (some cards come up far more
+    often), and is one of a few phrasings of that card's common right and wrong answers,
+    as spoken answers are. A miss costs evaluate_seconds, the time of a model call.
+
+    Args:
+        students (int, optional): Simulated students
+        cards (int, optional): Cards in the deck
+        answers (int, optional): Answers evaluated
+        evaluate_seconds (float, optional): Simulated latency of one evaluation call
+        path (str or Path, optional): The SQLite file. Defaults to a temporary file.
+
+    Returns:
+        dict: Hit rate, model calls made, and mean evaluation latency with and without the cache
+    """
+    rng = random.Random(0)
+    weights = [1 / (rank + 1) for rank in range(cards)]
+    phrasings = ["{}", "{}.", "Um, {}", "{}!", "uh {}", "{} "]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = VerdictCache(path or Path(tmpdir) / "verdicts.sqlite", max_memory=1000)
+        latency = 0.0
+        for _ in range(answers):
+            card = rng.choices(range(cards), weights)[0]
+            # Most students give one of a few answers; some give something new
+            if rng.random() < 0.8:
+                answer = rng.choice(phrasings).format(f"answer {rng.randrange(4)} to card {card}")
+            else:
+                answer = f"student {rng.randrange(students)} guess {rng.randrange(10 ** 6)}"
+            key = verdict_key(f"deck:{card}", f"question {card}", f"answer 0 to card {card}", answer,
+                              "evaluation prompt", {"name": "check_answer"})
+            start = time.perf_counter()
+            if cache.get(key) is None:
+                latency += evaluate_seconds
+                cache.put(key, {"is_correct": answer.endswith(f"0 to card {card}"), "explanation": "..."})
+            latency += time.perf_counter() - start
+        stats = cache.stats()
+        cache.close()
+    return {
+        "answers": answers,
+        "hit_rate": stats["hit_rate"],
+        "model_calls": stats["misses"],
+        "mean_latency_ms_without_cache": round(evaluate_seconds * 1000, 1),
+        "mean_latency_ms_with_cache": round(latency / answers * 1000, 1),
+    }
+
+if __name__ == "__main__":
+    # Example usage: python -m utils.verdict_cache
+    print(json.dumps(simulate(), indent=2))
@@ -0,0 +1,169 @@
+import collections
+import os
+import threading
+import time
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Warm the server up in the background at startup; set WARMUP=0 to load decks before
+# serving and skip the rest
+WARMUP = (os.getenv("WARMUP") or "1") != "0"
+# Categories to pre-render questions for, the ones with the most cards to study first
+WARMUP_CATEGORIES = int(os.getenv("WARMUP_CATEGORIES") or "3")
+# Questions pre-rendered per category
+WARMUP_QUESTIONS = int(os.getenv("WARMUP_QUESTIONS") or "2")
+
+class Warmup:
+    """
+    Runs named startup steps one after another on a background thread.
+
+    The server is ready once every step has finished and no required step has failed.
+    Optional steps that fail (e.g. the API is unreachable) are reported, but don't keep
+    the server out of rotation.
+    """
+    def __init__(self):
+        self._steps = []  # [(name, function, required)]
+        self._lock = threading.Lock()
+        self._status = {}  # {name: {'state', 'required', 'seconds', 'detail', 'error'}}
+        self._thread = None
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, name, function, required=False):
+        """
+        Add a step. Steps run in the order they were added.
+
+        Args:
+            name (str): Name of the step, shown in the progress report
+            function (callable): Runs the step; what it returns is reported as its detail
+            required (bool, optional): The server isn't ready if this step fails
+        """
+        self._steps.append((name, function, required))
+        self._status[name] = {"state": "pending", "required": required}
+
+    def _set(self, name, **status):
+        with self._lock:
+            self._status[name].update(status)
+
+    def run(self):
+        """Run every step on the calling thread."""
+        self.started_at = time.time()
+        for name, function, _ in self._steps:
+            self._set(name, state="running")
+            start = time.perf_counter()
+            try:
+                detail = function()
+            except Exception as e:
+                print(f"Warm-up step '{name}' failed: {e}")
+                self._set(name, state="failed", error=str(e), seconds=round(time.perf_counter() - start, 3))
+            else:
+                self._set(name, state="done", detail=detail, seconds=round(time.perf_counter() - start, 3))
+        self.finished_at = time.time()
+        print(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s; ready: {self.ready()}")
+
+    def start(self):
+        """Run the steps on a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def ready(self):
+        """Return True once every step has finished and every required step succeeded."""
+        with self._lock:
+            return all(status["state"] == "done" or (status["state"] == "failed" and not status["required"])
+                       for status in self._status.values())
+
+    def progress(self):
+        """
+        Get the warm-up's progress.
+
+        Returns:
+            dict: 'ready', steps 'done' out of 'total', seconds elapsed, and each step's
+                state, duration and detail or error
+        """
+        with self._lock:
+            steps = {name: dict(status) for name, status in self._status.items()}
+        end = self.finished_at or time.time()
+        return {
+            "ready": self.ready(),
+            "done": sum(status["state"] in ("done", "failed") for status in steps.values()),
+            "total": len(steps),
+            "seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "steps": steps,
+        }
+
+class PrerenderedProblems:
+    """
+    Problems rendered ahead of time (formatted question and speech), served once each.
+
+    A problem is only served while the decks are at the registry version it was
+    rendered for, so a reloaded deck never serves a stale card.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._problems = collections.defaultdict(collections.deque)  # {category: deque of (version, problem)}
+        self.served = 0
+
+    def add(self, category, version, problem):
+        """
+        Keep a rendered problem for a category.
+
+        Args:
+            category (str): The category it was chosen from
+            version (int): The deck registry version it was rendered at
+            problem (dict): The response for /api/start_problem, including 'visual'
+        """
+        with self._lock:
+            self._problems[category].append((version, problem))
+
+    def take(self, category, version, textual_only=False):
+        """
+        Take a rendered problem for a category, if one is left.
+
+        Args:
+            category (str): The requested category
+            version (int): The current deck registry version
+            textual_only (bool, optional): Only take a problem answerable without a picture
+
+        Returns:
+            dict: The problem, or None
+        """
+        with self._lock:
+            queue = self._problems.get(category)
+            if not queue:
+                return None
+            # Stale problems are dropped; ones this request can't use stay for other students
+            kept = [(problem_version, problem) for problem_version, problem in queue if problem_version == version]
+            for i, (_, problem) in enumerate(kept):
+                if not textual_only or problem.get("visual") == "textual":
+                    del kept[i]
+                    queue.clear()
+                    queue.extend(kept)
+                    self.served += 1
+                    return problem
+            queue.clear()
+            queue.extend(kept)
+            return None
+
+    def stats(self):
+        """Get the number of problems waiting per category and served so far."""
+        with self._lock:
+            return {"waiting": {category: len(queue) for category, queue in self._problems.items() if queue},
+                    "served": self.served}
+
+def popular_categories(deck_tree, limit=WARMUP_CATEGORIES):
+    """
+    Pick the top-level categories with the most cards to study.
+
+    Args:
+        deck_tree (list): The registry's deck tree (see DeckRegistry.deck_tree)
+        limit (int, optional): Categories to return
+
+    Returns:
+        list: Category paths, most new and due cards first
+    """
+    ranked = sorted(deck_tree, key=lambda node: (node["counts"]["new"] + node["counts"]["due"],
+                                                 node["counts"]["total"]), reverse=True)
+    return [node["path"] for node in ranked[:limit]]